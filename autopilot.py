@@ -0,0 +1,210 @@
+import threading
+from typing import List, Optional, Tuple
+
+import torch
+from PyQt6.QtCore import QObject, pyqtSignal, pyqtSlot
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+
+from env_config import env_float, env_int
+from genome import expand, genome_nbytes
+from image_manager import BackgroundBatchRender, ImageManager, RenderResult
+
+AUTOPILOT_ENV = "ED_AUTOPILOT"
+AUTOPILOT_BUDGET_S = env_float("ED_AUTOPILOT_BUDGET_S", 600)  # Render seconds per idle period
+AUTOPILOT_POPULATION = env_int("ED_AUTOPILOT_POPULATION", 8)
+AUTOPILOT_BATCH = env_int("ED_AUTOPILOT_BATCH", 2)  # Candidates per background render, smaller yields sooner
+AUTOPILOT_PROMOTE = env_int("ED_AUTOPILOT_PROMOTE", 2)  # Champions shown once the budget is spent
+CROSSOVER_PROBABILITY = 0.7  # Other children are mutated copies of their first parent
+TOURNAMENT_SIZE = 2
+
+
+def _per_row(weights: torch.Tensor, like: torch.Tensor) -> torch.Tensor:
+    """Reshapes one weight per individual to broadcast over a stacked population tensor."""
+    return weights.to(device=like.device, dtype=like.dtype).view(-1, *([1] * (like.dim() - 1)))
+
+
+class Autopilot(QObject):
+    """
+    Evolves a background population while the installation is idle, so the model does not sit unused.
+    The population is seeded with the images on screen and kept as one stacked tensor per embedding. Each
+    generation is bred at once over the whole population: tournament selection, a lerp crossover with a weight per
+    child and sparse mutation of the stacked offspring. Offspring are rendered as low priority background batches,
+    one batch at a time, so interactive renders always go first. The best of parents and offspring survive.
+    Every individual keeps the names of the images on screen it descends from through its first parents, they are
+    recorded as the parents of a promoted champion.
+    Evolution stops when the render budget of the idle period is spent, a render fails or a visitor arrives. Once the
+    budget is spent or a render failed, or on deep idle, the best individuals that beat an image on screen are
+    promoted to it, so the screen never changes under a visitor who just arrived.
+    """
+    budgetSpent = pyqtSignal()  # Emitted from the generation thread, promotes the champions on the main thread
+
+    def __init__(self, image_manager: ImageManager, budget_s: float = AUTOPILOT_BUDGET_S,
+                 population_size: int = AUTOPILOT_POPULATION, batch_size: int = AUTOPILOT_BATCH,
+                 promote: int = AUTOPILOT_PROMOTE):
+        super().__init__()
+        self._image_manager = image_manager
+        self._budget_s = budget_s
+        self._population_size = max(2, population_size)
+        self._batch_size = max(1, batch_size)
+        self._promote = promote
+        self._lock = threading.Lock()
+        self._run = 0  # Incremented on every start and stop, renders of earlier runs are cancelled or discarded
+        self._running = False
+        self._prompt: Optional[torch.Tensor] = None  # Population, stacked along the batch dimension
+        self._pooled: Optional[torch.Tensor] = None
+        self._scores: Optional[torch.Tensor] = None
+        self._results: List[Optional[RenderResult]] = []  # None for individuals taken from the screen
+        self._seeds: List[Tuple[Optional[str], Optional[str]]] = []  # Names of the seed images of each individual
+        self._offspring: Optional[PooledPromptEmbedData] = None
+        self._offspring_results: List[RenderResult] = []
+        self._offspring_seeds: List[Tuple[Optional[str], Optional[str]]] = []
+        self._spent = 0.0
+        self.generations = 0
+        self.budgetSpent.connect(self.promote_champions)
+
+    def start(self):
+        """Seeds the population with the images on screen and the unshown survivors, then starts evolving."""
+        seeds = [(self._image_manager.genome(image), float(image.score), None, (image.name, None))
+                 for image in self._image_manager.images if image.selectable and image.arguments is not None]
+        with self._lock:
+            self._run += 1
+            run = self._run
+            members = seeds + [(PooledPromptEmbedData(self._prompt[index:index + 1], self._pooled[index:index + 1]),
+                                float(self._scores[index]), result, self._seeds[index])
+                               for index, result in enumerate(self._results) if result is not None]
+            if not members:
+                print("Autopilot: no genomes on screen to start from.")
+                return
+            members = sorted(members, key=lambda member: -member[1])[:self._population_size]
+            dtype = seeds[0][0].prompt_embeds.dtype if seeds else self._prompt.dtype
+            self._prompt = torch.cat([expand(genome, dtype).prompt_embeds for genome, _, _, _ in members])
+            self._pooled = torch.cat([expand(genome, dtype).pooled_prompt_embeds for genome, _, _, _ in members])
+            self._scores = torch.tensor([score for _, score, _, _ in members])
+            self._results = [result for _, _, result, _ in members]
+            self._seeds = [seed_names for _, _, _, seed_names in members]
+            self._spent = 0.0
+            self._running = True
+            self._breed()
+            print(f"Autopilot: started with {len(members)} individuals, best score {self._scores.max():.2f}, "
+                  f"budget {self._budget_s:.0f} s")
+        self._schedule_next(run)
+
+    def stop(self):
+        """Cancels queued renders and keeps the offspring rendered so far for the next idle period."""
+        with self._lock:
+            self._run += 1
+            self._running = False
+            self._select()
+
+    def _breed(self):
+        """Creates the next generation of offspring from the whole population at once. Called with the lock held."""
+        count = self._population_size
+        contestants = torch.randint(self._scores.numel(), (2, count, TOURNAMENT_SIZE))
+        parents = contestants.gather(2, self._scores[contestants].argmax(dim=2, keepdim=True)).squeeze(2)
+        weights = torch.rand(count)
+        weights[torch.rand(count) >= CROSSOVER_PROBABILITY] = 1.0  # Exact copy of the first parent
+        first, second = parents[0].to(self._prompt.device), parents[1].to(self._prompt.device)
+        prompt = torch.lerp(self._prompt[second], self._prompt[first], _per_row(weights, self._prompt))
+        pooled = torch.lerp(self._pooled[second], self._pooled[first], _per_row(weights, self._pooled))
+        self._offspring = self._image_manager.mutator.mutate_(PooledPromptEmbedData(prompt, pooled))
+        self._offspring_results = []
+        self._offspring_seeds = []
+        for first_parent, second_parent, weight in zip(parents[0].tolist(), parents[1].tolist(), weights.tolist()):
+            first_seed, second_seed = self._seeds[first_parent][0], self._seeds[second_parent][0]
+            crossed = weight < 1.0 and second_seed != first_seed  # Copies only descend from their first parent
+            self._offspring_seeds.append((first_seed, second_seed if crossed else None))
+
+    def _select(self):
+        """Keeps the best of the population and the offspring rendered so far. Called with the lock held."""
+        if not self._offspring_results:
+            return
+        dtype = self._prompt.dtype
+        genomes = [expand(result.embeds, dtype) for result in self._offspring_results]  # Cached ones may be compact
+        prompt = torch.cat([self._prompt] + [genome.prompt_embeds for genome in genomes])
+        pooled = torch.cat([self._pooled] + [genome.pooled_prompt_embeds for genome in genomes])
+        scores = torch.cat([self._scores, torch.tensor([float(result.score) for result in self._offspring_results])])
+        results = self._results + self._offspring_results
+        seeds = self._seeds + self._offspring_seeds[:len(self._offspring_results)]
+        survivors = scores.topk(min(self._population_size, scores.numel())).indices
+        self._prompt = prompt[survivors.to(prompt.device)]
+        self._pooled = pooled[survivors.to(pooled.device)]
+        self._scores = scores[survivors]
+        self._results = [results[index] for index in survivors.tolist()]
+        self._seeds = [seeds[index] for index in survivors.tolist()]
+        self._offspring_results = []
+
+    def _schedule_next(self, run: int):
+        with self._lock:
+            if run != self._run or not self._running:
+                return
+            if self._spent >= self._budget_s:
+                self._running = False
+                self._select()
+                print(f"Autopilot: budget of {self._budget_s:.0f} s spent after {self.generations} generations, "
+                      f"best score {self._scores.max():.2f}")
+                candidates = None
+            else:
+                start = len(self._offspring_results)
+                end = min(start + self._batch_size, self._population_size)
+                candidates = [PooledPromptEmbedData(self._offspring.prompt_embeds[index:index + 1].clone(),
+                                                    self._offspring.pooled_prompt_embeds[index:index + 1].clone())
+                              for index in range(start, end)]  # Copies, survivors must not keep the whole batch alive
+        if candidates is None:
+            self.budgetSpent.emit()
+            return
+        self._image_manager.schedule_background_render(BackgroundBatchRender(
+            candidates, on_finished=lambda results: self._on_rendered(run, results),
+            is_cancelled=lambda: run != self._run, on_failed=lambda error: self._on_failed(run)))
+
+    def _on_rendered(self, run: int, results: List[RenderResult]):
+        """Called from the generation thread."""
+        with self._lock:
+            if run != self._run:
+                return  # Started before the visitor arrived
+            self._spent += max(result.render_seconds for result in results)  # Shared by the whole batch
+            self._offspring_results.extend(results)
+            if len(self._offspring_results) >= self._population_size:
+                self._select()
+                self.generations += 1
+                print(f"Autopilot: generation {self.generations}, best score {self._scores.max():.2f}, "
+                      f"mean {self._scores.mean():.2f} ({self._spent:.0f} of {self._budget_s:.0f} s budget)")
+                self._breed()
+        self._schedule_next(run)
+
+    def _on_failed(self, run: int):
+        """Called from the generation thread. Ends the run instead of retrying a render that may keep failing."""
+        with self._lock:
+            if run != self._run or not self._running:
+                return
+            self._running = False
+            self._select()
+            print(f"Autopilot: render failed, stopping after {self.generations} generations, "
+                  f"best score {self._scores.max():.2f}")
+        self.budgetSpent.emit()
+
+    @pyqtSlot()
+    def promote_champions(self):
+        """Shows the best rendered individuals that score higher than the lowest scoring image on screen."""
+        shown = [float(image.score) for image in self._image_manager.images if image.selectable]
+        threshold = min(shown) if shown else float("-inf")
+        with self._lock:
+            ranked = sorted((index for index, result in enumerate(self._results)
+                             if result is not None and float(result.score) > threshold),
+                            key=lambda index: -float(self._results[index].score))[:self._promote]
+            champions = [(self._results[index], self._seeds[index]) for index in ranked]
+            for index in ranked:
+                self._results[index] = None  # Shown now, seeded from the screen next time
+        for champion, seed_names in champions:
+            self._image_manager.promote_image(champion, seed_names)
+
+    def memory_usage(self) -> int:
+        """Estimated bytes of the population, the offspring and their images, for the memory report."""
+        with self._lock:
+            tensors = [tensor for tensor in (self._prompt, self._pooled) if tensor is not None]
+            size = sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+            if self._offspring is not None:
+                size += genome_nbytes(self._offspring)
+            for result in self._results + self._offspring_results:
+                if result is not None:
+                    size += result.image.width * result.image.height * len(result.image.getbands())
+            return size
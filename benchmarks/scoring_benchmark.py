@@ -0,0 +1,55 @@
+"""
+Compares the AestheticsImageEvaluator with the optimized CPU predictor (int8 dynamic quantization, traced graph,
+tuned thread count) on the bundled test images. Reports latency per image and the score differences.
+
+Run from the repository root: python -m benchmarks.scoring_benchmark [iterations]
+"""
+import sys
+import time
+
+from evolutionary_imaging.evaluators import AestheticsImageEvaluator
+
+from scoring import ImageScorer, OptimizedPredictor, calibration_images, find_predictor, OPTIMIZED_SCORING_TOLERANCE
+
+BATCH_SIZES = [1, 4]
+
+
+def seconds_per_image(score, images, iterations: int) -> float:
+    score(images)  # Warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        score(images)
+    return (time.perf_counter() - start) / (iterations * len(images))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    evaluator = AestheticsImageEvaluator(device="cpu")
+    model, processor = find_predictor(evaluator)
+    if model is None or processor is None:
+        print("The evaluator does not expose its predictor, nothing to compare.")
+        return
+    images = calibration_images()
+    scorer = ImageScorer(evaluator)  # Without ED_OPTIMIZED_SCORING, the evaluator one image at a time
+    optimized = OptimizedPredictor(model, processor, images)
+
+    expected = [scorer.evaluate_single(image) for image in images]
+    actual = [optimized.predict([image])[0] for image in images]
+    for index, (a, b) in enumerate(zip(expected, actual), start=1):
+        print(f"test{index}.png: evaluator {a:.4f}, optimized {b:.4f}, difference {abs(a - b):.4f}")
+    difference = max(abs(a - b) for a, b in zip(expected, actual))
+    print(f"Maximum difference {difference:.4f}, tolerance {OPTIMIZED_SCORING_TOLERANCE}: "
+          f"{'within' if difference <= OPTIMIZED_SCORING_TOLERANCE else 'EXCEEDED'}")
+
+    for batch_size in BATCH_SIZES:
+        batch = (images * batch_size)[:batch_size]
+        evaluator_seconds = seconds_per_image(lambda batch: [scorer.evaluate_single(image) for image in batch],
+                                              batch, iterations)
+        optimized_seconds = seconds_per_image(optimized.predict, batch, iterations)
+        print(f"Batch {batch_size}: evaluator {evaluator_seconds * 1000:.1f} ms/image, "
+              f"optimized {optimized_seconds * 1000:.1f} ms/image ({optimized.threads} threads), "
+              f"{evaluator_seconds / optimized_seconds:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
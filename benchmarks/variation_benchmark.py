@@ -0,0 +1,110 @@
+"""
+Compares the project's variation operators with the evolutionary_prompt_embedding ones on SDXL Turbo sized genomes.
+Reports time and allocated memory per operation, and checks that both behave the same statistically.
+
+Run from the repository root: python -m benchmarks.variation_benchmark [iterations]
+"""
+import sys
+import time
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+from evolutionary_prompt_embedding.value_ranges import SDXLTurboEmbeddingRange, SDXLTurboPooledEmbeddingRange
+from evolutionary_prompt_embedding.variation import \
+    UniformGaussianMutatorArguments, PooledUniformGaussianMutator, PooledArithmeticCrossover
+
+from image_manager import MUTATION_RATE, MUTATION_STRENGTH
+from variation import PooledLerpCrossover, PooledSparseMutator, SparseGaussianMutation
+
+WEIGHT = 0.4
+
+
+def synchronize(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def time_per_operation(operation, iterations: int, device: torch.device) -> float:
+    operation()  # Warm up, allocates buffers
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        operation()
+    synchronize(device)
+    return (time.perf_counter() - start) / iterations
+
+
+def allocated_bytes(operation, device: torch.device) -> int:
+    """Sum of all allocations made by one operation, including temporaries freed again."""
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if device.type == "cuda" else [])
+    with profile(activities=activities, profile_memory=True) as profiler:
+        operation()
+    attribute = "self_cpu_memory_usage" if device.type != "cuda" else "self_device_memory_usage"
+    return sum(max(getattr(event, attribute, 0) or 0, 0) for event in profiler.events())
+
+
+def mutation_statistics(mutate, parent: PooledPromptEmbedData, samples: int = 50):
+    """Fraction of mutated elements and standard deviation of the changes in the prompt embedding."""
+    changed, deltas = 0, []
+    for _ in range(samples):
+        delta = (mutate(parent).prompt_embeds - parent.prompt_embeds).flatten()
+        mask = delta != 0
+        changed += mask.sum().item()
+        deltas.append(delta[mask].float().cpu())
+    deltas = torch.cat(deltas)
+    return changed / (samples * parent.prompt_embeds.numel()), deltas.std().item()
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    embedding_range = SDXLTurboEmbeddingRange()
+    pooled_range = SDXLTurboPooledEmbeddingRange()
+    parent1 = PooledPromptEmbedData(embedding_range.random_tensor_in_range(), pooled_range.random_tensor_in_range())
+    parent2 = PooledPromptEmbedData(embedding_range.random_tensor_in_range(), pooled_range.random_tensor_in_range())
+    device = parent1.prompt_embeds.device
+    print(f"Genome: {tuple(parent1.prompt_embeds.shape)} + {tuple(parent1.pooled_prompt_embeds.shape)} "
+          f"{parent1.prompt_embeds.dtype} on {device}, {iterations} iterations")
+
+    clamp = (embedding_range.minimum, embedding_range.maximum)
+    clamp_pooled = (pooled_range.minimum, pooled_range.maximum)
+    library_mutator = PooledUniformGaussianMutator(
+        UniformGaussianMutatorArguments(mutation_rate=MUTATION_RATE, mutation_strength=MUTATION_STRENGTH,
+                                        clamp_range=clamp),
+        UniformGaussianMutatorArguments(mutation_rate=MUTATION_RATE, mutation_strength=MUTATION_STRENGTH,
+                                        clamp_range=clamp_pooled))
+    sparse_mutator = PooledSparseMutator(SparseGaussianMutation(MUTATION_RATE, MUTATION_STRENGTH, clamp),
+                                         SparseGaussianMutation(MUTATION_RATE, MUTATION_STRENGTH, clamp_pooled))
+    crossover = PooledLerpCrossover()
+
+    operations = {
+        "mutation": (lambda: library_mutator.mutate(parent1), lambda: sparse_mutator.mutate(parent1)),
+        "crossover": (lambda: PooledArithmeticCrossover(interpolation_weight=WEIGHT, interpolation_weight_pooled=WEIGHT)
+                      .crossover(parent1, parent2),
+                      lambda: crossover.crossover(parent1, parent2, WEIGHT)),
+    }
+    for name, (library_operation, project_operation) in operations.items():
+        library_seconds = time_per_operation(library_operation, iterations, device)
+        project_seconds = time_per_operation(project_operation, iterations, device)
+        library_bytes = allocated_bytes(library_operation, device)
+        project_bytes = allocated_bytes(project_operation, device)
+        print(f"{name:>9}: library {library_seconds * 1000:.3f} ms, {library_bytes / 2 ** 20:.2f} MiB | "
+              f"project {project_seconds * 1000:.3f} ms, {project_bytes / 2 ** 20:.2f} MiB | "
+              f"{library_seconds / project_seconds:.1f}x faster, "
+              f"{(library_bytes - project_bytes) / 2 ** 20:.2f} MiB less allocated")
+
+    library_rate, library_std = mutation_statistics(library_mutator.mutate, parent1)
+    project_rate, project_std = mutation_statistics(sparse_mutator.mutate, parent1)
+    print(f"Mutation statistics (expected rate {MUTATION_RATE}, strength {MUTATION_STRENGTH}): "
+          f"library rate {library_rate:.5f} std {library_std:.6f} | project rate {project_rate:.5f} std {project_std:.6f}")
+    library_child = PooledArithmeticCrossover(interpolation_weight=WEIGHT, interpolation_weight_pooled=WEIGHT) \
+        .crossover(parent1, parent2)
+    project_child = crossover.crossover(parent1, parent2, WEIGHT)
+    difference = (library_child.prompt_embeds - project_child.prompt_embeds).abs().max().item()
+    print(f"Crossover maximum difference to library: {difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
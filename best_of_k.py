@@ -0,0 +1,61 @@
+from typing import Dict
+
+from env_config import env_float, env_int
+
+BEST_OF_K_ENV = "ED_BEST_OF_K"
+BEST_OF_K_MAX = env_int("ED_BEST_OF_K_MAX", 4)
+BEST_OF_K_TARGET_S = env_float("ED_BEST_OF_K_TARGET_S", 4.0)
+LATENCY_SMOOTHING = 0.3  # Weight of the newest measurement in the moving average
+
+
+class BatchSizeTuner:
+    """
+    Chooses how many candidates K to render per operation, so the visible latency stays within the target.
+    Keeps a moving average of the measured batch latency per K. K grows when the next size is predicted to fit
+    (measured, or extrapolated linearly from the current size) and shrinks when the current size is too slow.
+    """
+
+    def __init__(self, target_seconds: float = BEST_OF_K_TARGET_S, max_k: int = BEST_OF_K_MAX):
+        self._target = target_seconds
+        self._max_k = max(1, max_k)
+        self._k = 1
+        self._latency: Dict[int, float] = {}
+
+    @property
+    def k(self) -> int:
+        return self._k
+
+    @property
+    def max_k(self) -> int:
+        return self._max_k
+
+    def set_max_k(self, max_k: int):
+        self._max_k = max(1, max_k)
+        if self._k > self._max_k:
+            self._change_k(self._max_k, "limit lowered")
+
+    def predicted_latency(self, k: int) -> float | None:
+        if k in self._latency:
+            return self._latency[k]
+        measured = [size for size in self._latency if size < k]
+        if not measured:
+            return None
+        size = max(measured)
+        return self._latency[size] * k / size  # Conservative, batching is usually cheaper than linear
+
+    def record(self, k: int, seconds: float):
+        previous = self._latency.get(k)
+        self._latency[k] = seconds if previous is None else \
+            LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * previous
+        if k != self._k:
+            return
+        if self._latency[k] > self._target and k > 1:
+            self._change_k(k - 1, f"{self._latency[k]:.2f} s above target")
+        elif k < self._max_k:
+            predicted = self.predicted_latency(k + 1)
+            if predicted is not None and predicted <= self._target:
+                self._change_k(k + 1, f"predicted {predicted:.2f} s within target")
+
+    def _change_k(self, k: int, reason: str):
+        print(f"Best-of-K: K {self._k} -> {k} ({reason}, target {self._target:.2f} s)")
+        self._k = k
@@ -0,0 +1,29 @@
+import os
+
+
+def is_env_enabled(value: str | None) -> bool:
+    """Parses common truthy environment variable values."""
+    if value is None:
+        return False
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def env_flag(name: str) -> bool:
+    """Returns True when the environment variable is set to a truthy value."""
+    return is_env_enabled(os.environ.get(name))
+
+
+def env_int(name: str, default: int) -> int:
+    """Reads an integer environment variable, falling back to the default when unset or empty."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def env_float(name: str, default: float) -> float:
+    """Reads a float environment variable, falling back to the default when unset or empty."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
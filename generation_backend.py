@@ -0,0 +1,149 @@
+import io
+import os
+from typing import List, Tuple
+
+import requests
+import torch
+from PIL import Image
+from evolutionary_imaging.evaluators import AestheticsImageEvaluator
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+from evolutionary_prompt_embedding.image_creation import SDXLPromptEmbeddingImageCreator
+
+from env_config import env_float
+from image_history import genome_from_tensors, genome_to_tensors
+from scoring import ImageScorer
+
+GENERATION_SERVICE_URL_ENV = "ED_GENERATION_SERVICE_URL"
+GENERATION_SERVICE_CONNECT_TIMEOUT_S = 3
+GENERATION_SERVICE_READ_TIMEOUT_S = env_float("ED_GENERATION_SERVICE_TIMEOUT_S", 120)
+CONTENT_TYPE = "application/octet-stream"
+
+
+def pack(payload: dict) -> bytes:
+    """Serializes a payload of tensors, numbers and strings for the generation service."""
+    buffer = io.BytesIO()
+    torch.save(payload, buffer)
+    return buffer.getvalue()
+
+
+def unpack(data: bytes, device: torch.device = None) -> dict:
+    return torch.load(io.BytesIO(data), map_location=device, weights_only=True)
+
+
+def image_to_tensor(image: Image.Image) -> torch.Tensor:
+    """Encodes an image as png bytes in a uint8 tensor."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return torch.frombuffer(bytearray(buffer.getvalue()), dtype=torch.uint8)
+
+
+def image_from_tensor(tensor: torch.Tensor) -> Image.Image:
+    with Image.open(io.BytesIO(tensor.numpy().tobytes())) as image:
+        image.load()
+        return image.copy()
+
+
+def embeds_to_payload(embeds: PooledPromptEmbedData) -> dict:
+    return genome_to_tensors(embeds)
+
+
+def embeds_from_payload(tensors: dict, device: torch.device = None) -> PooledPromptEmbedData:
+    return genome_from_tensors(tensors, device)
+
+
+class LocalGenerationBackend:
+    """Renders and scores images with the SDXL Turbo pipeline and aesthetic predictor in this process."""
+
+    def __init__(self):
+        self.imageCreator = SDXLPromptEmbeddingImageCreator(inference_steps=3, batch_size=1, deterministic=True)
+        self.evaluator = AestheticsImageEvaluator(device="cpu")  # Force CPU for windows compatibility, CUDA causes errors
+        self.scorer = ImageScorer(self.evaluator)
+
+    def render(self, candidates: List[PooledPromptEmbedData], background: bool = False) -> Tuple[list, List[float], bool]:
+        """
+        Creates the images for all candidates in a single diffusion pass and scores them in one batch.
+        Returns the images, their scores and whether the image was rendered on its own, which is reproducible.
+        """
+        if len(candidates) == 1:
+            image_data = self.imageCreator.create_solution(candidates[0])
+            images = image_data.result.images[:1]
+            scores = self.scorer.score(images) if self.scorer.optimized else [self.evaluator.evaluate(image_data.result)]
+            return images, scores, True
+        batch = PooledPromptEmbedData(torch.cat([embeds.prompt_embeds for embeds in candidates]),
+                                      torch.cat([embeds.pooled_prompt_embeds for embeds in candidates]))
+        images = self.imageCreator.create_solution(batch).result.images
+        return images, self.scorer.score(images), False
+
+    def score(self, images) -> List[float]:
+        return self.scorer.score(images)
+
+    def prompt_embeds(self, prompt: str, device: torch.device = None) -> PooledPromptEmbedData:
+        return self.imageCreator.arguments_from_prompt(prompt)
+
+    def render_config(self) -> str:
+        """Everything besides the genome that determines the rendered image."""
+        options = {name: getattr(self.imageCreator, name, getattr(self.imageCreator, f"_{name}", None))
+                   for name in ("model_id", "inference_steps", "height", "width")}
+        options["scorer"] = "optimized" if self.scorer.optimized else "evaluator"  # Cached scores depend on it
+        return type(self.imageCreator).__name__ + "".join(f" {name}={value}" for name, value in options.items())
+
+    def set_option(self, name: str, value) -> bool:
+        """Sets an option of the image creator, which only takes them in its constructor, by attribute."""
+        for attribute in (name, f"_{name}"):
+            if hasattr(self.imageCreator, attribute):
+                try:
+                    setattr(self.imageCreator, attribute, value)
+                    return True
+                except AttributeError:  # Read-only property
+                    continue
+        return False
+
+
+class RemoteGenerationBackend:
+    """
+    Renders and scores images through a generation service (see generation_service.py), so the kiosk needs no
+    diffusion capable hardware. Mutation and crossover stay local, they are cheap and need no model.
+    """
+
+    def __init__(self, url: str):
+        self._url = url.rstrip("/")
+        self._session = requests.Session()
+        self._render_config = None
+
+    def _post(self, path: str, payload: dict, device: torch.device = None) -> dict:
+        response = self._session.post(f"{self._url}{path}", data=pack(payload),
+                                      headers={"Content-Type": CONTENT_TYPE},
+                                      timeout=(GENERATION_SERVICE_CONNECT_TIMEOUT_S, GENERATION_SERVICE_READ_TIMEOUT_S))
+        response.raise_for_status()
+        return unpack(response.content, device)
+
+    def render(self, candidates: List[PooledPromptEmbedData], background: bool = False) -> Tuple[list, List[float], bool]:
+        response = self._post("/generate", {"candidates": [embeds_to_payload(embeds) for embeds in candidates],
+                                            "background": background})
+        self._render_config = response["render_config"]
+        return [image_from_tensor(image) for image in response["images"]], response["scores"], response["solo"]
+
+    def score(self, images) -> List[float]:
+        return self._post("/score", {"images": [image_to_tensor(image) for image in images]})["scores"]
+
+    def prompt_embeds(self, prompt: str, device: torch.device = None) -> PooledPromptEmbedData:
+        return embeds_from_payload(self._post("/prompt", {"prompt": prompt}, device)["genome"], device)
+
+    def render_config(self) -> str:
+        if self._render_config is None:
+            response = self._session.get(f"{self._url}/config", timeout=GENERATION_SERVICE_CONNECT_TIMEOUT_S)
+            response.raise_for_status()
+            self._render_config = unpack(response.content)["render_config"]
+        return self._render_config
+
+    def set_option(self, name: str, value) -> bool:
+        return False  # Render options are owned by the service
+
+
+def create_backend():
+    """Uses the generation service when ED_GENERATION_SERVICE_URL is set, otherwise renders locally."""
+    url = os.environ.get(GENERATION_SERVICE_URL_ENV)
+    if url:
+        print(f"Using generation service at {url}")
+        return RemoteGenerationBackend(url)
+    return LocalGenerationBackend()
@@ -0,0 +1,197 @@
+"""
+Generation service, lets one machine render and score images for several kiosks.
+Start it with `python generation_service.py` and point the kiosks to it with ED_GENERATION_SERVICE_URL.
+Requests and responses are torch-serialized dicts, images are transferred as png bytes in uint8 tensors.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from dotenv import load_dotenv
+load_dotenv()  # Load environment variables from .env file, needed in other modules
+
+from diffusers.utils import logging
+from evolutionary_prompt_embedding.value_ranges import SDXLTurboEmbeddingRange, SDXLTurboPooledEmbeddingRange
+
+from env_config import env_int
+from generation_backend import CONTENT_TYPE, LocalGenerationBackend, embeds_from_payload, embeds_to_payload, \
+    image_from_tensor, image_to_tensor, pack, unpack
+from image_manager import MUTATION_RATE, MUTATION_STRENGTH
+from variation import PooledLerpCrossover, pooled_sparse_mutator
+
+SERVICE_HOST = os.environ.get("ED_GENERATION_SERVICE_HOST", "127.0.0.1")  # Only reachable locally by default
+SERVICE_PORT = env_int("ED_GENERATION_SERVICE_PORT", 8765)
+SERVICE_MAX_BATCH = env_int("ED_GENERATION_SERVICE_MAX_BATCH", 4)  # Candidates rendered in one diffusion pass
+SERVICE_BATCH_WAIT_MS = env_int("ED_GENERATION_SERVICE_BATCH_WAIT_MS", 20)  # Time other kiosks get to join a batch
+MAX_MUTATIONS_PER_REQUEST = 16
+
+
+class RenderRequest:
+    def __init__(self, candidates, background: bool):
+        self.candidates = candidates
+        self.background = background
+        self.future = Future()
+
+
+class BatchingRenderer:
+    """
+    Renders the requests of all kiosks on one worker thread, combining them into shared diffusion batches.
+    Interactive requests go before background ones, otherwise requests are served in arrival order.
+    A request is always rendered as a whole, one larger than the batch limit is rendered on its own.
+    """
+
+    def __init__(self, backend: LocalGenerationBackend, max_batch: int = SERVICE_MAX_BATCH,
+                 batch_wait_ms: int = SERVICE_BATCH_WAIT_MS):
+        self._backend = backend
+        self._max_batch = max(1, max_batch)
+        self._batch_wait_s = batch_wait_ms / 1000
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self.backend_lock = threading.Lock()  # Prompt encoding and scoring requests share the models
+        self.batches = 0
+        self.requests = 0
+        threading.Thread(target=self._run, name="BatchingRenderer", daemon=True).start()
+
+    def submit(self, candidates, background: bool) -> Future:
+        request = RenderRequest(candidates, background)
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify()
+        return request.future
+
+    def _pending_candidates(self) -> int:
+        return sum(len(request.candidates) for request in self._pending)
+
+    def _next_batch(self) -> List[RenderRequest]:
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self._batch_wait_s
+            while self._pending_candidates() < self._max_batch and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            batch, size = [], 0
+            for request in sorted(self._pending, key=lambda pending: pending.background):  # Stable, keeps arrival order
+                if batch and size + len(request.candidates) > self._max_batch:
+                    continue
+                batch.append(request)
+                size += len(request.candidates)
+            for request in batch:
+                self._pending.remove(request)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            candidates = [embeds for request in batch for embeds in request.candidates]
+            try:
+                with self.backend_lock:
+                    images, scores, solo = self._backend.render(candidates)
+            except Exception as e:
+                print("Exception in generation service render:", e)
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            if len(batch) > 1:
+                print(f"Rendered {len(batch)} requests in one batch of {len(candidates)} "
+                      f"({self.requests} requests in {self.batches} batches)")
+            offset = 0
+            for request in batch:
+                count = len(request.candidates)
+                request.future.set_result((images[offset:offset + count], scores[offset:offset + count], solo))
+                offset += count
+
+
+class GenerationService(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = SERVICE_HOST, port: int = SERVICE_PORT):
+        super().__init__((host, port), GenerationRequestHandler)
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"  # Avoids warning from transformers
+        logging.disable_progress_bar()
+        logging.set_verbosity_error()
+        self.backend = LocalGenerationBackend()
+        self.renderer = BatchingRenderer(self.backend)
+        embedding_range = SDXLTurboEmbeddingRange()
+        pooled_embedding_range = SDXLTurboPooledEmbeddingRange()
+        self.device = embedding_range.random_tensor_in_range().device
+        self.mutator = pooled_sparse_mutator(MUTATION_RATE, MUTATION_STRENGTH, embedding_range, pooled_embedding_range)
+        self.crossover = PooledLerpCrossover()
+
+    def generate(self, payload: dict) -> dict:
+        candidates = [embeds_from_payload(embeds, self.device) for embeds in payload["candidates"]]
+        images, scores, solo = self.renderer.submit(candidates, bool(payload.get("background", False))).result()
+        return {"images": [image_to_tensor(image) for image in images], "scores": scores, "solo": solo,
+                "render_config": self.backend.render_config()}
+
+    def mutate(self, payload: dict) -> dict:
+        genome = embeds_from_payload(payload["genome"], self.device)
+        count = min(int(payload.get("count", 1)), MAX_MUTATIONS_PER_REQUEST)
+        return {"genomes": [embeds_to_payload(self.mutator.mutate(genome)) for _ in range(count)]}
+
+    def crossover_genomes(self, payload: dict) -> dict:
+        child = self.crossover.crossover(embeds_from_payload(payload["genome1"], self.device),
+                                         embeds_from_payload(payload["genome2"], self.device),
+                                         float(payload["weight"]))
+        return {"genome": embeds_to_payload(child)}
+
+    def score(self, payload: dict) -> dict:
+        images = [image_from_tensor(image) for image in payload["images"]]
+        with self.renderer.backend_lock:
+            return {"scores": self.backend.score(images)}
+
+    def prompt(self, payload: dict) -> dict:
+        with self.renderer.backend_lock:
+            return {"genome": embeds_to_payload(self.backend.prompt_embeds(str(payload["prompt"])))}
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    server: GenerationService
+
+    def _respond(self, payload: dict):
+        data = pack(payload)
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/config":
+            self.send_error(404)
+            return
+        self._respond({"render_config": self.server.backend.render_config()})
+
+    def do_POST(self):
+        operations = {"/generate": self.server.generate, "/mutate": self.server.mutate,
+                      "/crossover": self.server.crossover_genomes, "/score": self.server.score,
+                      "/prompt": self.server.prompt}
+        operation = operations.get(self.path)
+        if operation is None:
+            self.send_error(404)
+            return
+        try:
+            payload = unpack(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            response = operation(payload)
+        except Exception as e:
+            print(f"Exception in generation service {self.path}:", e)
+            self.send_error(500, str(e))
+            return
+        self._respond(response)
+
+    def log_request(self, code="-", size="-"):
+        pass  # Errors are still logged, successful requests would flood the output
+
+
+if __name__ == '__main__':
+    service = GenerationService()
+    print(f"Generation service listening on http://{SERVICE_HOST}:{SERVICE_PORT}")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.server_close()
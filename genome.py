@@ -0,0 +1,66 @@
+import os
+
+import torch
+from PIL import ImageChops
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+
+GENOME_DTYPE_ENV = "ED_GENOME_DTYPE"
+GENOME_VERIFY_ENV = "ED_GENOME_VERIFY"
+STORAGE_DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+def _storage_dtype(name: str) -> torch.dtype:
+    dtype = STORAGE_DTYPES.get(name.strip().lower())
+    if dtype is None:
+        raise ValueError(f"{GENOME_DTYPE_ENV} must be one of {', '.join(STORAGE_DTYPES)}, got '{name}'")
+    return dtype
+
+
+GENOME_STORAGE_DTYPE = _storage_dtype(os.environ.get(GENOME_DTYPE_ENV) or "float32")
+
+
+def _compact_tensor(tensor: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    return tensor.to(dtype) if tensor.dtype.itemsize > dtype.itemsize else tensor  # Never widens
+
+
+def compact(embeds: PooledPromptEmbedData, dtype: torch.dtype = GENOME_STORAGE_DTYPE) -> PooledPromptEmbedData:
+    """Returns the genome in the storage dtype, or the genome itself if it is not wider than that."""
+    prompt_embeds = _compact_tensor(embeds.prompt_embeds, dtype)
+    pooled_prompt_embeds = _compact_tensor(embeds.pooled_prompt_embeds, dtype)
+    if prompt_embeds is embeds.prompt_embeds and pooled_prompt_embeds is embeds.pooled_prompt_embeds:
+        return embeds
+    return PooledPromptEmbedData(prompt_embeds, pooled_prompt_embeds)
+
+
+def expand(embeds: PooledPromptEmbedData, dtype: torch.dtype) -> PooledPromptEmbedData:
+    """Upcasts a stored genome to the dtype used by the image creator and variation operators."""
+    if embeds.prompt_embeds.dtype == dtype and embeds.pooled_prompt_embeds.dtype == dtype:
+        return embeds
+    return PooledPromptEmbedData(embeds.prompt_embeds.to(dtype), embeds.pooled_prompt_embeds.to(dtype))
+
+
+def genome_nbytes(embeds: PooledPromptEmbedData) -> int:
+    return sum(tensor.numel() * tensor.element_size()
+               for tensor in (embeds.prompt_embeds, embeds.pooled_prompt_embeds))
+
+
+class GenomeVerifier:
+    """
+    Compares images rendered from full precision genomes with renders of their upcast stored form, to check that
+    the storage dtype does not change the output. Keeps counts over the session and logs every comparison.
+    """
+
+    def __init__(self):
+        self.identical = 0
+        self.different = 0
+
+    def compare(self, name: str, original_image, original_score: float, image, score: float):
+        difference = ImageChops.difference(original_image.convert("RGB"), image.convert("RGB"))
+        if difference.getbbox() is None:
+            self.identical += 1
+            print(f"Genome verification {name}: identical render ({self.identical} identical, {self.different} different)")
+            return
+        self.different += 1
+        max_difference = max(high for _, high in difference.getextrema())
+        print(f"Genome verification {name}: render differs, maximum pixel difference {max_difference}, "
+              f"score {original_score:.4f} -> {score:.4f} ({self.identical} identical, {self.different} different)")
@@ -0,0 +1,287 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QObject, QRunnable, QSize, QThreadPool, pyqtSignal, \
+    pyqtSlot, QDateTime
+from PyQt6.QtGui import QImage, QImageReader, QPixmap, QColor
+from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QListView, QComboBox, QPushButton, \
+    QLabel, QAbstractItemView
+
+from image_history import HistoryRecord
+from image_manager import ImageManager
+from image_window import format_image_name
+from storage_manager import resolve_image_path, restore_png
+
+THUMBNAIL_SIZE = 128
+THUMBNAIL_CACHE_SIZE = 600  # Roughly a few screens full of thumbnails
+MAX_PENDING_THUMBNAILS = 200
+SORT_NEWEST = "Newest first"
+SORT_OLDEST = "Oldest first"
+SORT_SCORE = "Highest score"
+SORT_SCORE_ASCENDING = "Lowest score"
+SORT_OPTIONS = [SORT_NEWEST, SORT_OLDEST, SORT_SCORE, SORT_SCORE_ASCENDING]
+
+
+class ThumbnailSignals(QObject):
+    loaded = pyqtSignal(str, QImage)
+
+
+class RecordsSignals(QObject):
+    loaded = pyqtSignal(int, object)  # Load generation, list of HistoryRecord
+
+
+class RecordsTask(QRunnable):
+    """Reads the history records off the GUI thread, dropping those whose image no longer exists."""
+
+    def __init__(self, image_manager: ImageManager, generation: int, signals: RecordsSignals):
+        super().__init__()
+        self._image_manager = image_manager
+        self._generation = generation
+        self._signals = signals
+
+    def run(self):
+        # Images evicted before their record was removed cannot be shown or restored
+        records = [record for record in self._image_manager.history.records()
+                   if resolve_image_path(record.name) is not None]
+        self._signals.loaded.emit(self._generation, records)
+
+
+class ThumbnailTask(QRunnable):
+    """Decodes a thumbnail off the GUI thread. Skipped if it was no longer wanted by the time it runs."""
+
+    def __init__(self, name: str, signals: ThumbnailSignals, pending: 'OrderedDict[str, None]'):
+        super().__init__()
+        self._name = name
+        self._signals = signals
+        self._pending = pending
+
+    def run(self):
+        if self._name not in self._pending:
+            return
+        path = resolve_image_path(self._name)
+        image = QImage()
+        if path is not None:
+            reader = QImageReader(path)
+            reader.setScaledSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))  # Lets decoders skip work where supported
+            image = reader.read()
+        self._signals.loaded.emit(self._name, image)
+
+
+class HistoryModel(QAbstractListModel):
+    """
+    List model over all history records. Thumbnails are loaded lazily when the view asks for them, decoded in a
+    thread pool and kept in a bounded LRU cache, so memory stays flat regardless of the archive size.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._all_records: List[HistoryRecord] = []
+        self._records: List[HistoryRecord] = []
+        self._rows: Dict[str, int] = {}
+        self._thumbnails: 'OrderedDict[str, QPixmap]' = OrderedDict()
+        self._pending: 'OrderedDict[str, None]' = OrderedDict()
+        self._placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self._placeholder.fill(QColor("#d0d0d0"))
+        self._signals = ThumbnailSignals()
+        self._signals.loaded.connect(self._on_thumbnail_loaded)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+
+    def set_records(self, records: List[HistoryRecord]):
+        self._all_records = records
+
+    def all_records(self) -> List[HistoryRecord]:
+        return self._all_records
+
+    def show_records(self, records: List[HistoryRecord]):
+        self.beginResetModel()
+        self._records = records
+        self._rows = {record.name: row for row, record in enumerate(records)}
+        self._pending.clear()
+        self.endResetModel()
+
+    def record(self, index: QModelIndex) -> Optional[HistoryRecord]:
+        return self._records[index.row()] if index.isValid() else None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._records)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self._records[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{format_image_name(record.name)}\n{record.score:.2f}"
+        if role == Qt.ItemDataRole.DecorationRole:
+            return self._thumbnail(record.name)
+        if role == Qt.ItemDataRole.ToolTipRole:
+            created = QDateTime.fromSecsSinceEpoch(int(record.created)).toString("yyyy-MM-dd hh:mm")
+            return f"Created {created}, score {record.score:.2f}"
+        return None
+
+    def _thumbnail(self, name: str) -> QPixmap:
+        thumbnail = self._thumbnails.get(name)
+        if thumbnail is not None:
+            self._thumbnails.move_to_end(name)
+            return thumbnail
+        if name not in self._pending:
+            self._pending[name] = None
+            if len(self._pending) > MAX_PENDING_THUMBNAILS:
+                self._pending.popitem(last=False)  # Scrolled past, its task will be skipped
+            self._pool.start(ThumbnailTask(name, self._signals, self._pending))
+        return self._placeholder
+
+    @pyqtSlot(str, QImage)
+    def _on_thumbnail_loaded(self, name: str, image: QImage):
+        self._pending.pop(name, None)
+        self._thumbnails[name] = QPixmap.fromImage(image) if not image.isNull() else self._placeholder
+        if len(self._thumbnails) > THUMBNAIL_CACHE_SIZE:
+            self._thumbnails.popitem(last=False)
+        row = self._rows.get(name)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def release(self):
+        self._pool.clear()
+        self._pending.clear()
+        self._thumbnails.clear()
+
+
+def lineage_of(name: str, records: List[HistoryRecord]) -> Set[str]:
+    """Names of all ancestors and descendants of the image, including itself."""
+    by_name = {record.name: record for record in records}
+    children: Dict[str, List[str]] = {}
+    for record in records:
+        for parent in (record.parent1, record.parent2):
+            if parent is not None:
+                children.setdefault(parent, []).append(record.name)
+    lineage = set()
+    stack = [name]
+    while stack:  # Ancestors
+        current = stack.pop()
+        if current in lineage:
+            continue
+        lineage.add(current)
+        record = by_name.get(current)
+        if record is not None:
+            stack.extend(parent for parent in (record.parent1, record.parent2) if parent is not None)
+    stack = list(children.get(name, []))
+    while stack:  # Descendants
+        current = stack.pop()
+        if current not in lineage:
+            lineage.add(current)
+            stack.extend(children.get(current, []))
+    return lineage
+
+
+class HistoryWindow(QMainWindow):
+    """
+    Scrollable gallery of every generated image, sortable by date or score and filterable by lineage.
+    The list view only paints visible rows and has no widget per image. Records are loaded in the background on
+    every show. Bringing an image back adds it to the ImageManager with its genome.
+    """
+
+    def __init__(self, image_manager: ImageManager):
+        super().__init__()
+        self._image_manager = image_manager
+        self._lineage_filter: Optional[str] = None
+        self._load_generation = 0
+        self._records_signals = RecordsSignals()
+        self._records_signals.loaded.connect(self._on_records_loaded)
+        self._records_pool = QThreadPool(self)
+        self._records_pool.setMaxThreadCount(1)
+        self.setWindowTitle("History")
+        self.setWindowFlags(Qt.WindowType.Tool | Qt.WindowType.WindowStaysOnTopHint |
+                            Qt.WindowType.WindowCloseButtonHint)
+        self.resize(900, 700)
+
+        central_widget = QWidget()
+        layout = QVBoxLayout(central_widget)
+        self.setCentralWidget(central_widget)
+
+        controls = QHBoxLayout()
+        self.sort_combo = QComboBox()
+        self.sort_combo.addItems(SORT_OPTIONS)
+        self.sort_combo.currentTextChanged.connect(self.refresh_view)
+        controls.addWidget(self.sort_combo)
+        self.lineage_button = QPushButton("Show Lineage")
+        self.lineage_button.setCheckable(True)
+        self.lineage_button.toggled.connect(self.toggle_lineage)
+        controls.addWidget(self.lineage_button)
+        controls.addStretch()
+        self.count_label = QLabel()
+        controls.addWidget(self.count_label)
+        self.restore_button = QPushButton("Bring Back")
+        self.restore_button.clicked.connect(self.restore_selected)
+        controls.addWidget(self.restore_button)
+        layout.addLayout(controls)
+
+        self.model = HistoryModel(self)
+        self.view = QListView()
+        self.view.setViewMode(QListView.ViewMode.IconMode)
+        self.view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.view.setGridSize(QSize(THUMBNAIL_SIZE + 24, THUMBNAIL_SIZE + 48))
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.view.setBatchSize(500)
+        self.view.setMovement(QListView.Movement.Static)
+        self.view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.view.setModel(self.model)
+        self.view.doubleClicked.connect(self.restore_selected)
+        layout.addWidget(self.view)
+
+    def showEvent(self, event):
+        self.reload()
+        super().showEvent(event)
+
+    def closeEvent(self, event):
+        self.model.release()  # Thumbnails are reloaded on the next show
+        event.accept()
+
+    def reload(self):
+        self._load_generation += 1
+        self.count_label.setText("Loading...")
+        self._records_pool.start(RecordsTask(self._image_manager, self._load_generation, self._records_signals))
+
+    @pyqtSlot(int, object)
+    def _on_records_loaded(self, generation: int, records: List[HistoryRecord]):
+        if generation != self._load_generation:
+            return  # Shown again while loading, a newer load follows
+        self.model.set_records(records)
+        self.refresh_view()
+
+    @pyqtSlot()
+    def refresh_view(self):
+        records = self.model.all_records()
+        if self._lineage_filter is not None:
+            lineage = lineage_of(self._lineage_filter, records)
+            records = [record for record in records if record.name in lineage]
+        sort = self.sort_combo.currentText()
+        if sort == SORT_SCORE or sort == SORT_SCORE_ASCENDING:
+            records = sorted(records, key=lambda record: record.score, reverse=sort == SORT_SCORE)
+        else:
+            records = sorted(records, key=lambda record: record.created, reverse=sort == SORT_NEWEST)
+        self.model.show_records(records)
+        self.count_label.setText(f"{len(records)} images")
+
+    @pyqtSlot(bool)
+    def toggle_lineage(self, checked: bool):
+        record = self.model.record(self.view.currentIndex())
+        if checked and record is None:
+            self.lineage_button.setChecked(False)
+            return
+        self._lineage_filter = record.name if checked else None
+        self.refresh_view()
+
+    @pyqtSlot()
+    def restore_selected(self):
+        record = self.model.record(self.view.currentIndex())
+        if record is None:
+            return
+        image_path = restore_png(record.name)
+        if image_path is None:
+            print(f"Image {record.name} is no longer stored.")
+            return
+        self._image_manager.restore_image(record.name, image_path)
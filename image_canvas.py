@@ -0,0 +1,190 @@
+from typing import Dict, Optional
+
+from PyQt6.QtCore import Qt, QRect, QRectF, QPointF, pyqtSlot
+from PyQt6.QtGui import QPixmap, QColor, QFont, QPainter, QPen
+from PyQt6.QtWidgets import QGraphicsObject, QGraphicsScene, QGraphicsView, QGraphicsItem, QFrame
+
+from image_manager import ImageInfo, ImageManager
+from image_window import CUSTOM_TITLE_BAR_HEIGHT, DRAG_THRESHOLD, IMAGE_SIZE, DRAGGABLE_WINDOW_WIDTH, \
+    DRAGGABLE_WINDOW_HEIGHT, format_image_name, parents_text
+
+RENDERER_ENV = "ED_RENDERER"  # "windows" (default) or "canvas"
+CANVAS_RENDERER = "canvas"
+SCORE_LABEL_HEIGHT = 40
+BACKGROUND = QColor("#f0f0f0")
+SELECTED_BACKGROUND = QColor("lightblue")
+CLOSE_BACKGROUND = QColor("red")
+
+
+class ImageCanvasItem(QGraphicsObject):
+    """
+    Draws an image with its title bar, score and parents as a single item on the ImageCanvas.
+    Mirrors the DraggableImageWindow: drag to move, tap to select, X to close. The image is scaled once into a
+    cached pixmap and the item is cached in device coordinates, so moving it does not repaint its content.
+    Offers the geometry methods of the window, so the MainWindow can position both the same way.
+    """
+
+    def __init__(self, image_info: ImageInfo, canvas: 'ImageCanvas'):
+        super().__init__()
+        self._image_info = image_info
+        self._canvas = canvas
+        self._selected = False
+        self._press_pos: Optional[QPointF] = None
+        self._close_pressed = False
+        self._pixmap = QPixmap(image_info.path).scaled(IMAGE_SIZE, IMAGE_SIZE, Qt.AspectRatioMode.IgnoreAspectRatio,
+                                                       Qt.TransformationMode.SmoothTransformation)
+        self._title = "IMAGE " + format_image_name(image_info.name)
+        self._score_text = "Aesthetic Score: {:.2f}".format(image_info.score)
+        self._parents_text = parents_text(image_info)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable)
+        self.setCacheMode(QGraphicsItem.CacheMode.DeviceCoordinateCache)
+
+    @property
+    def image_info(self):
+        return self._image_info
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, DRAGGABLE_WINDOW_WIDTH, DRAGGABLE_WINDOW_HEIGHT)
+
+    def _close_rect(self) -> QRectF:
+        return QRectF(DRAGGABLE_WINDOW_WIDTH - CUSTOM_TITLE_BAR_HEIGHT, 0, CUSTOM_TITLE_BAR_HEIGHT, CUSTOM_TITLE_BAR_HEIGHT)
+
+    def paint(self, painter: QPainter, option, widget=None):
+        painter.fillRect(self.boundingRect(), SELECTED_BACKGROUND if self._selected else BACKGROUND)
+        font = QFont(painter.font())
+        font.setBold(True)
+        painter.setFont(font)
+        painter.setPen(QPen(Qt.GlobalColor.black))
+        painter.drawText(QRectF(5, 0, DRAGGABLE_WINDOW_WIDTH - CUSTOM_TITLE_BAR_HEIGHT - 5, CUSTOM_TITLE_BAR_HEIGHT),
+                         Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, self._title)
+        painter.fillRect(self._close_rect(), CLOSE_BACKGROUND)
+        painter.setPen(QPen(Qt.GlobalColor.white))
+        painter.drawText(self._close_rect(), Qt.AlignmentFlag.AlignCenter, "X")
+
+        painter.drawPixmap(0, CUSTOM_TITLE_BAR_HEIGHT, self._pixmap)
+
+        label_top = CUSTOM_TITLE_BAR_HEIGHT + IMAGE_SIZE
+        font.setPixelSize(24)
+        painter.setFont(font)
+        painter.setPen(QPen(Qt.GlobalColor.black))
+        painter.drawText(QRectF(0, label_top, DRAGGABLE_WINDOW_WIDTH, SCORE_LABEL_HEIGHT),
+                         Qt.AlignmentFlag.AlignCenter, self._score_text)
+        font.setBold(False)
+        font.setPixelSize(12)
+        painter.setFont(font)
+        painter.setPen(QPen(Qt.GlobalColor.gray))
+        painter.drawText(QRectF(0, label_top + SCORE_LABEL_HEIGHT, DRAGGABLE_WINDOW_WIDTH,
+                                DRAGGABLE_WINDOW_HEIGHT - label_top - SCORE_LABEL_HEIGHT),
+                         Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop, self._parents_text)
+
+    def set_selected(self, selected: bool):
+        if self._selected != selected:
+            self._selected = selected
+            self.update()
+
+    def geometry(self) -> QRect:
+        return self.sceneBoundingRect().toRect()
+
+    def setGeometry(self, rect: QRect):
+        self.setPos(QPointF(rect.topLeft()))
+
+    def show(self):
+        self.setVisible(True)
+
+    def raise_(self):
+        self._canvas.raise_item(self)
+
+    def close(self):
+        self._canvas.remove_item(self)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.raise_()
+            self._close_pressed = self._close_rect().contains(event.pos())
+            self._press_pos = event.screenPos()
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        if self._close_pressed:
+            self._close_pressed = False
+            if self._close_rect().contains(event.pos()):
+                self._canvas.image_manager.remove_image(self._image_info)
+            return
+        if self._press_pos is not None:
+            distance = (QPointF(event.screenPos()) - QPointF(self._press_pos)).manhattanLength()
+            if distance < DRAG_THRESHOLD and self._image_info.selectable:  # Do not select if user is dragging
+                if self._selected:
+                    self._canvas.image_manager.unselect_image(self._image_info)
+                else:
+                    self._canvas.image_manager.select_image(self._image_info)
+            self._press_pos = None
+
+    def mouseMoveEvent(self, event):
+        if self._close_pressed:
+            return  # Do not drag when the close button is held
+        super().mouseMoveEvent(event)
+
+
+class ImageCanvas(QGraphicsView):
+    """
+    Alternative to one DraggableImageWindow per image: all images are items on a single QGraphicsScene.
+    Uses the same ImageManager signals, tapping empty space unselects all images.
+    Overlay widgets (menu, buttons) can be placed in a layout on the viewport.
+    """
+
+    def __init__(self, image_manager: ImageManager, background_color: str, parent=None):
+        super().__init__(parent)
+        self._image_manager = image_manager
+        self._items: Dict[ImageInfo, ImageCanvasItem] = {}
+        self._top_z = 0.0
+        self._scene = QGraphicsScene(self)
+        self._scene.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.NoIndex)  # Items move often, few lookups
+        self.setScene(self._scene)
+        self.setBackgroundBrush(QColor(background_color))
+        self.setFrameShape(QFrame.Shape.NoFrame)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        self.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.SmartViewportUpdate)
+        self.setOptimizationFlag(QGraphicsView.OptimizationFlag.DontSavePainterState)
+        self._image_manager.selectionChanged.connect(self.on_selection_changed)
+
+    @property
+    def image_manager(self) -> ImageManager:
+        return self._image_manager
+
+    def create_item(self, image_info: ImageInfo) -> ImageCanvasItem:
+        item = ImageCanvasItem(image_info, self)
+        item.set_selected(image_info in self._image_manager.selected_images)
+        self._items[image_info] = item
+        self._scene.addItem(item)
+        return item
+
+    def raise_item(self, item: ImageCanvasItem):
+        self._top_z += 1
+        item.setZValue(self._top_z)
+
+    def remove_item(self, item: ImageCanvasItem):
+        if self._items.get(item.image_info) is item:
+            del self._items[item.image_info]
+            self._scene.removeItem(item)
+            self._image_manager.remove_image(item.image_info)
+            item.deleteLater()
+
+    @pyqtSlot(ImageInfo, bool)
+    def on_selection_changed(self, image_info: ImageInfo, selected: bool):
+        item = self._items.get(image_info)
+        if item is not None:
+            item.set_selected(selected)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._scene.setSceneRect(0, 0, self.viewport().width(), self.viewport().height())
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton and self.itemAt(event.pos()) is None:
+            print('Mouse pressed, unselecting all images.')
+            self._image_manager.unselect_all()
+        super().mousePressEvent(event)
@@ -0,0 +1,71 @@
+import os
+import shelve
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+import torch
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+
+HISTORY_INDEX = "evolutionary_diffusion_history"  # Shelve of image name to HistoryRecord
+GENOME_FOLDER = "genomes"
+GENOME_EXTENSION = ".pt"
+
+
+class HistoryRecord(NamedTuple):
+    name: str
+    score: float
+    created: float  # Unix timestamp
+    parent1: Optional[str]
+    parent2: Optional[str]
+
+
+def genome_to_tensors(arguments: PooledPromptEmbedData) -> dict:
+    return {"prompt_embeds": arguments.prompt_embeds.detach().cpu(),
+            "pooled_prompt_embeds": arguments.pooled_prompt_embeds.detach().cpu()}
+
+
+def genome_from_tensors(tensors: dict, device: torch.device = None) -> PooledPromptEmbedData:
+    return PooledPromptEmbedData(tensors["prompt_embeds"].to(device), tensors["pooled_prompt_embeds"].to(device))
+
+
+class ImageHistory:
+    """
+    Persists a record and the genome of every generated image, so images can be browsed and bred again after
+    they left the screen. Records are kept in a shelve, genomes as tensor files next to the images.
+    Thread-safe, records are written from the image generation thread.
+    """
+
+    def __init__(self, image_location: str):
+        self._genome_location = os.path.join(image_location, GENOME_FOLDER)
+        self._lock = threading.Lock()
+        os.makedirs(self._genome_location, exist_ok=True)
+
+    def genome_path(self, name: str) -> str:
+        return os.path.join(self._genome_location, f"{name}{GENOME_EXTENSION}")
+
+    def record(self, name: str, arguments: PooledPromptEmbedData, score: float,
+               parent1: Optional[str] = None, parent2: Optional[str] = None):
+        torch.save(genome_to_tensors(arguments), self.genome_path(name))
+        with self._lock, shelve.open(HISTORY_INDEX) as db:
+            db[name] = tuple(HistoryRecord(name, score, time.time(), parent1, parent2))
+
+    def remove(self, name: str):
+        """Forgets an image whose files were deleted, so it is no longer offered for browsing."""
+        with self._lock, shelve.open(HISTORY_INDEX) as db:
+            db.pop(name, None)
+
+    def records(self) -> List[HistoryRecord]:
+        with self._lock, shelve.open(HISTORY_INDEX) as db:
+            return [HistoryRecord(*record) for record in db.values()]
+
+    def get(self, name: str) -> Optional[HistoryRecord]:
+        with self._lock, shelve.open(HISTORY_INDEX) as db:
+            record = db.get(name)
+        return HistoryRecord(*record) if record is not None else None
+
+    def load_genome(self, name: str, device: torch.device = None) -> Optional[PooledPromptEmbedData]:
+        path = self.genome_path(name)
+        if not os.path.exists(path):
+            return None
+        return genome_from_tensors(torch.load(path, weights_only=True), device)
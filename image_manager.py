@@ -1,21 +1,32 @@
+import itertools
 import os
 import shelve
+import threading
+import time
+from collections import deque
 from queue import Queue
-from typing import List, Optional
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
-from PyQt6.QtCore import pyqtSlot, QObject, pyqtSignal, QThread, QMutex
+from PyQt6.QtCore import pyqtSlot, QObject, pyqtSignal, QThread, QThreadPool, QMutex
 from diffusers.utils import logging
-from evolutionary_imaging.evaluators import AestheticsImageEvaluator
 from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
-from evolutionary_prompt_embedding.image_creation import SDXLPromptEmbeddingImageCreator
 from evolutionary_prompt_embedding.value_ranges import SDXLTurboEmbeddingRange, SDXLTurboPooledEmbeddingRange
-from evolutionary_prompt_embedding.variation import \
-    UniformGaussianMutatorArguments, PooledUniformGaussianMutator, PooledArithmeticCrossover
+
+from best_of_k import BatchSizeTuner, BEST_OF_K_ENV
+from env_config import env_flag, env_int
+from generation_backend import create_backend
+from genome import GenomeVerifier, GENOME_VERIFY_ENV, compact, expand, genome_nbytes
+from image_history import ImageHistory
+from lineage_export import LineageRecord
+from quality_controller import QualityController, QualityLevel, ADAPTIVE_QUALITY_ENV
+from render_cache import RenderCache, RENDER_CACHE_ENV, genome_key
+from variation import PooledLerpCrossover, pooled_sparse_mutator
 
 SHELVE = "evolutionary_diffusion_shelve"
 IMAGE_COUNTER = "image_counter"
+IMAGE_EPOCH = "image_epoch"  # When the counter was started, image names are only unique together with it
 IMAGE_LOCATION = "results"
-MAX_IMAGES = 10
+MAX_IMAGES = env_int("ED_MAX_IMAGES", 10)
 MUTATION_RATE = 0.005
 MUTATION_STRENGTH = 0.0005
 
@@ -25,6 +36,14 @@ def get_current_image_counter():
         return db.get(IMAGE_COUNTER, 0)
 
 
+def get_image_epoch() -> float:
+    """Unix time the image counter was started, a reset deletes the shelve and starts a new epoch."""
+    with shelve.open(SHELVE) as db:
+        if IMAGE_EPOCH not in db:
+            db[IMAGE_EPOCH] = time.time() if db.get(IMAGE_COUNTER, 0) == 0 else 0.0  # 0 for counters started before
+        return db[IMAGE_EPOCH]
+
+
 class ImageInfo:
     def __init__(self, arguments, path: str, score: float, selectable=True,
                  parent1: 'ImageInfo' = None, parent2: 'ImageInfo' = None):
@@ -69,12 +88,60 @@ class ImageInfo:
         return os.path.basename(self._path)
 
     def __eq__(self, other):
+        if not isinstance(other, ImageInfo):
+            return NotImplemented  # E.g. compared with None
         return self.path == other.path
 
     def __hash__(self):
         return hash(self.path)
 
 
+class Operation(NamedTuple):
+    """What an image is created by, carried from the request to its lineage record."""
+    name: str  # generate, mutate, crossover or promote
+    weight: Optional[float] = None
+    style: Optional[str] = None
+    requested: float = 0.0  # Unix timestamp
+    id: int = 0  # Links the request to its image in session recordings, unique per process
+
+
+class RenderResult:
+    """A rendered and scored image that is not saved or shown yet."""
+
+    def __init__(self, embeds, image, score: float, render_seconds: float,
+                 cache_key: Optional[str] = None, render_config: Optional[str] = None, cached: bool = False):
+        self.embeds = embeds
+        self.image = image
+        self.score = score
+        self.render_seconds = render_seconds
+        self.cache_key = cache_key  # Set for renders that can be added to the render cache
+        self.render_config = render_config
+        self.cached = cached  # Taken from the render cache instead of rendered
+
+
+class BackgroundRender:
+    """A speculative render job, on_finished or on_failed is called from the generation thread."""
+
+    def __init__(self, embeds, on_finished: Callable[[RenderResult], None], is_cancelled: Callable[[], bool],
+                 bypass_cache: bool = False, on_failed: Optional[Callable[[Exception], None]] = None):
+        self.embeds = embeds
+        self.on_finished = on_finished
+        self.is_cancelled = is_cancelled
+        self.bypass_cache = bypass_cache  # Always diffuse, e.g. to compare a render with an earlier one
+        self.on_failed = on_failed
+
+
+class BackgroundBatchRender:
+    """A background job rendering several candidates in one diffusion pass, on_finished gets all results."""
+
+    def __init__(self, candidates, on_finished: Callable[[List[RenderResult]], None],
+                 is_cancelled: Callable[[], bool], on_failed: Optional[Callable[[Exception], None]] = None):
+        self.candidates = candidates
+        self.on_finished = on_finished
+        self.is_cancelled = is_cancelled
+        self.on_failed = on_failed
+
+
 class ImageManager(QObject):
     """
     Manages the display and selection of images.
@@ -88,8 +155,10 @@ class ImageManager(QObject):
     imageAdded = pyqtSignal(ImageInfo)
     imageRemoved = pyqtSignal(ImageInfo)
     isLoadingChanged = pyqtSignal(bool)
+    operationRequested = pyqtSignal(str, object)  # Operation name and its parameters, for session recording
+    imageCreated = pyqtSignal(object)  # LineageRecord of every new image, may be emitted from the generation thread
 
-    def __init__(self):
+    def __init__(self, backend=None):
         super().__init__()
         self._selected_images: List[ImageInfo] = []
         self._images: List[ImageInfo] = []
@@ -99,27 +168,40 @@ class ImageManager(QObject):
 
         # Image generation thread management
         self._thread_running = False
+        self._interactive_running = False
         self._task_queue = Queue()
+        self._background_jobs = deque()
         self._mutex = QMutex()
         self._current_thread = None
+        self._counter_lock = threading.Lock()
+        self._last_reserved_counter = -1
+        self.image_epoch = get_image_epoch()
+        self._crossover_prefetcher = None
+        self._mutation_prefetcher = None
+        self._operation_ids = itertools.count(1)
+        self._save_pool = QThreadPool(self)  # Saves prefetched results, one at a time
+        self._save_pool.setMaxThreadCount(1)
 
         # Setup for image generation, part of the evolutionary_diffusion library
         os.environ["TOKENIZERS_PARALLELISM"] = "false"  # Avoids warning from transformers
         logging.disable_progress_bar()  # Or else your output will be full of progress bars
         logging.set_verbosity_error()
         os.mkdir(IMAGE_LOCATION) if not os.path.exists(IMAGE_LOCATION) else None
-        self.imageCreator = SDXLPromptEmbeddingImageCreator(inference_steps=3, batch_size=1, deterministic=True)
-        self.evaluator = AestheticsImageEvaluator(device="cpu")  # Force CPU for windows compatibility, CUDA causes errors
+        self.backend = backend if backend is not None else create_backend()
         self.embedding_range = SDXLTurboEmbeddingRange()
         self.pooled_embedding_range = SDXLTurboPooledEmbeddingRange()
-        self.mutation_arguments = UniformGaussianMutatorArguments(mutation_rate=MUTATION_RATE, mutation_strength=MUTATION_STRENGTH,
-                                                                  clamp_range=(self.embedding_range.minimum,
-                                                                               self.embedding_range.maximum))
-        self.mutation_arguments_pooled = UniformGaussianMutatorArguments(mutation_rate=MUTATION_RATE, mutation_strength=MUTATION_STRENGTH,
-                                                                         clamp_range=(
-                                                                             self.pooled_embedding_range.minimum,
-                                                                             self.pooled_embedding_range.maximum))
-        self.mutator = PooledUniformGaussianMutator(self.mutation_arguments, self.mutation_arguments_pooled)
+        self.mutator = pooled_sparse_mutator(MUTATION_RATE, MUTATION_STRENGTH,
+                                             self.embedding_range, self.pooled_embedding_range)
+        self.crossover = PooledLerpCrossover()
+        self.history = ImageHistory(IMAGE_LOCATION)
+        self._batch_tuner = BatchSizeTuner() if env_flag(BEST_OF_K_ENV) else None
+        self._unsupported_quality_options = set()
+        self._quality_controller = QualityController(self._apply_quality) if env_flag(ADAPTIVE_QUALITY_ENV) else None
+        self._genome_device = None
+        self._compute_dtype = None
+        self._genome_verifier = GenomeVerifier() if env_flag(GENOME_VERIFY_ENV) else None
+        self._render_cache = RenderCache(IMAGE_LOCATION, reset=get_current_image_counter() == 0) \
+            if env_flag(RENDER_CACHE_ENV) else None
 
     @property
     def selected_images(self):
@@ -129,6 +211,24 @@ class ImageManager(QObject):
     def images(self):
         return self._images
 
+    @property
+    def is_busy(self) -> bool:
+        """True while an image is being generated for the visitor or generation tasks are queued."""
+        return self._interactive_running or not self._task_queue.empty()
+
+    @property
+    def queued_task_count(self) -> int:
+        """Interactive and background renders waiting for the generation thread."""
+        return self._task_queue.qsize() + len(self._background_jobs)
+
+    def set_crossover_prefetcher(self, prefetcher):
+        """Prefetched crossover results are used by create_child when available."""
+        self._crossover_prefetcher = prefetcher
+
+    def set_mutation_prefetcher(self, prefetcher):
+        """Prefetched mutations are used by mutate_image when available."""
+        self._mutation_prefetcher = prefetcher
+
     @pyqtSlot()
     def on_selection_changed(self):
         self.selectionCountChanged.emit(len(self._selected_images))
@@ -157,46 +257,271 @@ class ImageManager(QObject):
             self.unselect_image(image)
         self._selected_images.clear()
 
-    def _schedule_create_image(self, embeds, parent1=None, parent2=None):
+    def _schedule_create_image(self, candidates, operation: Operation, parent1=None, parent2=None):
         """
-        Schedules the creation of an image with the given embeddings.
+        Schedules the creation of an image from the candidate embeddings, or a callable that creates them.
+        All candidates are rendered in one batch, the highest scoring one is shown.
         Executed in a QThread to avoid blocking the main thread.
         """
+        self._task_queue.put((candidates, operation, parent1, parent2))
+        self._start_next_task()
+
+    def _candidate_count(self) -> int:
+        """Number of candidates per operation, only more than one in Best-of-K mode."""
+        return self._batch_tuner.k if self._batch_tuner is not None else 1
+
+    def schedule_background_render(self, job: BackgroundRender | BackgroundBatchRender):
+        """
+        Schedules a speculative render. Background renders only run when no interactive task is queued,
+        at low thread priority, and are skipped when cancelled before they start.
+        """
+        self._mutex.lock()
+        self._background_jobs.append(job)
+        self._mutex.unlock()
+        self._start_next_task()
+
+    def _start_next_task(self):
         self._mutex.lock()
         if self._thread_running:
             self._mutex.unlock()
-            self._task_queue.put((embeds, parent1, parent2))
-        else:
-            self._thread_running = True
-            self._mutex.unlock()
-            self._current_thread = QThread()
+            return
+        if not self._task_queue.empty():
+            candidates, operation, parent1, parent2 = self._task_queue.get()
+            self._interactive_running = True
 
             def task():
                 self.isLoadingChanged.emit(True)
-                image_data = self.imageCreator.create_solution(embeds)
-                image_data.fitness = self.evaluator.evaluate(image_data.result)
-                image_filename = f"{get_current_image_counter()}.png"
-                image_path = os.path.join(IMAGE_LOCATION, image_filename)
-                image_data.result.images[0].save(image_path)
-                image_info = ImageInfo(arguments=embeds, path=image_path, score=image_data.fitness,
-                                       parent1=parent1, parent2=parent2)
-                self._add_or_replace_image(image_info)
-                self.isLoadingChanged.emit(False)
+                try:
+                    results = self._render_batch(candidates() if callable(candidates) else candidates)
+                    rendered = [result for result in results if not result.cached]
+                    if self._quality_controller is not None and rendered:
+                        self._quality_controller.record(rendered[0].render_seconds)
+                    best = max(results, key=lambda result: result.score)
+                    self.add_rendered_image(best, parent1, parent2, operation)
+                    if len(results) > 1:
+                        print(f"Best-of-{len(results)}: showing score {best.score:.2f} of "
+                              f"{', '.join(f'{result.score:.2f}' for result in results)}")
+                finally:
+                    self.isLoadingChanged.emit(False)
+
+            priority = QThread.Priority.InheritPriority
+        else:
+            job = None
+            while self._background_jobs and job is None:
+                job = self._background_jobs.popleft()
+                job = None if job.is_cancelled() else job
+            if job is None:
+                self._mutex.unlock()
+                return
+
+            def task():
+                try:
+                    if isinstance(job, BackgroundBatchRender):
+                        results = self._render_batch(job.candidates, background=True)
+                    else:
+                        results = self._render(job.embeds, job.bypass_cache)
+                except Exception as e:
+                    if job.on_failed is None:
+                        raise
+                    print("Exception in background render:", e)
+                    job.on_failed(e)  # Lets jobs waiting for the result carry on
+                    return
+                job.on_finished(results)
+
+            priority = QThread.Priority.LowPriority
+        self._thread_running = True
+        self._mutex.unlock()
+        self._current_thread = QThread()
+
+        def run():
+            try:
+                task()
+            except Exception as e:
+                print("Exception in image generation task:", e)
+            finally:
                 self._thread_finished()
 
-            self._current_thread.run = task
-            self._current_thread.finished.connect(self._current_thread.deleteLater)
-            self._current_thread.start()
+        self._current_thread.run = run
+        self._current_thread.finished.connect(self._current_thread.deleteLater)
+        self._current_thread.start(priority)
 
     def _thread_finished(self):
         self._mutex.lock()
         self._thread_running = False
-        if not self._task_queue.empty():
-            embeds, parent1, parent2 = self._task_queue.get()
-            self._mutex.unlock()
-            self._schedule_create_image(embeds, parent1, parent2)
-        else:
-            self._mutex.unlock()
+        self._interactive_running = False
+        self._mutex.unlock()
+        self._start_next_task()
+
+    def _render(self, embeds, bypass_cache: bool = False) -> RenderResult:
+        """Creates and scores the image for a background job. Must only be called from the generation thread."""
+        return self._render_batch([embeds], background=True, bypass_cache=bypass_cache)[0]
+
+    def _render_batch(self, candidates, background: bool = False, bypass_cache: bool = False) -> List[RenderResult]:
+        """
+        Creates the images for all candidates in a single diffusion pass and scores them in one batch.
+        Candidates found in the render cache are skipped. Must only be called from the generation thread.
+        """
+        results: List[Optional[RenderResult]] = [None] * len(candidates)
+        if self._render_cache is not None and not bypass_cache:
+            render_config = self._render_config()
+            for index, embeds in enumerate(candidates):
+                start = time.perf_counter()
+                cached = self._render_cache.lookup(embeds, render_config)
+                if cached is not None:
+                    genome, image, score = cached
+                    results[index] = RenderResult(genome, image, score, time.perf_counter() - start, cached=True)
+        pending = [index for index, result in enumerate(results) if result is None]
+        if pending:
+            for index, result in zip(pending, self._diffuse([candidates[index] for index in pending], background)):
+                results[index] = result
+        return results
+
+    def _render_config(self) -> str:
+        """Everything besides the genome that determines the rendered image, part of the render cache key."""
+        return self.backend.render_config()
+
+    def _diffuse(self, candidates, background: bool = False) -> List[RenderResult]:
+        render_config = self._render_config()
+        start = time.perf_counter()
+        images, scores, solo = self.backend.render(candidates, background)
+        seconds = time.perf_counter() - start
+        if self._batch_tuner is not None and not background:
+            self._batch_tuner.record(len(candidates), seconds)  # Tunes the batch size of interactive renders only
+        # Only single renders are cached, images of a batch depend on their position in it
+        cache_key = genome_key(candidates[0], render_config) if self._render_cache is not None and solo else None
+        return [RenderResult(embeds, image, score, seconds, cache_key=cache_key, render_config=render_config)
+                for embeds, image, score in zip(candidates, images, scores)]
+
+    def _apply_quality(self, level: QualityLevel) -> QualityLevel:
+        """
+        Applies a quality level from the quality controller. Called from the generation thread between renders.
+        Returns what was applied, options the image creator does not support are None and warned about once.
+        """
+        steps = level.inference_steps if self.backend.set_option("inference_steps", level.inference_steps) else None
+        resolution = level.resolution if (self.backend.set_option("height", level.resolution) and
+                                           self.backend.set_option("width", level.resolution)) else None
+        batch_size = None
+        if self._batch_tuner is not None:
+            self._batch_tuner.set_max_k(level.batch_size)
+            batch_size = level.batch_size
+        applied = QualityLevel(steps, resolution, batch_size)
+        for option, value in zip(("inference steps", "resolution"), applied):
+            if value is None and option not in self._unsupported_quality_options:
+                self._unsupported_quality_options.add(option)
+                print(f"Quality controller: image creator does not support changing the {option}.")
+        return applied
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes of genomes and unsaved images held by the image manager, for the memory report."""
+        shown, ancestors, seen = 0, 0, set()
+        stack = [(image, True) for image in self._images]
+        while stack:  # Parent chains keep the genomes of all ancestors alive
+            image_info, on_screen = stack.pop()
+            if image_info is None or id(image_info) in seen:
+                continue
+            seen.add(id(image_info))
+            if image_info.arguments is not None:
+                size = genome_nbytes(image_info.arguments)
+                shown, ancestors = (shown + size, ancestors) if on_screen else (shown, ancestors + size)
+            stack.extend([(image_info.parent1, False), (image_info.parent2, False)])
+        self._mutex.lock()
+        queued = sum(genome_nbytes(embeds) for candidates, _, _, _ in list(self._task_queue.queue)
+                     if not callable(candidates) for embeds in candidates)
+        background = sum(genome_nbytes(embeds) for job in self._background_jobs
+                         for embeds in (job.candidates if isinstance(job, BackgroundBatchRender) else [job.embeds]))
+        self._mutex.unlock()
+        return {"genomes on screen": shown, "genomes of ancestors": ancestors, "queued genomes": queued,
+                "background render genomes": background}
+
+    def prune_render_cache(self):
+        if self._render_cache is not None:
+            self._render_cache.prune()
+
+    def _genome_format(self):
+        """Device and dtype the image creator and variation operators work with, taken from the embedding range."""
+        if self._genome_device is None:
+            reference = self.embedding_range.random_tensor_in_range()
+            self._genome_device, self._compute_dtype = reference.device, reference.dtype
+        return self._genome_device, self._compute_dtype
+
+    def genome(self, image_info: ImageInfo):
+        """The image's genome upcast for rendering or variation, genomes of shown images are stored compact."""
+        return expand(image_info.arguments, self._genome_format()[1])
+
+    def _verify_genome(self, name: str, result: RenderResult, stored_embeds):
+        """Renders the upcast stored genome in the background and compares it with the shown image."""
+        self.schedule_background_render(BackgroundRender(
+            expand(stored_embeds, self._genome_format()[1]),
+            on_finished=lambda verified: self._genome_verifier.compare(name, result.image, result.score,
+                                                                       verified.image, verified.score),
+            is_cancelled=lambda: False, bypass_cache=True))  # A cache hit would compare the image with itself
+
+    def _next_image_path(self) -> str:
+        """Reserves the next file name, the persisted counter is only incremented once the image was added."""
+        with self._counter_lock:
+            counter = max(get_current_image_counter(), self._last_reserved_counter + 1)
+            self._last_reserved_counter = counter
+        return os.path.join(IMAGE_LOCATION, f"{counter}.png")
+
+    def add_rendered_image(self, result: RenderResult, parent1: ImageInfo = None, parent2: ImageInfo = None,
+                           operation: Optional[Operation] = None,
+                           parent_names: Tuple[Optional[str], Optional[str]] = None) -> ImageInfo:
+        """
+        Saves a rendered image, records it in the history and its lineage, and shows it.
+        parent_names records ancestors that are no longer on screen, for images without parent ImageInfos.
+        """
+        image_path = self._next_image_path()
+        result.image.save(image_path)
+        stored_embeds = compact(result.embeds)
+        image_info = ImageInfo(arguments=stored_embeds, path=image_path, score=result.score,
+                               parent1=parent1, parent2=parent2)
+        if parent_names is None:
+            parent_names = (parent1.name if parent1 is not None else None,
+                            parent2.name if parent2 is not None else None)
+        self.history.record(image_info.name, stored_embeds, image_info.score, *parent_names)
+        if operation is not None:
+            self.imageCreated.emit(LineageRecord(
+                image_info.name, image_info.path, image_info.score, *parent_names,
+                operation.name, operation.weight, operation.style, operation.requested, time.time(),
+                result.render_seconds, self.image_epoch, operation.id))
+        if result.cache_key is not None:
+            self._render_cache.store(result.cache_key, image_info.name, result.score, result.embeds,
+                                     result.render_config)
+        self._add_or_replace_image(image_info)
+        if self._genome_verifier is not None and stored_embeds is not result.embeds:
+            self._verify_genome(image_info.name, result, stored_embeds)
+        return image_info
+
+    def _request_operation(self, name: str, parameters: dict, weight: Optional[float] = None,
+                           style: Optional[str] = None) -> Operation:
+        """Announces an operation for session recording, the returned Operation carries its id to the image."""
+        operation = Operation(name, weight, style, time.time(), next(self._operation_ids))
+        self.operationRequested.emit(name, dict(parameters, id=operation.id))
+        return operation
+
+    def _add_prefetched_image(self, result: RenderResult, parent1: ImageInfo = None, parent2: ImageInfo = None,
+                              operation: Optional[Operation] = None):
+        """Saves and shows a prefetched result in a worker, the png, genome and shelve writes would block the GUI."""
+        def task():
+            try:
+                self.add_rendered_image(result, parent1, parent2, operation)
+            except Exception as e:
+                print("Exception while adding prefetched image:", e)
+
+        self._save_pool.start(task)
+
+    def promote_image(self, result: RenderResult,
+                      parent_names: Tuple[Optional[str], Optional[str]] = (None, None)) -> ImageInfo:
+        """
+        Shows an image that was rendered in the background without a visitor's operation, e.g. by the autopilot.
+        parent_names are the images it was bred from.
+        """
+        print(f"Promoting background image with score {result.score:.2f}")
+        operation = self._request_operation("promote", {"score": round(float(result.score), 4)})
+        return self.add_rendered_image(result, operation=operation, parent_names=parent_names)
+
+    def mutate_embeds(self, image_info: ImageInfo):
+        return self.mutator.mutate(self.genome(image_info))
 
     def _add_or_replace_image(self, image_info: ImageInfo):
         if len(self._images) >= MAX_IMAGES:
@@ -213,29 +538,81 @@ class ImageManager(QObject):
         if image_info not in self._images:
             self._add_or_replace_image(image_info)
 
+    def _random_embeds(self, style_embeds=None, weight: Optional[float] = None):
+        random_embeds = PooledPromptEmbedData(self.embedding_range.random_tensor_in_range(),
+                                              self.pooled_embedding_range.random_tensor_in_range())
+        if style_embeds is not None:
+            random_embeds = self.crossover.crossover(style_embeds, random_embeds, weight)
+        return random_embeds
+
     def generate_image(self, style: Optional[str] = None, weight: Optional[float] = None):
         """Genernates a new image using the evolutionary diffusion library, optionally with a style and weight."""
         print("Generating new image. Style:", style, "Weight:", weight)
-        random_embeds = PooledPromptEmbedData(self.embedding_range.random_tensor_in_range(),
-                                              self.pooled_embedding_range.random_tensor_in_range())
-        if style is not None:
-            style_embeds = self.imageCreator.arguments_from_prompt(f"in the style of {style}")
-            random_embeds = (PooledArithmeticCrossover(interpolation_weight=weight, interpolation_weight_pooled=weight)
-                        .crossover(style_embeds, random_embeds))
-        # TODO improve performance
-        self._schedule_create_image(random_embeds)
+        operation = self._request_operation("generate", {"style": style, "weight": weight}, weight, style)
+
+        def candidates():  # Called on the generation thread, encoding the prompt would block the GUI
+            style_embeds = None
+            if style is not None:
+                style_embeds = self.backend.prompt_embeds(f"in the style of {style}", self._genome_format()[0])
+            return [self._random_embeds(style_embeds, weight) for _ in range(self._candidate_count())]
+
+        self._schedule_create_image(candidates, operation)
 
     def mutate_image(self, image_info: ImageInfo):
         print(f"Mutating image {image_info.name}")
-        mutated_embeds = self.mutator.mutate(image_info.arguments)
-        self._schedule_create_image(mutated_embeds, parent1=image_info)
+        operation = self._request_operation("mutate", {"image": image_info.name})
+        if self._mutation_prefetcher is not None:
+            prefetched = self._mutation_prefetcher.take(image_info)
+            if prefetched is not None:
+                self._add_prefetched_image(prefetched, parent1=image_info, operation=operation)
+                return
+        candidates = [self.mutate_embeds(image_info) for _ in range(self._candidate_count())]
+        self._schedule_create_image(candidates, operation, parent1=image_info)
+
+    def crossover_embeds(self, parent1: ImageInfo, parent2: ImageInfo, weight: float):
+        return self.crossover.crossover(self.genome(parent1), self.genome(parent2), weight)
 
     def create_child(self, parent1: ImageInfo, parent2: ImageInfo, parent_contribution: int):
         weight = float(parent_contribution) / 100
         print(f"Parent contribution: {weight} for {parent1.name} and {parent2.name}")
-        child_embeds = (PooledArithmeticCrossover(interpolation_weight=weight, interpolation_weight_pooled=weight)
-                        .crossover(parent1.arguments, parent2.arguments))
-        self._schedule_create_image(child_embeds, parent1, parent2)
+        operation = self._request_operation("crossover", {"parents": [parent1.name, parent2.name], "weight": weight},
+                                            weight)
+        if self._crossover_prefetcher is not None:
+            prefetched = self._crossover_prefetcher.take(parent1, parent2, weight)
+            if prefetched is not None:
+                prefetched_weight, result = prefetched  # The nearest prefetched weight, not the slider position
+                self._add_prefetched_image(result, parent1, parent2, operation._replace(weight=prefetched_weight))
+                return
+        child_embeds = self.crossover_embeds(parent1, parent2, weight)
+        # Further candidates are slight mutations of the child, the crossover itself is deterministic
+        candidates = [child_embeds] + [self.mutator.mutate(child_embeds) for _ in range(self._candidate_count() - 1)]
+        self._schedule_create_image(candidates, operation, parent1, parent2)
+
+    def restore_image(self, name: str, image_path: str) -> Optional[ImageInfo]:
+        """
+        Brings an image from the history back on screen with its genome, so it can be bred again.
+        Parents are only restored for display, without their genomes.
+        """
+        record = self.history.get(name)
+        arguments = self.history.load_genome(name, self._genome_format()[0])
+        if record is None or arguments is None:
+            print(f"Cannot restore image {name}, no genome in history.")
+            return None
+        arguments = compact(arguments)
+
+        def parent_info(parent_name):
+            if parent_name is None:
+                return None
+            parent_record = self.history.get(parent_name)
+            return ImageInfo(arguments=None, path=os.path.join(IMAGE_LOCATION, f"{parent_name}.png"),
+                             score=parent_record.score if parent_record is not None else 0.0, selectable=False)
+
+        image_info = ImageInfo(arguments=arguments, path=image_path, score=record.score,
+                               parent1=parent_info(record.parent1), parent2=parent_info(record.parent2))
+        print(f"Restoring image {name}")
+        self.operationRequested.emit("restore", {"image": name})
+        self.manual_add_image(image_info)
+        return image_info
 
     def remove_image(self, image_info: ImageInfo):  # May also remove image from disk in the future?
         print(f"Removing image {image_info.name}")
@@ -245,6 +622,7 @@ class ImageManager(QObject):
             self.imageRemoved.emit(image_info)
 
     def clear_all_images(self):
+        self.operationRequested.emit("clear", {})
         self.unselect_all()
         for image in list(self._images):  # Copy to avoid modifying while iterating
             self.remove_image(image)
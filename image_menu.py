@@ -258,6 +258,12 @@ class ImageMenu(QFrame):
                 right_image = QPixmap(self._image_manager.selected_images[0].path)
                 self.right_image_label.setPixmap(right_image)
 
+    def release_pixmaps(self):
+        """Frees the parent preview pixmaps while they are not shown, they are reloaded on the next selection."""
+        if not self.slider_images_widget.isVisible():
+            self.left_image_label.clear()
+            self.right_image_label.clear()
+
     @pyqtSlot()
     def upload_and_get_qr_code(self):
         if self._qr_blob_manager is None:
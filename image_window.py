@@ -23,6 +23,20 @@ def format_image_name(name: str) -> str:
         return f"{name}"
 
 
+def parents_text(image_info: ImageInfo) -> str:
+    """
+    Format as "Parent: #000012 + #000034" or "Parent: None"
+    """
+    text = "Parent: "
+    if image_info.parent1 is not None:
+        text += format_image_name(image_info.parent1.name)
+        if image_info.parent2 is not None:
+            text += " + " + format_image_name(image_info.parent2.name)
+    else:
+        text += "None"
+    return text
+
+
 class ImageWindowTitleBar(QWidget):
     def __init__(self, parent=None, name=""):
         super().__init__(parent)
@@ -94,15 +108,7 @@ class DraggableImageWindow(QMainWindow):
         self.score_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.score_label.setStyleSheet("font-size: 24px; font-weight: bold; padding-top: 8px;")
 
-        parents_text = "Parent: "
-        if image_info.parent1 is not None:
-            parents_text += format_image_name(image_info.parent1.name)
-            if image_info.parent2 is not None:
-                parents_text += " + " + format_image_name(image_info.parent2.name)
-        else:
-            parents_text += "None"
-
-        self.parents_label = QLabel(parents_text, self.central_widget)
+        self.parents_label = QLabel(parents_text(image_info), self.central_widget)
         self.parents_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.parents_label.setStyleSheet("font-size: 12px; color: gray; margin-top: -12px;")
 
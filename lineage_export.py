@@ -0,0 +1,364 @@
+"""
+Lineage export, streams a record of every new image to an append-only columnar file and analyses it.
+Run from the repository root to query it, e.g. `python lineage_export.py results/lineage.edl --by-day`.
+
+File layout: a header line with the magic, version and column schema as JSON, followed by row groups. Each row
+group has a fixed size header (magic, rows, payload length, CRC32 of the payload), the compressed length of every
+column and the columns, each zlib compressed on its own, so a query only decompresses the columns it needs.
+Integers are delta encoded, strings dictionary encoded per row group. A torn row group at the end, e.g. after a
+power loss, is ignored by readers and cut off when the writer opens the file again. Image ids are the image
+counter, which starts over after a reset, so images are identified by the epoch of the counter and their id.
+"""
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSlot
+
+from env_config import env_float, env_int
+
+LINEAGE_EXPORT_ENV = "ED_LINEAGE_EXPORT"
+LINEAGE_FILE = "lineage.edl"
+LINEAGE_FLUSH_S = env_float("ED_LINEAGE_FLUSH_S", 60)
+LINEAGE_ROW_GROUP = env_int("ED_LINEAGE_ROW_GROUP", 4096)  # Rows buffered before they are flushed regardless
+FILE_MAGIC = b"EDLINEAGE"
+FORMAT_VERSION = 2  # Version 1 files have no epoch column, all their images count as epoch 0
+GROUP_HEADER = struct.Struct("<4sIII")  # Magic, rows, payload length, CRC32 of the payload
+GROUP_MAGIC = b"LGRP"
+COLUMN_LENGTH = struct.Struct("<I")
+NULL_ID = -1
+NULL_CODE = 0xFFFFFFFF
+COMPRESSION_LEVEL = 6
+NUMERIC_TYPES = {"int64": "q", "float32": "f", "float64": "d"}
+COLUMNS = [("epoch", "float64"), ("id", "int64"), ("parent1", "int64"), ("parent2", "int64"), ("operation", "string"),
+           ("weight", "float32"), ("style", "string"), ("score", "float32"), ("requested", "float64"),
+           ("created", "float64"), ("render_seconds", "float32"), ("path", "string")]
+DEPTH_UNKNOWN = 0xFFFF
+MAX_DEPTH_ROWS = 20  # Deeper lineages are grouped into ranges in the report
+
+
+class LineageRecord(NamedTuple):
+    name: str
+    path: str
+    score: float
+    parent1: Optional[str]
+    parent2: Optional[str]
+    operation: str
+    weight: Optional[float]
+    style: Optional[str]
+    requested: float  # Unix timestamps
+    created: float
+    render_seconds: float
+    epoch: float  # Unix time the image counter was started
+    operation_id: int = 0  # Id of the request, for session recordings, not exported
+
+
+def _image_id(name: Optional[str]) -> int:
+    return int(name) if name is not None else NULL_ID  # Image names are the image counter
+
+
+def _numeric_bytes(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _numeric_array(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def encode_column(kind: str, values: list) -> bytes:
+    if kind == "int64":
+        deltas = array("q", (value - previous for previous, value in zip([0] + values[:-1], values)))
+        return _numeric_bytes(deltas)
+    if kind in NUMERIC_TYPES:
+        return _numeric_bytes(array(NUMERIC_TYPES[kind], (math.nan if value is None else value for value in values)))
+    dictionary: Dict[str, int] = {}
+    codes = array("I", (NULL_CODE if value is None else dictionary.setdefault(value, len(dictionary))
+                        for value in values))
+    entries = "\0".join(dictionary).encode("utf-8")
+    return COLUMN_LENGTH.pack(len(entries)) + entries + _numeric_bytes(codes)
+
+
+def decode_column(kind: str, data: bytes) -> list:
+    if kind == "int64":
+        values, total = [], 0
+        for delta in _numeric_array("q", data):
+            total += delta
+            values.append(total)
+        return values
+    if kind in NUMERIC_TYPES:
+        return _numeric_array(NUMERIC_TYPES[kind], data).tolist()
+    (length,) = COLUMN_LENGTH.unpack_from(data)
+    entries = data[COLUMN_LENGTH.size:COLUMN_LENGTH.size + length].decode("utf-8")
+    dictionary = entries.split("\0") if length > 0 else []
+    codes = _numeric_array("I", data[COLUMN_LENGTH.size + length:])
+    return [None if code == NULL_CODE else dictionary[code] for code in codes]
+
+
+def _header(columns) -> bytes:
+    return FILE_MAGIC + json.dumps({"version": FORMAT_VERSION, "columns": columns}).encode("utf-8") + b"\n"
+
+
+def _read_header(file) -> List[List[str]]:
+    line = file.readline()
+    if not line.startswith(FILE_MAGIC) or not line.endswith(b"\n"):
+        raise ValueError(f"{file.name} is not a lineage file")
+    schema = json.loads(line[len(FILE_MAGIC):])
+    if schema["version"] > FORMAT_VERSION:
+        raise ValueError(f"{file.name} has format version {schema['version']}, only {FORMAT_VERSION} is supported")
+    return schema["columns"]
+
+
+def _valid_length(path: str) -> int:
+    """Length of the file up to the end of its last complete row group, checked by lengths, not checksums."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        _read_header(file)
+        end = file.tell()
+        while end + GROUP_HEADER.size <= size:
+            file.seek(end)
+            magic, _, payload_length, _ = GROUP_HEADER.unpack(file.read(GROUP_HEADER.size))
+            if magic != GROUP_MAGIC or end + GROUP_HEADER.size + payload_length > size:
+                break
+            end += GROUP_HEADER.size + payload_length
+    return end
+
+
+def read_row_groups(path: str, columns: Optional[List[str]] = None) -> Iterator[Dict[str, list]]:
+    """Yields the row groups of a lineage file one at a time, only decoding the requested columns."""
+    with open(path, "rb") as file:
+        schema = _read_header(file)
+        wanted = [index for index, (name, _) in enumerate(schema) if columns is None or name in columns]
+        while True:
+            header = file.read(GROUP_HEADER.size)
+            if not header:
+                return
+            if len(header) < GROUP_HEADER.size:
+                print(f"Lineage: ignoring incomplete row group at the end of {path}")
+                return
+            magic, rows, payload_length, checksum = GROUP_HEADER.unpack(header)
+            payload = file.read(payload_length)
+            if magic != GROUP_MAGIC or len(payload) < payload_length or zlib.crc32(payload) != checksum:
+                print(f"Lineage: ignoring damaged row group at the end of {path}")
+                return
+            lengths = [COLUMN_LENGTH.unpack_from(payload, COLUMN_LENGTH.size * index)[0]
+                       for index in range(len(schema))]
+            offsets = [COLUMN_LENGTH.size * len(schema)]
+            for length in lengths:
+                offsets.append(offsets[-1] + length)
+            yield {schema[index][0]: decode_column(schema[index][1],
+                                                   zlib.decompress(payload[offsets[index]:offsets[index + 1]]))
+                   for index in wanted}
+
+
+class LineageWriter(QObject):
+    """
+    Buffers the lineage record of every image created by the image manager and appends it to the lineage file as a
+    row group every LINEAGE_FLUSH_S seconds, or once LINEAGE_ROW_GROUP records are buffered.
+    """
+
+    def __init__(self, image_manager, path: str, flush_s: float = LINEAGE_FLUSH_S,
+                 row_group: int = LINEAGE_ROW_GROUP):
+        super().__init__()
+        self._path = path
+        self._row_group = max(1, row_group)
+        self._columns: Dict[str, list] = {name: [] for name, _ in COLUMNS}
+        self.rows_written = 0
+        self._open()
+        image_manager.imageCreated.connect(self.on_image_created)
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(flush_s * 1000))
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def _open(self):
+        if os.path.exists(self._path) and os.path.getsize(self._path) > 0:
+            with open(self._path, "rb") as file:
+                columns = _read_header(file)
+            if columns != [list(column) for column in COLUMNS]:
+                root, extension = os.path.splitext(self._path)
+                rotated = f"{root}-{time.strftime('%Y%m%d-%H%M%S')}{extension}"
+                print(f"Lineage: {self._path} has an older schema, moving it to {rotated}")
+                os.replace(self._path, rotated)
+                self._open()
+                return
+            valid_length = _valid_length(self._path)
+            if valid_length < os.path.getsize(self._path):
+                print(f"Lineage: cutting off an incomplete row group at the end of {self._path}")
+                with open(self._path, "r+b") as file:
+                    file.truncate(valid_length)
+        else:
+            with open(self._path, "wb") as file:
+                file.write(_header(COLUMNS))
+
+    @property
+    def buffered(self) -> int:
+        return len(self._columns["id"])
+
+    @pyqtSlot(object)
+    def on_image_created(self, record: LineageRecord):
+        row = {"epoch": record.epoch, "id": _image_id(record.name), "parent1": _image_id(record.parent1),
+               "parent2": _image_id(record.parent2), "operation": record.operation, "weight": record.weight,
+               "style": record.style, "score": float(record.score), "requested": record.requested,
+               "created": record.created, "render_seconds": record.render_seconds, "path": record.path}
+        for name, values in self._columns.items():
+            values.append(row[name])
+        if self.buffered >= self._row_group:
+            self.flush()
+
+    @pyqtSlot()
+    def flush(self):
+        """Appends the buffered records as one row group."""
+        rows = self.buffered
+        if rows == 0:
+            return
+        start = time.perf_counter()
+        blobs = [zlib.compress(encode_column(kind, self._columns[name]), COMPRESSION_LEVEL) for name, kind in COLUMNS]
+        payload = b"".join(COLUMN_LENGTH.pack(len(blob)) for blob in blobs) + b"".join(blobs)
+        with open(self._path, "ab") as file:
+            file.write(GROUP_HEADER.pack(GROUP_MAGIC, rows, len(payload), zlib.crc32(payload)) + payload)
+        for values in self._columns.values():
+            values.clear()
+        self.rows_written += rows
+        print(f"Lineage: flushed {rows} records in {len(payload)} bytes, "
+              f"took {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+class LineageSummary:
+    """
+    Aggregates a lineage file in one pass. Parents are always written before their children, so the ancestry depth
+    of an image follows from the depth of its parents. Depths and scores are kept in compact arrays indexed by image
+    id, the records themselves are never held in memory. Parents are always from the same epoch as their child, the
+    arrays are cleared when a new epoch starts.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.unknown_parents = 0
+        self._depths = array("H")
+        self._scores = array("f")
+        self._epoch: Optional[float] = None
+        self.depth_scores: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0, -math.inf])  # Count, sum, max
+        self.operations: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0.0, 0, 0.0, 0.0])
+        self.day_scores: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, -math.inf])
+        self.deepest = (0, None, None)  # Depth, image id and epoch
+
+    def _ensure(self, image_id: int):
+        if image_id >= len(self._depths):
+            missing = image_id + 1 - len(self._depths)
+            self._depths.extend(array("H", [DEPTH_UNKNOWN]) * missing)
+            self._scores.extend(array("f", [math.nan]) * missing)
+
+    def _parent(self, parent_id: int):
+        """Depth and score of a parent, None for images without that parent."""
+        if parent_id == NULL_ID:
+            return None
+        if parent_id >= len(self._depths) or self._depths[parent_id] == DEPTH_UNKNOWN:
+            self.unknown_parents += 1  # Created before the export was enabled, counted as a root
+            return 0, math.nan
+        return self._depths[parent_id], self._scores[parent_id]
+
+    def _start_epoch(self, epoch: float):
+        self._epoch = epoch
+        self._depths = array("H")
+        self._scores = array("f")
+
+    def add_row_group(self, group: Dict[str, list]):
+        epochs = group.get("epoch") or [0.0] * len(group["id"])  # Not written by version 1
+        for epoch, image_id, parent1, parent2, operation, score, requested, created, render_seconds in zip(
+                epochs, group["id"], group["parent1"], group["parent2"], group["operation"], group["score"],
+                group["requested"], group["created"], group["render_seconds"]):
+            if epoch != self._epoch:
+                self._start_epoch(epoch)
+            parents = [parent for parent in (self._parent(parent1), self._parent(parent2)) if parent is not None]
+            depth = min(1 + max(depth for depth, _ in parents), DEPTH_UNKNOWN - 1) if parents else 0
+            self._ensure(image_id)
+            self._depths[image_id] = depth
+            self._scores[image_id] = score
+            self.records += 1
+            if depth > self.deepest[0] or self.deepest[1] is None:
+                self.deepest = (depth, image_id, epoch)
+            for totals, key in ((self.depth_scores, depth),
+                                (self.day_scores, time.strftime("%Y-%m-%d", time.localtime(created)))):
+                entry = totals[key]
+                entry[0] += 1
+                entry[1] += score
+                entry[2] = max(entry[2], score)
+            parent_scores = [parent_score for _, parent_score in parents if not math.isnan(parent_score)]
+            entry = self.operations[operation]  # Count, score sum, latency sum, improvement count and sum, render sum
+            entry[0] += 1
+            entry[1] += score
+            entry[2] += created - requested
+            if parent_scores:
+                entry[3] += 1
+                entry[4] += score - sum(parent_scores) / len(parent_scores)
+            entry[5] += render_seconds
+
+    def report(self, by_day: bool = False) -> str:
+        if self.records == 0:
+            return "No lineage records."
+        depth, image_id, epoch = self.deepest
+        started = f" of the counter started {time.strftime('%Y-%m-%d', time.localtime(epoch))}" if epoch else ""
+        lines = [f"{self.records} records, deepest lineage {depth} generations (image {image_id}{started}), "
+                 f"{self.unknown_parents} parents not in the file"]
+        lines.append("Operation mix:")
+        lines.append(f"  {'operation':<12} {'count':>9} {'share':>7} {'score':>7} {'vs parents':>11} "
+                     f"{'latency':>9} {'render':>8}")
+        for operation, (count, score_sum, latency_sum, improved, improvement_sum, render_sum) in sorted(
+                self.operations.items(), key=lambda item: -item[1][0]):
+            improvement = f"{improvement_sum / improved:+.3f}" if improved else "-"
+            lines.append(f"  {operation:<12} {int(count):>9} {count / self.records:>7.1%} {score_sum / count:>7.3f} "
+                         f"{improvement:>11} {latency_sum / count:>8.2f}s {render_sum / count:>7.2f}s")
+        max_depth = max(self.depth_scores)
+        width = max(1, math.ceil((max_depth + 1) / MAX_DEPTH_ROWS))
+        lines.append("Score by ancestry depth:")
+        for low in range(0, max_depth + 1, width):
+            entries = [self.depth_scores[depth] for depth in range(low, low + width) if depth in self.depth_scores]
+            if not entries:
+                continue
+            count = sum(entry[0] for entry in entries)
+            label = str(low) if width == 1 else f"{low}-{low + width - 1}"
+            mean = sum(entry[1] for entry in entries) / count
+            lines.append(f"  {label:<12} {int(count):>9} images, mean {mean:.3f}, "
+                         f"max {max(entry[2] for entry in entries):.3f}")
+        if by_day:
+            lines.append("Score by day:")
+            for day, (count, score_sum, best) in sorted(self.day_scores.items()):
+                lines.append(f"  {day:<12} {int(count):>9} images, mean {score_sum / count:.3f}, max {best:.3f}")
+        return "\n".join(lines)
+
+
+QUERY_COLUMNS = ["epoch", "id", "parent1", "parent2", "operation", "score", "requested", "created", "render_seconds"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports ancestry depth, score progression and operation mix "
+                                                 "of a lineage file.")
+    parser.add_argument("path", nargs="?", default=os.path.join("results", LINEAGE_FILE), help="Lineage file")
+    parser.add_argument("--by-day", action="store_true", help="Also report the score progression per day")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = LineageSummary()
+    for group in read_row_groups(arguments.path, QUERY_COLUMNS):
+        summary.add_row_group(group)
+    print(summary.report(arguments.by_day))
+    print(f"Read {os.path.getsize(arguments.path) / 1024:.0f} KB in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
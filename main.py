@@ -7,7 +7,9 @@ from PyQt6.QtWidgets import QApplication
 from dotenv import load_dotenv
 load_dotenv() # Load environment variables from .env file, needed in other modules
 
+from env_config import is_env_enabled
 from main_window import MainWindow
+from resource_governor import ResourceGovernor
 from sklera_inactivity_manager import SkleraInactivityManager
 
 APP_NAME = "evolutionary-diffusion Interactive Ars Demo"
@@ -26,13 +28,6 @@ def check_device():
         print("CUDA and MPS are not available. Using CPU. (NOT RECOMMENDED)")
 
 
-def is_env_enabled(value: str | None) -> bool:
-    """Parses common truthy environment variable values."""
-    if value is None:
-        return False
-    return value.strip().lower() in {"1", "true", "yes", "on"}
-
-
 if __name__ == '__main__':
     os.environ["QT_QPA_PLATFORMTHEME"] = "light"  # Force light theme
     check_device()
@@ -42,14 +37,18 @@ if __name__ == '__main__':
     app.setApplicationName(APP_NAME)
     app.setApplicationDisplayName(APP_NAME)
     app.setApplicationVersion(APP_VERSION)
+    resource_governor = ResourceGovernor()
+    app.installEventFilter(resource_governor)
     sklera_inactivity_manager = None
     if is_env_enabled(os.environ.get("SKLERA_ENABLED")):
         try:
             sklera_inactivity_manager = SkleraInactivityManager()
             app.installEventFilter(sklera_inactivity_manager)
+            app.aboutToQuit.connect(sklera_inactivity_manager.close)
         except ValueError as e:
             # Keep the app usable when optional SKLERA settings are incomplete.
             print(f"SKLERA disabled: {e}")
-    mainWindow = MainWindow(APP_NAME, inactivity_manager=sklera_inactivity_manager)
+    mainWindow = MainWindow(APP_NAME, inactivity_manager=sklera_inactivity_manager,
+                            resource_governor=resource_governor)
     mainWindow.show()
     sys.exit(app.exec())
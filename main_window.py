@@ -3,33 +3,72 @@ import random
 from typing import Optional
 
 from PyQt6.QtCore import Qt, QRect, pyqtSlot
-from PyQt6.QtGui import QColor, QPalette
-from PyQt6.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QPushButton
+from PyQt6.QtGui import QColor, QPalette, QKeySequence, QShortcut
+from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QPushButton, QMessageBox
 
-from image_manager import ImageInfo, ImageManager
+from autopilot import Autopilot, AUTOPILOT_ENV
+from env_config import env_flag
+from history_window import HistoryWindow
+from image_canvas import ImageCanvas, ImageCanvasItem, RENDERER_ENV, CANVAS_RENDERER
+from image_manager import ImageInfo, ImageManager, IMAGE_LOCATION
 from image_menu import ImageMenu
 from image_window import DRAGGABLE_WINDOW_WIDTH, DRAGGABLE_WINDOW_HEIGHT, DraggableImageWindow
 from info_window import InfoWindow
+from lineage_export import LineageWriter, LINEAGE_EXPORT_ENV, LINEAGE_FILE
+from memory_report import MemoryReporter
+from prefetch import CrossoverPrefetcher, MutationPrefetcher, CROSSOVER_PREFETCH_ENV, MUTATION_PREFETCH_ENV
 from qr_blob_manager import QRBlobManager
+from qr_renderer import clear_qr_caches
+from qr_speculator import QRSpeculator, QR_SPECULATIVE_ENABLED_ENV
+from resource_governor import ResourceGovernor, ResourceState
+from session_recorder import SessionRecorder, SESSION_RECORDING_ENV
 from sklera_inactivity_manager import SkleraInactivityManager
+from storage_manager import StorageManager, storage_budget_configured
 
 START_IMAGES = 3
 MAX_FIND_POSITION_TRIES = 10
+MEMORY_REPORT_SHORTCUT = "Ctrl+Shift+M"
 BACKGROUND_COLOR = os.getenv("BACKGROUND_COLOR", "#e0e0e0")
 
 class MainWindow(QMainWindow):
-    def __init__(self, app_name, inactivity_manager: Optional[SkleraInactivityManager] = None):
+    def __init__(self, app_name, inactivity_manager: Optional[SkleraInactivityManager] = None,
+                 resource_governor: Optional[ResourceGovernor] = None):
         super().__init__()
         self._inactivity_manager = inactivity_manager
+        self._resource_governor = resource_governor
         self._image_manager = ImageManager()
         self._qr_blob_manager: Optional[QRBlobManager] = None
+        self._qr_speculator: Optional[QRSpeculator] = None
         try:
             self._qr_blob_manager = QRBlobManager()
             # Finished qr codes are added to the image manager.
             self._qr_blob_manager.qr_image_finished.connect(self._image_manager.manual_add_image)
+            if env_flag(QR_SPECULATIVE_ENABLED_ENV):
+                self._qr_speculator = QRSpeculator(self._image_manager, self._qr_blob_manager)
         except ValueError as e:
             # Keep the app usable without Azure credentials.
             print(f"QR upload disabled: {e}")
+        self._crossover_prefetcher: Optional[CrossoverPrefetcher] = None
+        if env_flag(CROSSOVER_PREFETCH_ENV):
+            self._crossover_prefetcher = CrossoverPrefetcher(self._image_manager)
+            self._image_manager.set_crossover_prefetcher(self._crossover_prefetcher)
+        self._mutation_prefetcher: Optional[MutationPrefetcher] = None
+        if env_flag(MUTATION_PREFETCH_ENV):
+            self._mutation_prefetcher = MutationPrefetcher(self._image_manager)
+            self._image_manager.set_mutation_prefetcher(self._mutation_prefetcher)
+        self._storage_manager: Optional[StorageManager] = None
+        if storage_budget_configured():
+            self._storage_manager = StorageManager(self._image_manager)
+        self._session_recorder: Optional[SessionRecorder] = None
+        if env_flag(SESSION_RECORDING_ENV):
+            self._session_recorder = SessionRecorder(self._image_manager, self._qr_blob_manager)
+        self._autopilot: Optional[Autopilot] = None
+        if env_flag(AUTOPILOT_ENV) and resource_governor is not None:  # Needs the governor to know when it is idle
+            self._autopilot = Autopilot(self._image_manager)
+        self._lineage_writer: Optional[LineageWriter] = None
+        if env_flag(LINEAGE_EXPORT_ENV):
+            self._lineage_writer = LineageWriter(self._image_manager, os.path.join(IMAGE_LOCATION, LINEAGE_FILE))
+            QApplication.instance().aboutToQuit.connect(self._lineage_writer.flush)
         self._image_manager.imageAdded.connect(self.on_image_added)
         self._image_manager.imageRemoved.connect(self.on_image_removed)
 
@@ -71,20 +110,34 @@ class MainWindow(QMainWindow):
         # corner_layout.addWidget(self.austria_button)
         self.info_button = create_button(self, "ℹ️", "Information", self.show_info)
         corner_layout.addWidget(self.info_button)
+        self.history_button = create_button(self, "🖼️", "Browse all Images", self.show_history)
+        corner_layout.addWidget(self.history_button)
         self.trash_button = create_button(self, "🗑️", "Clear all Images", self.clear_all_images)
         corner_layout.addWidget(self.trash_button)
 
         self.image_menu = ImageMenu(self._image_manager, self._qr_blob_manager, self)
         main_layout = QVBoxLayout()
         main_layout.addLayout(corner_layout)
-        central_widget = QWidget()
-        central_widget.setLayout(main_layout)
         main_layout.addStretch()
         main_layout.addWidget(self.image_menu, alignment=Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignBottom)
-        self.setCentralWidget(central_widget)
+        self._canvas: Optional[ImageCanvas] = None
+        if os.getenv(RENDERER_ENV, "").strip().lower() == CANVAS_RENDERER:
+            # Images are drawn on one scene, the controls are overlaid on its viewport
+            self._canvas = ImageCanvas(self._image_manager, BACKGROUND_COLOR, self)
+            self._canvas.viewport().setLayout(main_layout)
+            self.setCentralWidget(self._canvas)
+        else:
+            central_widget = QWidget()
+            central_widget.setLayout(main_layout)
+            self.setCentralWidget(central_widget)
 
         self.frames = []
         self.info_window = None
+        self.history_window = None
+        self._memory_reporter = MemoryReporter()
+        self._register_memory_probes()
+        QShortcut(QKeySequence(MEMORY_REPORT_SHORTCUT), self, self.show_memory_report)  # Hidden, for maintenance
+        self._register_resource_handlers()
         self._initImages()
 
     # If needed to prevent closing
@@ -95,6 +148,46 @@ class MainWindow(QMainWindow):
         for _ in range(START_IMAGES):
             self._image_manager.generate_image()
 
+    def _register_resource_handlers(self):
+        if self._resource_governor is None:
+            return
+        self._resource_governor.register(ResourceState.DEEP_IDLE, "release_menu_pixmaps", self.image_menu.release_pixmaps)
+        self._resource_governor.register(ResourceState.DEEP_IDLE, "clear_qr_caches", clear_qr_caches)
+        self._resource_governor.register(ResourceState.DEEP_IDLE, "prune_render_cache",
+                                         self._image_manager.prune_render_cache)
+        if self._qr_speculator is not None:
+            if self._resource_governor.is_active:
+                self._qr_speculator.pause()  # Uploads only use idle time, the visitor's requests go first
+            self._resource_governor.register(ResourceState.ACTIVE, "pause_qr_speculation", self._qr_speculator.pause)
+            self._resource_governor.register(ResourceState.IDLE, "resume_qr_speculation", self._qr_speculator.resume)
+            self._resource_governor.register(ResourceState.IDLE, "fill_qr_speculation", self._qr_speculator.fill_from_screen)
+        if self._storage_manager is not None:
+            self._resource_governor.register(ResourceState.ACTIVE, "cancel_storage_pass", self._storage_manager.cancel)
+            self._resource_governor.register(ResourceState.IDLE, "compact_storage", self._storage_manager.start_pass)
+        if self._session_recorder is not None:
+            self._resource_governor.register(ResourceState.IDLE, "new_session", self._session_recorder.new_session)
+        if self._lineage_writer is not None:
+            self._resource_governor.register(ResourceState.IDLE, "flush_lineage", self._lineage_writer.flush)
+        if self._autopilot is not None:
+            self._resource_governor.register(ResourceState.IDLE, "start_autopilot", self._autopilot.start)
+            self._resource_governor.register(ResourceState.ACTIVE, "stop_autopilot", self._autopilot.stop)
+            self._resource_governor.register(ResourceState.DEEP_IDLE, "promote_autopilot_champions",
+                                             self._autopilot.promote_champions)
+
+    def _register_memory_probes(self):
+        self._memory_reporter.register_probe("image manager", self._image_manager.memory_usage)
+        if self._autopilot is not None:
+            self._memory_reporter.register_probe("autopilot", self._autopilot.memory_usage)
+        self._memory_reporter.track_type("ImageInfo", ImageInfo)
+        self._memory_reporter.track_type("DraggableImageWindow", DraggableImageWindow)
+        self._memory_reporter.track_type("ImageCanvasItem", ImageCanvasItem)
+        self._memory_reporter.register_counter("frames", lambda: len(self.frames))
+        self._memory_reporter.register_counter("queued tasks", lambda: self._image_manager.queued_task_count)
+        if self._lineage_writer is not None:
+            self._memory_reporter.register_counter("buffered lineage records", lambda: self._lineage_writer.buffered)
+        if self._qr_blob_manager is not None:
+            self._memory_reporter.register_counter("upload threads", lambda: self._qr_blob_manager.upload_count)
+
     def _getRandomRect(self):
         """Tries to find a random rectangle that does not intersect with any of the existing frames in MAX_FIND_POSITION_TRIES
         attempts. Otherwise, just uses the random position."""
@@ -129,9 +222,15 @@ class MainWindow(QMainWindow):
             y = self.height() - DRAGGABLE_WINDOW_HEIGHT
         return QRect(x, y, DRAGGABLE_WINDOW_HEIGHT, DRAGGABLE_WINDOW_HEIGHT)
 
-    def _frameForImage(self, image_info: ImageInfo) -> DraggableImageWindow:
+    def _frameForImage(self, image_info: ImageInfo) -> DraggableImageWindow | ImageCanvasItem:
         return next((f for f in self.frames if f.image_info == image_info), None)
 
+    def _createFrame(self, image_info: ImageInfo) -> DraggableImageWindow | ImageCanvasItem:
+        """Frames are top-level windows by default, or items on the canvas. Both offer the same geometry methods."""
+        if self._canvas is not None:
+            return self._canvas.create_item(image_info)
+        return DraggableImageWindow(image_info, self._image_manager)
+
     @pyqtSlot(ImageInfo)
     def on_image_added(self, image_info: ImageInfo):
         print(f"Image added: {image_info.name}")
@@ -140,7 +239,7 @@ class MainWindow(QMainWindow):
             print("Not showing image, app currently hidden.")
             return
 
-        frame = DraggableImageWindow(image_info, self._image_manager)
+        frame = self._createFrame(image_info)
         if image_info.parent1 is not None:
             parent1_frame = self._frameForImage(image_info.parent1)
             if image_info.parent2 is not None:  # Child created
@@ -175,6 +274,21 @@ class MainWindow(QMainWindow):
         self.info_window.show()
         self.info_window.raise_()
 
+    @pyqtSlot()
+    def show_history(self):
+        if self.history_window is None:
+            self.history_window = HistoryWindow(self._image_manager)
+        self.history_window.show()
+        self.history_window.raise_()
+
+    @pyqtSlot()
+    def show_memory_report(self):
+        report = self._memory_reporter.report()
+        print(report)
+        box = QMessageBox(QMessageBox.Icon.Information, "Memory Report", report, parent=self)
+        box.setStyleSheet("QLabel { font-family: monospace; }")
+        box.exec()
+
     @pyqtSlot(str)
     def change_language(self, language):
         print(f"Change language to {language}")  # TODO maybe language selection
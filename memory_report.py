@@ -0,0 +1,191 @@
+import gc
+import os
+import sys
+import time
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import torch
+from PyQt6.QtCore import QObject, QTimer
+from PyQt6.QtGui import QPixmap
+
+from env_config import env_float
+
+try:
+    import psutil
+except ImportError:  # Optional, RSS is read from the OS directly otherwise
+    psutil = None
+
+MEMORY_REPORT_INTERVAL_MIN = env_float("ED_MEMORY_REPORT_INTERVAL_MIN", 30)  # 0 disables periodic snapshots
+MEMORY_GROWTH_WARN_MB_H = env_float("ED_MEMORY_GROWTH_WARN_MB_H", 50)
+MAX_SNAPSHOTS = 48
+MIN_TREND_SNAPSHOTS = 4  # Snapshots needed before growth is flagged
+MB = 1024 * 1024
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, None if it cannot be determined."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                     ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def torch_allocator_bytes() -> int:
+    """Memory held by the torch allocator of the accelerator, including its cache."""
+    if torch.cuda.is_available():
+        return torch.cuda.memory_reserved()
+    if torch.backends.mps.is_available():
+        return torch.mps.driver_allocated_memory()
+    return 0
+
+
+class MemorySnapshot(NamedTuple):
+    time: float
+    rss: Optional[int]
+    subsystems: Dict[str, int]  # Estimated bytes, may overlap
+    counts: Dict[str, int]  # Live objects
+
+
+class MemoryReporter(QObject):
+    """
+    Breaks the memory of the app down by subsystem and counts live objects, to find leaks in long-running kiosks.
+    Components register probes for their estimated bytes and counters, object types are counted by scanning the
+    garbage collector. Snapshots are logged periodically, a report flags RSS growing faster than
+    MEMORY_GROWTH_WARN_MB_H and counts that grew in each of the last MIN_TREND_SNAPSHOTS snapshots.
+    The garbage collector scan walks every object on the GUI thread, so periodic snapshots skip it and only the
+    report shown on demand includes the tracked types.
+    """
+
+    def __init__(self, interval_min: float = MEMORY_REPORT_INTERVAL_MIN):
+        super().__init__()
+        self._probes: List[Tuple[str, Callable[[], Union[int, Dict[str, int]]]]] = \
+            [("torch allocator", torch_allocator_bytes)]
+        self._counters: List[Tuple[str, Callable[[], int]]] = []
+        self._tracked_types: Dict[str, type] = {"QPixmap": QPixmap, "Tensor": torch.Tensor}
+        self._snapshots = deque(maxlen=MAX_SNAPSHOTS)
+        self._timer = QTimer(self)
+        if interval_min > 0:
+            self._timer.setInterval(int(interval_min * 60 * 1000))
+            self._timer.timeout.connect(self.log_snapshot)
+            self._timer.start()
+
+    def register_probe(self, name: str, probe: Callable[[], Union[int, Dict[str, int]]]):
+        """Registers a function returning the estimated bytes held by a subsystem, or by each of its parts."""
+        self._probes.append((name, probe))
+
+    def register_counter(self, name: str, counter: Callable[[], int]):
+        self._counters.append((name, counter))
+
+    def track_type(self, name: str, object_type: type):
+        """Counts live instances of the type in every snapshot."""
+        self._tracked_types[name] = object_type
+
+    def _scan_objects(self) -> Tuple[Dict[str, int], int, int]:
+        """Counts tracked objects and sums the bytes of live pixmaps and CPU tensors."""
+        counts = {name: 0 for name in self._tracked_types}
+        pixmap_bytes = 0
+        tensor_storages = {}
+        for obj in gc.get_objects():
+            for name, object_type in self._tracked_types.items():
+                if isinstance(obj, object_type):
+                    counts[name] += 1
+            if isinstance(obj, QPixmap) and not obj.isNull():
+                pixmap_bytes += obj.width() * obj.height() * obj.depth() // 8
+            elif isinstance(obj, torch.Tensor) and obj.device.type == "cpu":
+                storage = obj.untyped_storage()
+                tensor_storages[storage.data_ptr()] = storage.nbytes()  # Views share their storage
+        return counts, pixmap_bytes, sum(tensor_storages.values())
+
+    def snapshot(self, scan_objects: bool = True) -> MemorySnapshot:
+        subsystems = {}
+        for name, probe in self._probes:
+            try:
+                size = probe()
+                if isinstance(size, dict):
+                    subsystems.update(size)
+                else:
+                    subsystems[name] = size
+            except Exception as e:
+                print(f"Memory report: probe {name} failed: {e}")
+        counts = {}
+        if scan_objects:
+            counts, pixmap_bytes, tensor_bytes = self._scan_objects()
+            subsystems["pixmaps (live)"] = pixmap_bytes
+            subsystems["cpu tensors (live)"] = tensor_bytes
+        for name, counter in self._counters:
+            try:
+                counts[name] = counter()
+            except Exception as e:
+                print(f"Memory report: counter {name} failed: {e}")
+        snapshot = MemorySnapshot(time.time(), process_rss_bytes(), subsystems, counts)
+        self._snapshots.append(snapshot)
+        return snapshot
+
+    def rss_growth_mb_per_hour(self) -> Optional[float]:
+        """Least squares slope of the RSS over the kept snapshots."""
+        samples = [(snapshot.time, snapshot.rss) for snapshot in self._snapshots if snapshot.rss is not None]
+        if len(samples) < MIN_TREND_SNAPSHOTS:
+            return None
+        mean_time = sum(t for t, _ in samples) / len(samples)
+        mean_rss = sum(rss for _, rss in samples) / len(samples)
+        variance = sum((t - mean_time) ** 2 for t, _ in samples)
+        if variance == 0:
+            return None
+        slope = sum((t - mean_time) * (rss - mean_rss) for t, rss in samples) / variance
+        return slope * 3600 / MB
+
+    def growth_warnings(self) -> List[str]:
+        warnings = []
+        growth = self.rss_growth_mb_per_hour()
+        if growth is not None and growth > MEMORY_GROWTH_WARN_MB_H:
+            warnings.append(f"RSS growing {growth:.1f} MB/h over the last {len(self._snapshots)} snapshots")
+        recent = list(self._snapshots)[-MIN_TREND_SNAPSHOTS:]
+        if len(recent) == MIN_TREND_SNAPSHOTS:
+            for name in recent[-1].counts:
+                if not all(name in snapshot.counts for snapshot in recent):
+                    continue  # Scanned types are only counted in reports shown on demand
+                values = [snapshot.counts.get(name, 0) for snapshot in recent]
+                if all(later > earlier for earlier, later in zip(values, values[1:])):
+                    warnings.append(f"{name} grew in each of the last {MIN_TREND_SNAPSHOTS} snapshots: "
+                                    f"{' -> '.join(str(value) for value in values)}")
+        return warnings
+
+    def report(self, scan_objects: bool = True) -> str:
+        snapshot = self.snapshot(scan_objects)
+        lines = [f"Memory report, RSS {snapshot.rss / MB:.1f} MB" if snapshot.rss is not None
+                 else "Memory report, RSS unavailable"]
+        lines.append("Estimated by subsystem (may overlap):")
+        for name, size in sorted(snapshot.subsystems.items(), key=lambda item: -item[1]):
+            lines.append(f"  {name:<24} {size / MB:>9.1f} MB")
+        lines.append("Live objects:")
+        for name, count in snapshot.counts.items():
+            lines.append(f"  {name:<24} {count:>9}")
+        growth = self.rss_growth_mb_per_hour()
+        if growth is not None:
+            lines.append(f"RSS trend {growth:+.1f} MB/h")
+        lines.extend(f"WARNING: {warning}" for warning in self.growth_warnings())
+        return "\n".join(lines)
+
+    def log_snapshot(self):
+        print(self.report(scan_objects=False))
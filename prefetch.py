@@ -0,0 +1,217 @@
+import os
+import threading
+from abc import ABC, ABCMeta, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSlot
+
+from env_config import env_float, env_int
+from image_manager import BackgroundRender, ImageInfo, ImageManager, RenderResult
+
+CROSSOVER_PREFETCH_ENV = "ED_PREFETCH_CROSSOVER"
+CROSSOVER_PREFETCH_WEIGHTS = [float(weight) for weight in
+                              os.environ.get("ED_CROSSOVER_PREFETCH_WEIGHTS", "0.5,0.4,0.6").split(",")]
+CROSSOVER_PREFETCH_TOLERANCE = env_float("ED_CROSSOVER_PREFETCH_TOLERANCE", 0.1)
+MUTATION_PREFETCH_ENV = "ED_PREFETCH_MUTATION"
+MUTATION_PREFETCH_COUNT = env_int("ED_MUTATION_PREFETCH_COUNT", 1)
+
+
+class PrefetchStats:
+    """Counts whether speculation pays off: hits, misses and render time spent on results nobody used."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.used_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests > 0 else 0.0
+
+    def hit(self, result: RenderResult):
+        self.hits += 1
+        self.used_seconds += result.render_seconds
+
+    def miss(self):
+        self.misses += 1
+
+    def waste(self, seconds: float):
+        self.wasted_seconds += seconds
+
+    def summary(self) -> str:
+        return (f"{self.name} prefetch: {self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), "
+                f"{self.used_seconds:.1f} s used, {self.wasted_seconds:.1f} s wasted")
+
+
+class QObjectABCMeta(type(QObject), ABCMeta):
+    """Metaclass of QObject subclasses with abstract methods, QObject's own metaclass conflicts with ABCMeta."""
+
+
+class SelectionPrefetcher(QObject, ABC, metaclass=QObjectABCMeta):
+    """
+    Base for prefetchers that speculatively render results for the current selection in the background.
+    A change of the selection cancels renders that did not start yet, results of renders that were already
+    running or finished are counted as wasted. Results are stored from the generation thread. Selection changes
+    are handled once the selection settled, selecting a third image briefly drops the count to one.
+    """
+
+    def __init__(self, image_manager: ImageManager, name: str):
+        super().__init__()
+        self._image_manager = image_manager
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._key = None
+        self._update_scheduled = False
+        self.stats = PrefetchStats(name)
+        self._image_manager.selectionCountChanged.connect(self.on_selection_count_changed)
+
+    @abstractmethod
+    def _selection_key(self, count: int):
+        """Returns what to prefetch for the current selection, or None."""
+
+    @abstractmethod
+    def _schedule(self, key):
+        """Schedules the background renders for the selection key."""
+
+    @abstractmethod
+    def _clear_results(self) -> List[RenderResult]:
+        """Removes and returns all stored results."""
+
+    @abstractmethod
+    def _store_result(self, slot, result: RenderResult):
+        """Keeps a finished result, called with the lock held."""
+
+    @pyqtSlot(int)
+    def on_selection_count_changed(self, count: int):
+        if not self._update_scheduled:
+            self._update_scheduled = True
+            QTimer.singleShot(0, self._on_selection_settled)
+
+    def _on_selection_settled(self):
+        self._update_scheduled = False
+        key = self._selection_key(len(self._image_manager.selected_images))
+        if key == self._key:
+            return
+        with self._lock:
+            self._generation += 1
+            self._key = key
+            for result in self._clear_results():
+                self.stats.waste(result.render_seconds)
+        if key is not None:
+            self._schedule(key)
+
+    def _background_render(self, embeds, slot) -> BackgroundRender:
+        generation = self._generation
+        return BackgroundRender(embeds,
+                                on_finished=lambda result: self._store(generation, slot, result),
+                                is_cancelled=lambda: generation != self._generation)
+
+    def _store(self, generation: int, slot, result: RenderResult):
+        with self._lock:
+            if generation == self._generation:
+                self._store_result(slot, result)
+            else:
+                self.stats.waste(result.render_seconds)
+
+    def _record_hit(self, result: RenderResult) -> RenderResult:
+        self.stats.hit(result)
+        print(self.stats.summary())
+        return result
+
+    def _record_miss(self):
+        self.stats.miss()
+        print(self.stats.summary())
+
+
+class CrossoverPrefetcher(SelectionPrefetcher):
+    """
+    Renders crossover children of the selected pair at a few weights in the background, as soon as two images
+    are selected. take returns the result for the requested weight, or the nearest precomputed one within the
+    tolerance.
+    """
+
+    def __init__(self, image_manager: ImageManager, weights=CROSSOVER_PREFETCH_WEIGHTS,
+                 tolerance: float = CROSSOVER_PREFETCH_TOLERANCE):
+        super().__init__(image_manager, "Crossover")
+        self._weights = [round(weight, 2) for weight in weights]
+        self._tolerance = tolerance
+        self._results: Dict[float, RenderResult] = {}
+
+    def _selection_key(self, count: int):
+        return tuple(self._image_manager.selected_images) if count == 2 else None
+
+    def _schedule(self, pair: Tuple[ImageInfo, ImageInfo]):
+        parent1, parent2 = pair
+        print(f"Prefetching crossover of {parent1.name} and {parent2.name} at weights {self._weights}")
+        for weight in self._weights:
+            embeds = self._image_manager.crossover_embeds(parent1, parent2, weight)
+            self._image_manager.schedule_background_render(self._background_render(embeds, weight))
+
+    def _clear_results(self) -> List[RenderResult]:
+        results = list(self._results.values())
+        self._results.clear()
+        return results
+
+    def _store_result(self, weight: float, result: RenderResult):
+        self._results[weight] = result
+
+    def take(self, parent1: ImageInfo, parent2: ImageInfo, weight: float) -> Optional[Tuple[float, RenderResult]]:
+        """
+        Returns and removes the prefetched child closest to the weight together with the weight it was rendered
+        with, or None to render live.
+        """
+        with self._lock:
+            nearest = None
+            if self._key == (parent1, parent2) and self._results:
+                nearest = min(self._results, key=lambda prefetched: abs(prefetched - weight))
+            if nearest is None or abs(nearest - weight) > self._tolerance + 1e-9:
+                self._record_miss()
+                return None
+            print(f"Crossover prefetch hit for weight {weight} (prefetched {nearest})")
+            return nearest, self._record_hit(self._results.pop(nearest))
+
+
+class MutationPrefetcher(SelectionPrefetcher):
+    """
+    Renders mutations of the single selected image in the background, so "Mutate" can show one instantly.
+    """
+
+    def __init__(self, image_manager: ImageManager, count: int = MUTATION_PREFETCH_COUNT):
+        super().__init__(image_manager, "Mutation")
+        self._count = count
+        self._results: List[RenderResult] = []
+
+    def _selection_key(self, count: int):
+        if count != 1:
+            return None
+        image_info = self._image_manager.selected_images[0]
+        return image_info if image_info.selectable and image_info.arguments is not None else None
+
+    def _schedule(self, image_info: ImageInfo):
+        print(f"Prefetching {self._count} mutation(s) of {image_info.name}")
+        for index in range(self._count):
+            embeds = self._image_manager.mutate_embeds(image_info)
+            self._image_manager.schedule_background_render(self._background_render(embeds, index))
+
+    def _clear_results(self) -> List[RenderResult]:
+        results = list(self._results)
+        self._results.clear()
+        return results
+
+    def _store_result(self, index: int, result: RenderResult):
+        self._results.append(result)
+
+    def take(self, image_info: ImageInfo) -> Optional[RenderResult]:
+        """Returns and removes a prefetched mutation of the image, or None to render live."""
+        with self._lock:
+            if self._key != image_info or not self._results:
+                self._record_miss()
+                return None
+            result = self._results.pop(0)
+            # Keep the pool filled, the visitor may mutate the same image again
+            embeds = self._image_manager.mutate_embeds(image_info)
+            self._image_manager.schedule_background_render(self._background_render(embeds, len(self._results)))
+            return self._record_hit(result)
@@ -1,20 +1,48 @@
+import hashlib
 import os
-import qrcode
-from PyQt6.QtCore import QObject, pyqtSignal, QThread
+import shelve
+import threading
+
+from PyQt6.QtCore import QObject, pyqtSignal, QThread, QMutex
+from azure.core.exceptions import ResourceExistsError
 from azure.storage.blob import BlobServiceClient
-from qrcode.image.styledpil import StyledPilImage
 
 from image_manager import ImageInfo, IMAGE_LOCATION
+from qr_renderer import render_qr_image
 
 BLOB_CONTAINER_NAME = os.environ.get("ED_BLOB_CONTAINER_NAME")
 BLOB_KEY = os.environ.get("ED_BLOB_KEY")
 BLOB_URL = os.environ.get("ED_BLOB_URL")
+BLOB_INDEX = "evolutionary_diffusion_blob_index"  # Shelve of content hash to uploaded blob url
+
+_blob_index_lock = threading.Lock()  # Shelve does not support concurrent access from upload threads
+
+
+def content_blob_name(data: bytes, filename: str) -> str:
+    """Names blobs by their content, so equal images share a blob and different images never overwrite each other."""
+    return hashlib.sha256(data).hexdigest() + os.path.splitext(filename)[1]
+
+
+def lookup_blob_url(blob_name: str) -> str | None:
+    with _blob_index_lock, shelve.open(BLOB_INDEX) as db:
+        return db.get(blob_name)
+
+
+def store_blob_url(blob_name: str, url: str):
+    with _blob_index_lock, shelve.open(BLOB_INDEX) as db:
+        db[blob_name] = url
+
 
 class QRBlobManager(QObject):
     """
     Class to manage the uploading of images to the cloud and generating QR codes for downloading.
+    Uploads can either be requested by the visitor (start_upload) or speculatively in the background
+    (prepare_upload), in which case the QR code is only cached on disk and not shown.
     """
     qr_image_finished = pyqtSignal(ImageInfo)
+    qr_code_ready = pyqtSignal(ImageInfo)  # Emitted with the source image whenever a QR code was cached
+    upload_failed = pyqtSignal(ImageInfo)
+    uploadRequested = pyqtSignal(ImageInfo)  # The visitor asked for the QR code of the image
 
     def __init__(self):
         if any(var is None or (isinstance(var, str) and var.strip() == "") for var in [BLOB_CONTAINER_NAME, BLOB_KEY, BLOB_URL]):
@@ -24,51 +52,115 @@ class QRBlobManager(QObject):
 
         # Thread management
         self._current_threads = {}
+        self._requested_images = set()  # Images the visitor is waiting for, emit when their upload finishes
+        self._mutex = QMutex()
+
+    @staticmethod
+    def qr_path_for(input_image: ImageInfo) -> str:
+        return os.path.join(IMAGE_LOCATION, f"{input_image.name}_qr.png")
+
+    def has_qr_code(self, input_image: ImageInfo) -> bool:
+        """A QR code is only valid if it is newer than the image, names are reused after a counter reset."""
+        qr_path = self.qr_path_for(input_image)
+        return os.path.exists(qr_path) and os.path.getmtime(qr_path) >= os.path.getmtime(input_image.path)
+
+    @property
+    def upload_count(self) -> int:
+        return len(self._current_threads)
+
+    def is_uploading(self, input_image: ImageInfo) -> bool:
+        return self._current_threads.get(input_image) is not None
+
+    @staticmethod
+    def _qr_image_info(input_image: ImageInfo) -> ImageInfo:
+        return ImageInfo(path=QRBlobManager.qr_path_for(input_image),
+                         arguments=input_image.arguments, score=input_image.score,
+                         selectable=False, parent1=input_image)
 
     def start_upload(self, input_image: ImageInfo):
         """
         Starts the upload of the current image to the cloud.
         Executes the upload in a separate QThread.
+        When a speculative upload of the same image is already running, its result is shown once finished.
         """
+        self.uploadRequested.emit(input_image)
+        self._mutex.lock()
         if self._current_threads.get(input_image) is not None:
-            print("Thread already running. Do not start_upload twice.")
+            self._requested_images.add(input_image)
+            self._mutex.unlock()
+            print("Upload already running, QR code will be shown when finished.")
             return
+        self._mutex.unlock()
 
-        image_qr_path = os.path.join(IMAGE_LOCATION, f"{input_image.name}_qr.png")
-        # Return the existing QR code
-        goal_image_qr_info = ImageInfo(path=image_qr_path,
-                                       arguments=input_image.arguments, score=input_image.score,
-                                       selectable=False, parent1=input_image)
-
-        if os.path.exists(image_qr_path):
+        if self.has_qr_code(input_image):
             print("QR code already generated, returning existing QR code.")
-            self.qr_image_finished.emit(goal_image_qr_info)
+            self.qr_image_finished.emit(self._qr_image_info(input_image))
             return
 
+        self._start_upload_thread(input_image, requested=True, priority=QThread.Priority.InheritPriority)
+
+    def prepare_upload(self, input_image: ImageInfo) -> bool:
+        """
+        Speculatively uploads the image and caches its QR code without showing it.
+        Runs at low thread priority. Returns True if an upload was started.
+        """
+        if self.is_uploading(input_image) or self.has_qr_code(input_image):
+            return False
+        self._start_upload_thread(input_image, requested=False, priority=QThread.Priority.LowestPriority)
+        return True
+
+    def _start_upload_thread(self, input_image: ImageInfo, requested: bool, priority: QThread.Priority):
+        image_qr_path = self.qr_path_for(input_image)
         current_thread = QThread()
+        self._mutex.lock()
         self._current_threads[input_image] = current_thread
-        client = BlobServiceClient(account_url=BLOB_URL, credential=BLOB_KEY)
+        if requested:
+            self._requested_images.add(input_image)
+        self._mutex.unlock()
 
         def task():
+            succeeded = False
             try:
-                container_client = client.get_container_client(container=BLOB_CONTAINER_NAME)
-                with open(file=input_image.path, mode="rb") as data:
-                    container_client = container_client.upload_blob(input_image.filename, data, overwrite=True)
-                image_url = container_client.url
-                qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_Q)
-                # High error correct for embedded image
-                qr.add_data(image_url)
-                image_qr = qr.make_image(image_factory=StyledPilImage, embeded_image_path=input_image.path)
+                with open(file=input_image.path, mode="rb") as file:
+                    data = file.read()
+                blob_name = content_blob_name(data, input_image.filename)
+                image_url = lookup_blob_url(blob_name)
+                if image_url is None:
+                    image_url = self._upload_blob(blob_name, data)
+                    store_blob_url(blob_name, image_url)
+                else:
+                    print("Image already uploaded, skipping upload for", blob_name)
                 # Copy of image info with qr code embedded
-                image_qr.save(image_qr_path)
-                print("Upload finished for", image_url)
-                self.qr_image_finished.emit(goal_image_qr_info)
+                render_qr_image(image_url, input_image.path).save(image_qr_path)
+                print("Upload finished for", image_url, "" if requested else "(speculative)")
+                succeeded = True
             except Exception as e:
                 print("Exception in upload task:", e)
             finally:
+                self._mutex.lock()
                 self._current_threads.pop(input_image)
+                show_result = input_image in self._requested_images
+                self._requested_images.discard(input_image)
+                self._mutex.unlock()
+                if succeeded:
+                    self.qr_code_ready.emit(input_image)
+                    if show_result:
+                        self.qr_image_finished.emit(self._qr_image_info(input_image))
+                else:
+                    self.upload_failed.emit(input_image)
                 current_thread.quit()
 
         current_thread.run = task
         current_thread.finished.connect(current_thread.deleteLater)
-        current_thread.start()
+        current_thread.start(priority)
+
+    @staticmethod
+    def _upload_blob(blob_name: str, data: bytes) -> str:
+        """Uploads the data without overwriting. An existing blob has the same content as the name is its hash."""
+        client = BlobServiceClient(account_url=BLOB_URL, credential=BLOB_KEY)
+        container_client = client.get_container_client(container=BLOB_CONTAINER_NAME)
+        try:
+            return container_client.upload_blob(blob_name, data, overwrite=False).url
+        except ResourceExistsError:
+            print("Blob already exists in container, reusing", blob_name)
+            return container_client.get_blob_client(blob_name).url
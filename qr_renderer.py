@@ -0,0 +1,65 @@
+import os
+import time
+from functools import lru_cache
+
+import qrcode
+from PIL import Image
+from qrcode.image.styledpil import StyledPilImage
+
+from image_window import IMAGE_SIZE
+
+QR_IMAGE_SIZE = IMAGE_SIZE  # Rendered to the size it is displayed at in the DraggableImageWindow
+QR_BORDER = 4
+QR_MATRIX_CACHE_SIZE = 256
+THUMBNAIL_CACHE_SIZE = 32
+
+
+def _embedded_image_width(total_width: int, box_size: int) -> int:
+    """Mirrors the logo region computed by StyledPilImage, so the thumbnail is pasted without resampling."""
+    logo_width_ish = int(total_width / 4)
+    logo_offset = int((int(total_width / 2) - int(logo_width_ish / 2)) / box_size) * box_size
+    return total_width - logo_offset * 2
+
+
+@lru_cache(maxsize=QR_MATRIX_CACHE_SIZE)
+def _qr_code_for(url: str) -> qrcode.QRCode:
+    """
+    Builds the QR matrix for the url once. The box size is chosen so the rendered QR code is close to QR_IMAGE_SIZE.
+    Cached instances are only read afterwards and can be shared between upload threads.
+    """
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_Q, border=QR_BORDER)  # High error correct for embedded image
+    qr.add_data(url)
+    qr.make(fit=True)
+    qr.box_size = max(1, QR_IMAGE_SIZE // (qr.modules_count + 2 * QR_BORDER))
+    return qr
+
+
+@lru_cache(maxsize=THUMBNAIL_CACHE_SIZE)
+def _thumbnail_for(image_path: str, modified_time: float, width: int) -> Image.Image:
+    with Image.open(image_path) as image:
+        image.draft("RGB", (width, width))  # Lets JPEG decoders skip work, no-op for PNG
+        return image.convert("RGB").resize((width, width), Image.Resampling.LANCZOS)
+
+
+def render_qr_image(url: str, embed_image_path: str) -> Image.Image:
+    """
+    Renders a QR code for the url with a downscaled copy of the image embedded in its center.
+    The QR matrix and the thumbnail are cached, the result is sized for display.
+    """
+    start = time.perf_counter()
+    qr = _qr_code_for(url)
+    total_width = (qr.modules_count + 2 * qr.border) * qr.box_size
+    thumbnail = _thumbnail_for(embed_image_path, os.path.getmtime(embed_image_path),
+                               _embedded_image_width(total_width, qr.box_size))
+    image_qr = qr.make_image(image_factory=StyledPilImage, embeded_image=thumbnail).get_image()
+    if image_qr.size != (QR_IMAGE_SIZE, QR_IMAGE_SIZE):
+        image_qr = image_qr.resize((QR_IMAGE_SIZE, QR_IMAGE_SIZE), Image.Resampling.NEAREST)  # Keep modules sharp
+    print(f"QR code rendered in {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({qr.modules_count} modules, box size {qr.box_size})")
+    return image_qr
+
+
+def clear_qr_caches():
+    """Drops cached thumbnails and QR matrices, they are rebuilt on the next render."""
+    _thumbnail_for.cache_clear()
+    _qr_code_for.cache_clear()
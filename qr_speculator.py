@@ -0,0 +1,110 @@
+from collections import deque
+
+from PyQt6.QtCore import QObject, pyqtSlot, QTimer
+
+from env_config import env_int, env_float
+from image_manager import ImageInfo, ImageManager
+from qr_blob_manager import QRBlobManager
+
+QR_SPECULATIVE_ENABLED_ENV = "ED_QR_SPECULATIVE"
+QR_SPECULATIVE_BUDGET = env_int("ED_QR_SPECULATIVE_BUDGET", 50)
+QR_SPECULATIVE_MIN_SCORE = env_float("ED_QR_SPECULATIVE_MIN_SCORE", 6.5)
+BUSY_RETRY_MS = 2000
+
+
+class QRSpeculator(QObject):
+    """
+    Speculatively uploads images and caches their QR codes in the background, so the QR code can be shown
+    almost immediately when the visitor asks for it.
+    Candidates are the currently selected image (highest priority) and newly added images with a high score.
+    Only one speculative upload runs at a time, at most budget uploads are started per session and
+    speculation pauses while the image manager is generating images or while it is paused by the resource governor.
+    """
+
+    def __init__(self, image_manager: ImageManager, qr_blob_manager: QRBlobManager,
+                 budget: int = QR_SPECULATIVE_BUDGET, min_score: float = QR_SPECULATIVE_MIN_SCORE):
+        super().__init__()
+        self._image_manager = image_manager
+        self._qr_blob_manager = qr_blob_manager
+        self._budget = budget
+        self._min_score = min_score
+        self._candidates = deque()
+        self._in_flight = None
+        self._paused = False
+        self._retry_timer = QTimer(self)
+        self._retry_timer.setSingleShot(True)
+        self._retry_timer.setInterval(BUSY_RETRY_MS)
+        self._retry_timer.timeout.connect(self._pump)
+
+        self._image_manager.imageAdded.connect(self.on_image_added)
+        self._image_manager.imageRemoved.connect(self.on_image_removed)
+        self._image_manager.selectionChanged.connect(self.on_selection_changed)
+        self._image_manager.isLoadingChanged.connect(self.on_loading_changed)
+        self._qr_blob_manager.qr_code_ready.connect(self.on_upload_done)
+        self._qr_blob_manager.upload_failed.connect(self.on_upload_done)
+
+    def pause(self):
+        """Stops starting speculative uploads, e.g. while a visitor is interacting. Running uploads finish."""
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+        self._pump()
+
+    def fill_from_screen(self):
+        """Queues every image on screen regardless of score, used to make use of idle time."""
+        for image_info in self._image_manager.images:
+            if image_info.selectable and image_info not in self._candidates:
+                self._candidates.append(image_info)
+        self._pump()
+
+    @pyqtSlot(ImageInfo)
+    def on_image_added(self, image_info: ImageInfo):
+        if image_info.selectable and image_info.score >= self._min_score and image_info not in self._candidates:
+            self._candidates.append(image_info)
+            self._pump()
+
+    @pyqtSlot(ImageInfo)
+    def on_image_removed(self, image_info: ImageInfo):
+        if image_info in self._candidates:
+            self._candidates.remove(image_info)
+
+    @pyqtSlot(ImageInfo, bool)
+    def on_selection_changed(self, image_info: ImageInfo, selected: bool):
+        if not selected or not image_info.selectable:
+            return
+        # Selected images are the most likely to be downloaded, move them to the front
+        if image_info in self._candidates:
+            self._candidates.remove(image_info)
+        self._candidates.appendleft(image_info)
+        self._pump()
+
+    @pyqtSlot(bool)
+    def on_loading_changed(self, loading: bool):
+        if not loading:
+            self._pump()
+
+    @pyqtSlot(ImageInfo)
+    def on_upload_done(self, image_info: ImageInfo):
+        if image_info == self._in_flight:
+            self._in_flight = None
+        self._pump()
+
+    def _pump(self):
+        """Starts the next speculative upload if nothing else is running and budget is left."""
+        if self._paused or self._in_flight is not None:
+            return
+        if self._image_manager.is_busy:
+            # Generation has priority, check again later as loading signals may arrive before the queue drained
+            if self._candidates and not self._retry_timer.isActive():
+                self._retry_timer.start()
+            return
+        while self._candidates and self._budget > 0:
+            candidate = self._candidates.popleft()
+            if candidate not in self._image_manager.images:
+                continue
+            if self._qr_blob_manager.prepare_upload(candidate):
+                self._in_flight = candidate
+                self._budget -= 1
+                print(f"Speculative QR upload for {candidate.name}, remaining budget {self._budget}")
+                return
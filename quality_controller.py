@@ -0,0 +1,87 @@
+import math
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+
+from env_config import env_float, env_int
+
+ADAPTIVE_QUALITY_ENV = "ED_ADAPTIVE_QUALITY"
+LATENCY_TARGET_P95_S = env_float("ED_LATENCY_TARGET_P95_S", 4.0)
+LATENCY_WINDOW = env_int("ED_LATENCY_WINDOW", 20)
+MIN_SAMPLES = 5  # Measurements needed at a level before it is judged
+HEADROOM_FACTOR = 0.6  # Quality is only raised when p95 is well below the target, avoids oscillation
+
+
+class QualityLevel(NamedTuple):
+    inference_steps: Optional[int]  # None in applied levels, when the image creator does not support the option
+    resolution: Optional[int]
+    batch_size: Optional[int]  # Upper limit for Best-of-K candidates
+
+
+QUALITY_LEVELS = [  # Highest quality first
+    QualityLevel(4, 512, 4),
+    QualityLevel(4, 512, 2),
+    QualityLevel(3, 512, 2),
+    QualityLevel(3, 512, 1),
+    QualityLevel(2, 512, 1),
+    QualityLevel(1, 512, 1),
+    QualityLevel(1, 384, 1),
+    QualityLevel(1, 256, 1),
+]
+DEFAULT_LEVEL = QUALITY_LEVELS.index(QualityLevel(3, 512, 1))  # Former fixed configuration
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class QualityController:
+    """
+    Holds the p95 latency of image operations below a target by moving along QUALITY_LEVELS.
+    Measurements are collected in a sliding window. When the p95 exceeds the target, quality is lowered one
+    level; when it is below HEADROOM_FACTOR of the target, quality is raised again. apply returns what it could
+    actually apply, levels that change nothing applicable are skipped. The window is cleared after every change,
+    so each level is judged on its own measurements. Every adjustment is logged with the applied values.
+    """
+
+    def __init__(self, apply: Callable[[QualityLevel], QualityLevel], target_p95_seconds: float = LATENCY_TARGET_P95_S,
+                 window: int = LATENCY_WINDOW, level: int = DEFAULT_LEVEL):
+        self._apply = apply
+        self._target = target_p95_seconds
+        self._latencies = deque(maxlen=window)
+        self._level = level
+        self._applied = self._apply(self.level)  # Start from a known level, not what the image creator was built with
+
+    @property
+    def level(self) -> QualityLevel:
+        return QUALITY_LEVELS[self._level]
+
+    def record(self, seconds: float):
+        self._latencies.append(seconds)
+        if len(self._latencies) < MIN_SAMPLES:
+            return
+        p95 = percentile(self._latencies, 0.95)
+        if p95 > self._target and self._level < len(QUALITY_LEVELS) - 1:
+            self._change_level(1, p95)
+        elif p95 < self._target * HEADROOM_FACTOR and self._level > 0:
+            self._change_level(-1, p95)
+
+    def _change_level(self, step: int, p95: float):
+        """Moves to the next level in the direction of step that changes an applicable option."""
+        old = self._applied
+        level = self._level + step
+        while 0 <= level < len(QUALITY_LEVELS):
+            new = self._apply(QUALITY_LEVELS[level])
+            if new != old:
+                break
+            level += step
+        else:
+            self._latencies.clear()  # Nothing applicable left in this direction, judge the level again later
+            return
+        self._level = level
+        self._applied = new
+        self._latencies.clear()
+        changes = [f"{option} {before} -> {after}" for option, before, after in
+                   zip(("steps", "resolution", "batch"), old, new) if before != after]
+        print(f"Quality controller: p95 {p95:.2f} s (target {self._target:.2f} s), "
+              f"{'lowering' if step > 0 else 'raising'} quality: {', '.join(changes)}")
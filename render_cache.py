@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+import shelve
+import threading
+from typing import Dict, Optional, Tuple
+
+import torch
+from PIL import Image
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+
+from env_config import env_float
+from image_history import genome_from_tensors, genome_to_tensors
+
+RENDER_CACHE_ENV = "ED_RENDER_CACHE"
+RENDER_CACHE_TOLERANCE = env_float("ED_RENDER_CACHE_TOLERANCE", 0.0)  # 0 only reuses identical genomes
+RENDER_CACHE_INDEX = "evolutionary_diffusion_render_cache"  # Shelve of key to (name, score, config, sketch, png hash)
+RENDER_CACHE_GENOMES = "render_cache"  # Exact genomes of cached renders, for nearest neighbour matches
+SKETCH_SIZE = 64  # Sampled coordinates per embedding used to find nearest neighbour candidates
+MAX_VERIFIED_NEIGHBOURS = 3
+
+
+def genome_key(embeds: PooledPromptEmbedData, render_config: str) -> str:
+    """Canonical hash of the genome as passed to the image creator, together with the render configuration."""
+    digest = hashlib.sha256(render_config.encode())
+    for tensor in (embeds.prompt_embeds, embeds.pooled_prompt_embeds):
+        digest.update(f"{tuple(tensor.shape)}{tensor.dtype}".encode())
+        digest.update(tensor.detach().to("cpu", torch.float32).contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Persistent cache from genome hash to an already rendered image and its score. Rendering is deterministic, so a
+    hit replaces diffusion and scoring with reading the png. Entries point to the png in the results folder by name
+    and its sha256, they are dropped once the png was deleted or replaced, e.g. after the image counter was reset.
+    With a tolerance, genomes whose elements all differ by at most that much also count as hits. Candidates are
+    found by comparing a sketch of sampled coordinates and verified against the exact rendered genome, which is
+    kept next to the cache as the history may only have a reduced precision copy.
+    """
+
+    def __init__(self, image_location: str, tolerance: float = RENDER_CACHE_TOLERANCE, reset: bool = False):
+        self._image_location = image_location
+        self._genome_location = os.path.join(image_location, RENDER_CACHE_GENOMES)
+        self._tolerance = tolerance
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[str, float, str, str]] = {}
+        self._sketch_keys = []
+        self._sketches = []
+        self._sketch_matrix: Optional[torch.Tensor] = None
+        self._sketch_indices: Dict[int, torch.Tensor] = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self._genome_location, exist_ok=True)
+        with shelve.open(RENDER_CACHE_INDEX) as db:
+            if reset:  # Image names are reused once the counter was reset
+                db.clear()
+            for key, entry in list(db.items()):
+                if len(entry) != 5:  # Written without the png hash
+                    del db[key]
+                    continue
+                name, score, render_config, sketch, png_hash = entry
+                self._add_entry(key, name, score, render_config, png_hash, torch.tensor(sketch))
+        if reset:
+            for filename in os.listdir(self._genome_location):
+                os.remove(os.path.join(self._genome_location, filename))
+
+    def _image_path(self, name: str) -> str:
+        return os.path.join(self._image_location, f"{name}.png")
+
+    def _genome_path(self, key: str) -> str:
+        return os.path.join(self._genome_location, f"{key}.pt")
+
+    def _sketch(self, embeds: PooledPromptEmbedData) -> torch.Tensor:
+        parts = []
+        for tensor in (embeds.prompt_embeds, embeds.pooled_prompt_embeds):
+            flat = tensor.detach().reshape(-1)
+            indices = self._sketch_indices.get(flat.numel())
+            if indices is None:  # Same coordinates for every genome of this size, across sessions
+                generator = torch.Generator().manual_seed(flat.numel())
+                indices = torch.randperm(flat.numel(), generator=generator)[:SKETCH_SIZE]
+                self._sketch_indices[flat.numel()] = indices
+            parts.append(flat[indices.to(flat.device)].to("cpu", torch.float32))
+        return torch.cat(parts)
+
+    def _add_entry(self, key: str, name: str, score: float, render_config: str, png_hash: str,
+                   sketch: torch.Tensor):
+        self._entries[key] = (name, score, render_config, png_hash)
+        self._sketch_keys.append(key)
+        self._sketches.append(sketch)
+        self._sketch_matrix = None
+
+    def _remove_entry(self, key: str):
+        self._entries.pop(key, None)
+        if key in self._sketch_keys:
+            index = self._sketch_keys.index(key)
+            del self._sketch_keys[index]
+            del self._sketches[index]
+            self._sketch_matrix = None
+        with shelve.open(RENDER_CACHE_INDEX) as db:
+            db.pop(key, None)
+        if os.path.exists(self._genome_path(key)):
+            os.remove(self._genome_path(key))
+
+    def _load(self, key: str) -> Optional[Tuple[str, float, Image.Image]]:
+        name, score, _, png_hash = self._entries[key]
+        path = self._image_path(name)
+        if not os.path.exists(path):  # Deleted or archived by the storage manager
+            self._remove_entry(key)
+            return None
+        with open(path, "rb") as file:
+            data = file.read()
+        if hashlib.sha256(data).hexdigest() != png_hash:  # Another image with the same name, or re-encoded
+            print(f"Render cache: {name} changed since it was cached, dropping the entry")
+            self._remove_entry(key)
+            return None
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            return name, score, image.copy()
+
+    def _nearest(self, embeds: PooledPromptEmbedData, render_config: str):
+        """Cached genome and entry within the tolerance, closest sketch first."""
+        if self._sketch_matrix is None:
+            self._sketch_matrix = torch.stack(self._sketches) if self._sketches else None
+        if self._sketch_matrix is None:
+            return None
+        distances = (self._sketch_matrix - self._sketch(embeds)).abs().amax(dim=1)
+        order = torch.argsort(distances)[:MAX_VERIFIED_NEIGHBOURS]
+        for index in order.tolist():
+            if distances[index] > self._tolerance:
+                break
+            key = self._sketch_keys[index]
+            if self._entries[key][2] != render_config or not os.path.exists(self._genome_path(key)):
+                continue
+            cached = genome_from_tensors(torch.load(self._genome_path(key), weights_only=True),
+                                         embeds.prompt_embeds.device)
+            if all((a - b).abs().max().item() <= self._tolerance for a, b in
+                   ((cached.prompt_embeds, embeds.prompt_embeds),
+                    (cached.pooled_prompt_embeds, embeds.pooled_prompt_embeds))):
+                return cached, key
+        return None
+
+    def lookup(self, embeds: PooledPromptEmbedData, render_config: str):
+        """
+        Returns (genome, image, score) of a cached render, or None. The genome is the one that was rendered, which
+        only differs from the requested one for nearest neighbour hits.
+        """
+        with self._lock:
+            key = genome_key(embeds, render_config)
+            genome = embeds
+            if key not in self._entries and self._tolerance > 0:
+                nearest = self._nearest(embeds, render_config)
+                if nearest is not None:
+                    genome, key = nearest
+            loaded = self._load(key) if key in self._entries else None
+            if loaded is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            name, score, image = loaded
+            print(f"Render cache hit: reusing {name} ({self.hits} hits, {self.misses} misses)")
+            return genome, image, score
+
+    def store(self, key: str, name: str, score: float, embeds: PooledPromptEmbedData, render_config: str):
+        with self._lock:
+            if key in self._entries:
+                return
+            with open(self._image_path(name), "rb") as file:
+                png_hash = hashlib.sha256(file.read()).hexdigest()
+            if self._tolerance > 0:
+                torch.save(genome_to_tensors(embeds), self._genome_path(key))
+            sketch = self._sketch(embeds)
+            self._add_entry(key, name, score, render_config, png_hash, sketch)
+            with shelve.open(RENDER_CACHE_INDEX) as db:
+                db[key] = (name, score, render_config, sketch.tolist(), png_hash)
+
+    def prune(self):
+        """Drops entries whose image no longer exists."""
+        with self._lock:
+            for key, (name, _, _, _) in list(self._entries.items()):
+                if not os.path.exists(self._image_path(name)):
+                    self._remove_entry(key)
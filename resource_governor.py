@@ -0,0 +1,100 @@
+import gc
+import time
+from enum import Enum
+from typing import Callable, Dict, List, Tuple
+
+import torch
+from PyQt6.QtCore import QObject, QEvent, QTimer
+
+from env_config import env_int
+
+IDLE_AFTER_MS = env_int("ED_IDLE_AFTER_MS", 60000)
+DEEP_IDLE_AFTER_MS = env_int("ED_DEEP_IDLE_AFTER_MS", 600000)
+POLL_INTERVAL_MS = 1000
+ACTIVITY_EVENTS = (QEvent.Type.MouseMove, QEvent.Type.MouseButtonPress, QEvent.Type.KeyPress, QEvent.Type.TouchBegin)
+
+
+class ResourceState(Enum):
+    ACTIVE = "active"  # Visitor interacting, interactive work has full priority
+    IDLE = "idle"  # Use the time for background work like prefetching and storage compaction
+    DEEP_IDLE = "deep_idle"  # Nobody around for a long time, release memory
+
+
+class ResourceGovernor(QObject):
+    """
+    Tracks visitor activity with a cheap timestamp (updated in the event filter, polled by a timer) and moves
+    between ACTIVE, IDLE and DEEP_IDLE. Other components register handlers for entering a state, e.g. to start or
+    pause background work. Each transition is logged with the time its handlers took.
+    The first interaction switches back to ACTIVE immediately, inside the event filter.
+    """
+
+    def __init__(self, idle_after_ms: int = IDLE_AFTER_MS, deep_idle_after_ms: int = DEEP_IDLE_AFTER_MS):
+        super().__init__()
+        self._idle_after_s = idle_after_ms / 1000
+        self._deep_idle_after_s = max(deep_idle_after_ms, idle_after_ms) / 1000
+        self._last_activity = time.monotonic()
+        self._state = ResourceState.ACTIVE
+        self._handlers: Dict[ResourceState, List[Tuple[str, Callable[[], None]]]] = {state: [] for state in ResourceState}
+        self.register(ResourceState.DEEP_IDLE, "release_memory", release_memory)
+
+        self._poll_timer = QTimer(self)
+        self._poll_timer.setInterval(POLL_INTERVAL_MS)
+        self._poll_timer.timeout.connect(self._poll)
+        self._poll_timer.start()
+
+    @property
+    def state(self) -> ResourceState:
+        return self._state
+
+    @property
+    def is_active(self) -> bool:
+        return self._state == ResourceState.ACTIVE
+
+    @property
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self._last_activity
+
+    def register(self, state: ResourceState, name: str, handler: Callable[[], None]):
+        """Registers a handler that is called when the given state is entered."""
+        self._handlers[state].append((name, handler))
+
+    def eventFilter(self, obj, event):
+        if event.type() in ACTIVITY_EVENTS:
+            self._last_activity = time.monotonic()
+            if self._state != ResourceState.ACTIVE:
+                self._transition(ResourceState.ACTIVE)
+        return super().eventFilter(obj, event)
+
+    def _poll(self):
+        idle = self.idle_seconds
+        if idle >= self._deep_idle_after_s and self._state != ResourceState.DEEP_IDLE:
+            if self._state == ResourceState.ACTIVE:
+                self._transition(ResourceState.IDLE)  # Run idle work as well when polling skipped the idle state
+            self._transition(ResourceState.DEEP_IDLE)
+        elif self._deep_idle_after_s > idle >= self._idle_after_s and self._state == ResourceState.ACTIVE:
+            self._transition(ResourceState.IDLE)
+
+    def _transition(self, new_state: ResourceState):
+        old_state = self._state
+        self._state = new_state
+        start = time.perf_counter()
+        timings = []
+        for name, handler in self._handlers[new_state]:
+            handler_start = time.perf_counter()
+            try:
+                handler()
+            except Exception as e:
+                print(f"Resource governor: handler {name} failed: {e}")
+            timings.append(f"{name} {(time.perf_counter() - handler_start) * 1000:.1f} ms")
+        total_ms = (time.perf_counter() - start) * 1000
+        print(f"Resource governor: {old_state.value} -> {new_state.value} after {self.idle_seconds:.0f} s idle, "
+              f"took {total_ms:.1f} ms" + (f" ({', '.join(timings)})" if timings else ""))
+
+
+def release_memory():
+    """Releases memory that can be rebuilt on demand: unreachable objects and torch allocator caches."""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    elif torch.backends.mps.is_available():
+        torch.mps.empty_cache()
@@ -0,0 +1,173 @@
+import copy
+import math
+import os
+import time
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+from env_config import env_flag, env_float, env_int
+
+VALIDATION_TOLERANCE = 1e-3
+OPTIMIZED_SCORING_ENV = "ED_OPTIMIZED_SCORING"
+OPTIMIZED_SCORING_TOLERANCE = env_float("ED_OPTIMIZED_SCORING_TOLERANCE", 0.05)  # Maximum score difference
+SCORING_THREADS = env_int("ED_SCORING_THREADS", 0)  # 0 keeps the default thread count and logs the fastest
+CALIBRATION_IMAGES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", f"test{index}.png")
+                      for index in range(1, 4)]
+THREAD_TUNING_RUNS = 3
+
+
+def find_predictor(evaluator) -> Tuple[Optional[torch.nn.Module], Optional[object]]:
+    """Looks up the predictor model and image processor used by the evaluator, if it exposes them."""
+    model = processor = None
+    for attribute, value in vars(evaluator).items():
+        if model is None and isinstance(value, torch.nn.Module):
+            model = value
+        elif processor is None and "processor" in attribute.lower() and callable(value):
+            processor = value
+    return model, processor
+
+
+def calibration_images() -> List[Image.Image]:
+    images = []
+    for path in CALIBRATION_IMAGES:
+        with Image.open(path) as image:
+            images.append(image.convert("RGB"))
+    return images
+
+
+class LogitsOnly(torch.nn.Module):
+    """Returns the logits tensor of the predictor, so it can be traced."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        output = self.model(pixel_values=pixel_values)
+        return output.logits if hasattr(output, "logits") else output
+
+
+class OptimizedPredictor:
+    """
+    Aesthetic predictor for fast CPU scoring: linear layers are dynamically quantized to int8 and the model is
+    traced and frozen into a TorchScript graph. The intra-op thread count is process wide and shared with
+    diffusion, so it is only set when ED_SCORING_THREADS is given. Otherwise the fastest count for scoring is measured
+    and logged as a suggestion, the process keeps its default.
+    """
+
+    def __init__(self, model: torch.nn.Module, processor, example_images, threads: int = SCORING_THREADS):
+        self._processor = processor
+        quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(), {torch.nn.Linear},
+                                                           dtype=torch.qint8)
+        example = self._pixel_values(example_images[:1])
+        with torch.no_grad():
+            self._module = torch.jit.freeze(torch.jit.trace(LogitsOnly(quantized).eval(), example, strict=False))
+        if threads > 0:
+            torch.set_num_threads(threads)
+        else:
+            self._tune_threads(example)
+        self.threads = torch.get_num_threads()
+
+    def _pixel_values(self, images) -> torch.Tensor:
+        return self._processor(images=images, return_tensors="pt")["pixel_values"]
+
+    def _tune_threads(self, example: torch.Tensor):
+        cpu_count = os.cpu_count() or 1
+        previous = torch.get_num_threads()
+        best, best_seconds = previous, math.inf
+        try:
+            for threads in sorted({count for count in (1, 2, 4, 8, cpu_count) if count <= cpu_count}):
+                torch.set_num_threads(threads)
+                with torch.no_grad():
+                    self._module(example)  # Warm up
+                    start = time.perf_counter()
+                    for _ in range(THREAD_TUNING_RUNS):
+                        self._module(example)
+                seconds = (time.perf_counter() - start) / THREAD_TUNING_RUNS
+                if seconds < best_seconds:
+                    best, best_seconds = threads, seconds
+        finally:
+            torch.set_num_threads(previous)
+        print(f"Optimized scoring: fastest with {best} threads ({best_seconds * 1000:.1f} ms per image), "
+              f"set ED_SCORING_THREADS to use it, running with {previous}")
+
+    def predict(self, images) -> List[float]:
+        with torch.no_grad():
+            logits = self._module(self._pixel_values(images))
+        return logits.flatten().float().tolist()
+
+
+class ImageScorer:
+    """
+    Scores a batch of images with the AestheticsImageEvaluator's predictor in a single forward pass.
+    The evaluator only returns one score per call, so its predictor and processor are used directly. The batched
+    path is checked against the evaluator on its first use and disabled if the scores differ, scoring then falls
+    back to one evaluator call per image.
+    With ED_OPTIMIZED_SCORING, all images are scored by an OptimizedPredictor instead, if its scores for the
+    bundled test images are within OPTIMIZED_SCORING_TOLERANCE of the evaluator.
+    """
+
+    def __init__(self, evaluator):
+        self._evaluator = evaluator
+        self._model, self._processor = find_predictor(evaluator)
+        self._validated = False
+        if self._model is None or self._processor is None:
+            print("Batched scoring unavailable, evaluator does not expose its predictor. Scoring images one by one.")
+            self._model = None
+        self._optimized = self._create_optimized() if self._model is not None and env_flag(OPTIMIZED_SCORING_ENV) \
+            else None
+
+    @property
+    def optimized(self) -> bool:
+        return self._optimized is not None
+
+    def _create_optimized(self) -> Optional[OptimizedPredictor]:
+        try:
+            images = calibration_images()
+            predictor = OptimizedPredictor(self._model, self._processor, images)
+            expected = [self.evaluate_single(image) for image in images]
+            actual = [predictor.predict([image])[0] for image in images]
+        except Exception as e:
+            print("Optimized scoring unavailable:", e)
+            return None
+        difference = max(abs(a - b) for a, b in zip(actual, expected))
+        if difference > OPTIMIZED_SCORING_TOLERANCE:
+            print(f"Optimized scoring differs by {difference:.4f} from the evaluator "
+                  f"(tolerance {OPTIMIZED_SCORING_TOLERANCE}), using the evaluator.")
+            return None
+        print(f"Optimized scoring enabled, maximum difference {difference:.4f} on {len(images)} test images.")
+        return predictor
+
+    def evaluate_single(self, image) -> float:
+        return self._evaluator.evaluate(SimpleNamespace(images=[image]))
+
+    def _predict(self, images) -> List[float]:
+        inputs = self._processor(images=images, return_tensors="pt")
+        parameter = next(self._model.parameters())
+        with torch.no_grad():  # The predictor may run in half precision, the processor returns float32
+            output = self._model(pixel_values=inputs["pixel_values"].to(parameter.device, parameter.dtype))
+        logits = output.logits if hasattr(output, "logits") else output
+        return logits.flatten().float().tolist()
+
+    def score(self, images) -> List[float]:
+        if self._optimized is not None:
+            return self._optimized.predict(images)
+        if self._model is None or len(images) == 1:
+            return [self.evaluate_single(image) for image in images]
+        try:
+            scores = self._predict(images)
+        except Exception as e:
+            print("Batched scoring failed, disabling it:", e)
+            self._model = None
+            return [self.evaluate_single(image) for image in images]
+        if not self._validated:
+            expected = self.evaluate_single(images[0])
+            if abs(scores[0] - expected) > VALIDATION_TOLERANCE:
+                print(f"Batched scoring differs from evaluator ({scores[0]:.4f} vs {expected:.4f}), disabling it.")
+                self._model = None
+                return [expected] + [self.evaluate_single(image) for image in images[1:]]
+            self._validated = True
+        return scores
@@ -0,0 +1,86 @@
+import json
+import os
+import time
+from typing import Dict, Optional
+
+from PyQt6.QtCore import QObject, pyqtSlot
+
+from image_manager import ImageInfo, ImageManager
+from lineage_export import LineageRecord
+from qr_blob_manager import QRBlobManager
+
+SESSION_RECORDING_ENV = "ED_RECORD_SESSIONS"
+SESSION_LOCATION = "sessions"
+SESSION_FORMAT_VERSION = 2  # Version 1 has no operation ids, results are matched in request order
+RESULT_OPERATIONS = {"generate", "mutate", "crossover", "promote"}  # Operations that each add one new image
+UNTIMED_OPERATIONS = {"promote"}  # Rendered in the background before they were requested
+
+
+def session_path(started: float, location: str = SESSION_LOCATION) -> str:
+    return os.path.join(location, time.strftime("%Y%m%d-%H%M%S", time.localtime(started)) + ".jsonl")
+
+
+class SessionRecorder(QObject):
+    """
+    Records the operations of visitors as JSON lines in the sessions folder, for replay with session_replay.py.
+    Every line has the seconds since the session started ("t") and the operation ("op"). Images are referenced by
+    name. Operations that create an image carry an id, added images are logged with the id of the operation they
+    are the result of, so a replay can match them even when prefetched results finish out of order.
+    A new session file is started whenever the installation becomes idle.
+    """
+
+    def __init__(self, image_manager: ImageManager, qr_blob_manager: Optional[QRBlobManager] = None,
+                 location: str = SESSION_LOCATION):
+        super().__init__()
+        self._location = location
+        self._file = None
+        self._started = 0.0
+        self._operation_ids: Dict[str, int] = {}  # Created image name to the id of its operation
+        os.makedirs(location, exist_ok=True)
+        image_manager.operationRequested.connect(self.on_operation)
+        image_manager.imageCreated.connect(self.on_image_created)
+        image_manager.imageAdded.connect(self.on_image_added)
+        image_manager.selectionChanged.connect(self.on_selection_changed)
+        if qr_blob_manager is not None:
+            qr_blob_manager.uploadRequested.connect(self.on_upload_requested)
+
+    def _write(self, op: str, **fields):
+        if self._file is None:
+            self._started = time.time()
+            self._file = open(session_path(self._started, self._location), "a", encoding="utf-8")
+            self._file.write(json.dumps({"t": 0.0, "op": "session", "version": SESSION_FORMAT_VERSION,
+                                         "started": self._started}) + "\n")
+        line = {"t": round(time.time() - self._started, 3), "op": op}
+        line.update(fields)
+        self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def new_session(self):
+        """Closes the current session file, the next operation starts a new one."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @pyqtSlot(str, object)
+    def on_operation(self, op: str, parameters: dict):
+        self._write(op, **parameters)
+
+    @pyqtSlot(object)
+    def on_image_created(self, record: LineageRecord):
+        self._operation_ids[record.name] = record.operation_id  # Emitted before the image is added
+
+    @pyqtSlot(ImageInfo)
+    def on_image_added(self, image_info: ImageInfo):
+        # QR codes and restored images are added without an operation that waits for them
+        operation_id = self._operation_ids.pop(image_info.name, None)
+        fields = {"operation": operation_id} if operation_id is not None else {}
+        self._write("added", image=image_info.name, score=round(float(image_info.score), 4),
+                    result=operation_id is not None, **fields)
+
+    @pyqtSlot(ImageInfo, bool)
+    def on_selection_changed(self, image_info: ImageInfo, selected: bool):
+        self._write("select", image=image_info.name, selected=selected)
+
+    @pyqtSlot(ImageInfo)
+    def on_upload_requested(self, image_info: ImageInfo):
+        self._write("upload", image=image_info.name)
@@ -0,0 +1,306 @@
+"""
+Replays recorded visitor sessions headless, to load test a configuration with real visitor traffic.
+Run from the repository root, e.g. `python session_replay.py sessions/ --speed 4 --stub`.
+Without --stub the configured backend is used, the local image creator or ED_GENERATION_SERVICE_URL.
+Replays run in a temporary folder, so the results and counters of the installation are not touched.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+load_dotenv()  # Load environment variables from .env file, needed in other modules
+
+import torch
+from PIL import Image
+from PyQt6.QtCore import QCoreApplication, QObject, QTimer, pyqtSlot
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+from evolutionary_prompt_embedding.value_ranges import SDXLTurboEmbeddingRange, SDXLTurboPooledEmbeddingRange
+
+from env_config import env_flag
+from image_manager import ImageInfo, ImageManager
+from lineage_export import LineageRecord
+from prefetch import CrossoverPrefetcher, MutationPrefetcher, CROSSOVER_PREFETCH_ENV, MUTATION_PREFETCH_ENV
+from qr_blob_manager import QRBlobManager
+from quality_controller import percentile
+from session_recorder import RESULT_OPERATIONS, UNTIMED_OPERATIONS
+
+STUB_IMAGE_SIZE = 64
+FINISH_POLL_MS = 200
+
+
+class StubGenerationBackend:
+    """Stand-in for the image creator, waits like a render and returns a flat image coloured by the genome."""
+
+    def __init__(self, seconds_per_render: float = 1.0, seconds_per_extra_candidate: float = 0.25):
+        self._seconds_per_render = seconds_per_render
+        self._seconds_per_extra_candidate = seconds_per_extra_candidate
+        self._embedding_range = SDXLTurboEmbeddingRange()
+        self._pooled_embedding_range = SDXLTurboPooledEmbeddingRange()
+
+    def render(self, candidates, background: bool = False):
+        time.sleep(self._seconds_per_render + self._seconds_per_extra_candidate * (len(candidates) - 1))
+        images, scores = [], []
+        for embeds in candidates:
+            checksum = zlib.crc32(embeds.pooled_prompt_embeds.detach().float().cpu().numpy().tobytes())
+            images.append(Image.new("RGB", (STUB_IMAGE_SIZE, STUB_IMAGE_SIZE), checksum & 0xFFFFFF))
+            scores.append(4 + (checksum % 4000) / 1000)
+        return images, scores, len(candidates) == 1
+
+    def score(self, images) -> List[float]:
+        return [5.0 for _ in images]
+
+    def prompt_embeds(self, prompt: str, device: torch.device = None) -> PooledPromptEmbedData:
+        return PooledPromptEmbedData(self._embedding_range.random_tensor_in_range(),
+                                     self._pooled_embedding_range.random_tensor_in_range())
+
+    def render_config(self) -> str:
+        return "stub"
+
+    def set_option(self, name: str, value) -> bool:
+        return False
+
+
+def load_sessions(paths: List[str]) -> List[dict]:
+    """Reads session files (or folders of them) and joins them into one timeline, sessions one after another."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".jsonl")))
+        else:
+            files.append(path)
+    events, offset = [], 0.0
+    for file in files:
+        with open(file, encoding="utf-8") as session:
+            session_events = [json.loads(line) for line in session if line.strip()]
+        for event in session_events:
+            event["t"] = event["t"] + offset
+        events.extend(event for event in session_events if event["op"] != "session")
+        if session_events:
+            offset = max(event["t"] for event in session_events)
+    print(f"Loaded {len(events)} events from {len(files)} session(s), {offset:.1f} s of recorded traffic")
+    return events
+
+
+def match_results(events: List[dict]) -> List[float]:
+    """
+    Stores the name of the resulting image in every result operation and returns the recorded latencies.
+    Results are matched by operation id, recordings without ids in the order their operations were requested.
+    Promoted images were rendered before they were requested and are not counted.
+    """
+    by_id: Dict[int, dict] = {}
+    pending = deque()
+    latencies = []
+    for event in events:
+        if event["op"] in RESULT_OPERATIONS:
+            if "id" in event:
+                by_id[event["id"]] = event
+            else:
+                pending.append(event)
+        elif event["op"] == "added" and event.get("result"):
+            if "operation" in event:
+                operation = by_id.pop(event["operation"], None)
+            else:
+                operation = pending.popleft() if pending else None
+            if operation is None:
+                continue
+            operation["result"] = event["image"]
+            if operation["op"] not in UNTIMED_OPERATIONS:
+                latencies.append(event["t"] - operation["t"])
+    return latencies
+
+
+class SessionReplay(QObject):
+    """
+    Issues the recorded operations against an ImageManager at their recorded time divided by the speed. Operations
+    on images that the replay did not produce yet wait for them. Images are mapped from recorded to replayed by
+    the id of the operation that created them, unknown images fall back to the newest ones on screen.
+    """
+
+    def __init__(self, events: List[dict], image_manager: ImageManager, speed: float = 1.0, qr_blob_manager=None):
+        super().__init__()
+        self._operations = [event for event in events if event["op"] != "added"]
+        self._expected = {event["result"] for event in self._operations if "result" in event}
+        self._image_manager = image_manager
+        self._qr_blob_manager = qr_blob_manager
+        self._speed = speed
+        self._index = 0
+        self._images: Dict[str, ImageInfo] = {}
+        self._pending: Dict[int, tuple] = {}  # Operation id to (start time, recorded result name)
+        self._created: Dict[str, Optional[str]] = {}  # Replayed image name to recorded name, until it was added
+        self._operation_id: Optional[int] = None
+        self._waiting = False
+        self._start = 0.0
+        self.latencies: List[float] = []
+        self.executed = Counter()
+        self.skipped = Counter()
+        self._finished = None
+        self._image_manager.operationRequested.connect(self.on_operation_requested)
+        self._image_manager.imageCreated.connect(self.on_image_created)
+        self._image_manager.imageAdded.connect(self.on_image_added)
+
+    def start(self):
+        self._start = time.monotonic()
+        self._next()
+
+    def _replay_image(self, name: str, fallback: int = 1) -> Optional[ImageInfo]:
+        image_info = self._images.get(name)
+        if image_info is not None and image_info in self._image_manager.images:
+            return image_info
+        selectable = [image for image in self._image_manager.images if image.selectable]
+        return selectable[-fallback] if len(selectable) >= fallback else None
+
+    def _waits_for_image(self, operation: dict) -> bool:
+        names = operation.get("parents") or ([operation["image"]] if "image" in operation else [])
+        return any(name not in self._images and name in self._expected for name in names) and bool(self._pending)
+
+    @pyqtSlot()
+    def _next(self):
+        if self._index >= len(self._operations):
+            self._finish_when_idle()
+            return
+        operation = self._operations[self._index]
+        due = operation["t"] / self._speed - (time.monotonic() - self._start)
+        if due > 0:
+            QTimer.singleShot(int(due * 1000), self._next)
+            return
+        if self._waits_for_image(operation):
+            self._waiting = True  # Resumed when the next image was added
+            return
+        self._index += 1
+        if self._execute(operation):
+            self.executed[operation["op"]] += 1
+        else:
+            self.skipped[operation["op"]] += 1
+        QTimer.singleShot(0, self._next)
+
+    def _execute(self, operation: dict) -> bool:
+        op = operation["op"]
+        start = time.monotonic()
+        self._operation_id = None
+        if op == "generate":
+            self._image_manager.generate_image(style=operation.get("style"), weight=operation.get("weight"))
+        elif op == "mutate":
+            image_info = self._replay_image(operation["image"])
+            if image_info is None:
+                return False
+            self._image_manager.mutate_image(image_info)
+        elif op == "crossover":
+            parent1 = self._replay_image(operation["parents"][0], fallback=2)
+            parent2 = self._replay_image(operation["parents"][1], fallback=1)
+            if parent1 is None or parent2 is None or parent1 == parent2:
+                return False
+            self._image_manager.create_child(parent1, parent2, int(round(operation["weight"] * 100)))
+        elif op == "select":
+            image_info = self._images.get(operation["image"])
+            if image_info is None or image_info not in self._image_manager.images:
+                return False
+            if operation["selected"]:
+                self._image_manager.select_image(image_info)
+            else:
+                self._image_manager.unselect_image(image_info)
+        elif op == "upload":
+            image_info = self._images.get(operation["image"])
+            if self._qr_blob_manager is None or image_info is None:
+                return False
+            self._qr_blob_manager.start_upload(image_info)
+        elif op == "clear":
+            self._image_manager.clear_all_images()
+        else:  # Restored and promoted images only exist in the recorded installation
+            return False
+        if self._operation_id is not None:  # Announced synchronously by the image manager
+            self._pending[self._operation_id] = (start, operation.get("result"))
+        return True
+
+    @pyqtSlot(str, object)
+    def on_operation_requested(self, op: str, parameters: dict):
+        self._operation_id = parameters.get("id")
+
+    @pyqtSlot(object)
+    def on_image_created(self, record: LineageRecord):
+        pending = self._pending.pop(record.operation_id, None)
+        if pending is None:
+            return
+        start, recorded_name = pending
+        self.latencies.append(time.monotonic() - start)
+        self._created[record.name] = recorded_name
+
+    @pyqtSlot(ImageInfo)
+    def on_image_added(self, image_info: ImageInfo):
+        if image_info.name not in self._created:
+            return
+        recorded_name = self._created.pop(image_info.name)
+        if recorded_name is not None:
+            self._images[recorded_name] = image_info
+        if self._waiting:
+            self._waiting = False
+            QTimer.singleShot(0, self._next)
+
+    def _finish_when_idle(self):
+        if self._pending or self._image_manager.is_busy:
+            QTimer.singleShot(FINISH_POLL_MS, self._finish_when_idle)
+            return
+        self._finished = time.monotonic()
+        QCoreApplication.quit()
+
+    @property
+    def elapsed(self) -> float:
+        return (self._finished or time.monotonic()) - self._start
+
+
+def format_latencies(latencies: List[float]) -> str:
+    if not latencies:
+        return "no results"
+    return (f"p50 {percentile(latencies, 0.5):.2f} s, p95 {percentile(latencies, 0.95):.2f} s, "
+            f"p99 {percentile(latencies, 0.99):.2f} s (n={len(latencies)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays recorded visitor sessions and reports latencies.")
+    parser.add_argument("sessions", nargs="+", help="Session files or folders of them")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time acceleration, 1 replays at real speed")
+    parser.add_argument("--stub", action="store_true", help="Use a stand-in instead of the image creator")
+    parser.add_argument("--stub-seconds", type=float, default=1.0, help="Render time of the stand-in")
+    parser.add_argument("--uploads", action="store_true", help="Replay QR uploads, needs the blob settings")
+    parser.add_argument("--timeout", type=float, default=3600, help="Abort after this many seconds")
+    arguments = parser.parse_args()
+
+    events = load_sessions([os.path.abspath(path) for path in arguments.sessions])
+    recorded_latencies = match_results(events)
+    os.chdir(tempfile.mkdtemp(prefix="ed_replay_"))  # Keep results and counters of the installation untouched
+    print(f"Replaying in {os.getcwd()} at {arguments.speed}x speed")
+
+    app = QCoreApplication(sys.argv)
+    backend = StubGenerationBackend(arguments.stub_seconds) if arguments.stub else None
+    image_manager = ImageManager(backend=backend)
+    prefetchers = []  # Kept referenced for the duration of the replay
+    if env_flag(CROSSOVER_PREFETCH_ENV):
+        prefetchers.append(CrossoverPrefetcher(image_manager))
+        image_manager.set_crossover_prefetcher(prefetchers[-1])
+    if env_flag(MUTATION_PREFETCH_ENV):
+        prefetchers.append(MutationPrefetcher(image_manager))
+        image_manager.set_mutation_prefetcher(prefetchers[-1])
+    qr_blob_manager = None
+    if arguments.uploads:
+        qr_blob_manager = QRBlobManager()
+
+    replay = SessionReplay(events, image_manager, arguments.speed, qr_blob_manager)
+    QTimer.singleShot(0, replay.start)
+    QTimer.singleShot(int(arguments.timeout * 1000), app.quit)
+    app.exec()
+
+    elapsed = replay.elapsed
+    print(f"Executed: {dict(replay.executed)}, skipped: {dict(replay.skipped)}")
+    print(f"Latency replayed: {format_latencies(replay.latencies)}")
+    print(f"Latency recorded: {format_latencies(recorded_latencies)}")
+    print(f"Throughput: {len(replay.latencies) / elapsed * 60:.1f} images/min over {elapsed:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,101 @@
 import os
-from urllib.error import HTTPError
+import time
 
 import requests
-from PyQt6.QtCore import QObject, QEvent, QTimer
+from PyQt6.QtCore import QObject, QEvent, QTimer, QThread, pyqtSignal, pyqtSlot
+from requests.adapters import HTTPAdapter
+
+from env_config import env_float, env_int
 
 SKLERA_TIMEOUT_MS = os.environ.get("SKLERA_TIMEOUT_MS", 30000)
 SKLERA_API_TOKEN = os.environ.get("SKLERA_API_TOKEN")
 SKLERA_SCREEN_ID = os.environ.get("SKLERA_SCREEN_ID")
 SKLERA_API_URL = os.environ.get("SKLERA_API_URL", "https://my.sklera.tv/data/api/screens/sendCmd")
+SKLERA_CONNECT_TIMEOUT_S = env_float("SKLERA_CONNECT_TIMEOUT_S", 3)
+SKLERA_READ_TIMEOUT_S = env_float("SKLERA_READ_TIMEOUT_S", 5)
+SKLERA_MAX_RETRIES = env_int("SKLERA_MAX_RETRIES", 3)
+BACKOFF_BASE_S = 0.5
 BACKOFF_FACTOR = 2
+HIDE_COMMAND = "app_show"  # Shows the Sklera app on the screen, hiding this one
+
+
+class SkleraApiClient(QObject):
+    """
+    Sends commands to the Sklera API without blocking the GUI thread.
+    Requests run in a QThread over a pooled session with connect and read timeouts. Failed attempts are
+    retried with exponential backoff (BACKOFF_BASE_S * BACKOFF_FACTOR ** attempt), the outcome is reported
+    through the commandSucceeded and commandFailed signals. Only one command is in flight at a time.
+    """
+    commandSucceeded = pyqtSignal(str)
+    commandFailed = pyqtSignal(str, str)  # Command, error message
+
+    def __init__(self, api_url: str = SKLERA_API_URL, api_token: str = SKLERA_API_TOKEN,
+                 screen_id: str = SKLERA_SCREEN_ID, timeout: tuple[float, float] = (SKLERA_CONNECT_TIMEOUT_S, SKLERA_READ_TIMEOUT_S),
+                 max_retries: int = SKLERA_MAX_RETRIES):
+        super().__init__()
+        self._api_url = api_url
+        self._screen_id = screen_id
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.headers.update({
+            "apiToken": api_token,
+            "Content-Type": "application/json"
+        })
+        self._current_thread = None
+
+    def send_command(self, cmd: str) -> bool:
+        """Sends the command in the background. Returns False if another command is still in flight."""
+        if self._current_thread is not None:
+            return False
+
+        self._current_thread = QThread()
+        current_thread = self._current_thread
+
+        def task():
+            try:
+                self._post_with_backoff(cmd)
+                self.commandSucceeded.emit(cmd)
+            except Exception as e:
+                self.commandFailed.emit(cmd, str(e))
+            finally:
+                self._current_thread = None
+                current_thread.quit()
+
+        current_thread.run = task
+        current_thread.finished.connect(current_thread.deleteLater)
+        current_thread.start()
+        return True
+
+    def _post_with_backoff(self, cmd: str):
+        payload = {
+            "id": self._screen_id,
+            "cmd": cmd
+        }
+        for attempt in range(self._max_retries + 1):
+            try:
+                response = self._session.post(self._api_url, json=payload, timeout=self._timeout)
+                response.raise_for_status()  # Raise an exception for HTTP errors
+                return
+            except requests.HTTPError as e:
+                status = e.response.status_code
+                if 400 <= status < 500 and status != 429:
+                    raise  # Client errors will not succeed on retry
+                error = e
+            except requests.RequestException as e:
+                error = e
+            if attempt == self._max_retries:
+                raise error
+            delay = BACKOFF_BASE_S * BACKOFF_FACTOR ** attempt
+            print(f"Sklera command {cmd} failed ({error}), retrying in {delay:.1f} s.")
+            time.sleep(delay)
+
+    def close(self):
+        """Closes the pooled connection, called on shutdown."""
+        self._session.close()
+
 
 class SkleraInactivityManager(QObject):
     def __init__(self):
@@ -18,45 +105,60 @@ class SkleraInactivityManager(QObject):
 
         self.timeout = int(SKLERA_TIMEOUT_MS)
         self.timer = QTimer()
+        self.timer.setSingleShot(True)
         self.timer.setInterval(self.timeout)
         self.timer.timeout.connect(self._handle_inactivity)
         self.timer.start()
+        self._last_activity = time.monotonic()
         self._currently_hidden = False
+        self._client = SkleraApiClient()
+        self._client.commandSucceeded.connect(self._on_command_succeeded)
+        self._client.commandFailed.connect(self._on_command_failed)
 
     @property
     def currently_hidden(self) -> bool:
         return self._currently_hidden
 
+    def close(self):
+        self.timer.stop()
+        self._client.close()
+
     def eventFilter(self, obj, event):
         if event.type() in (QEvent.Type.MouseMove, QEvent.Type.MouseButtonPress, QEvent.Type.KeyPress):
-            self._reset_timer()
+            self._register_activity()
         return super().eventFilter(obj, event)
 
-    def _reset_timer(self):
+    def _register_activity(self):
+        """
+        Only stores a timestamp, as this runs for every mouse move. The timer checks the timestamp when it fires
+        and is only restarted here if it was stopped after hiding the app.
+        """
+        self._last_activity = time.monotonic()
         self._currently_hidden = False
-        if self.timer.isActive():
-            self.timer.stop()
-        self.timer.start()
+        if not self.timer.isActive():
+            self.timer.start(self.timeout)
 
     def _send_sklera_hide_command(self):
-        headers = {
-            "apiToken": SKLERA_API_TOKEN,
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "id": SKLERA_SCREEN_ID,
-            "cmd": "app_show"
-        }
+        if not self._client.send_command(HIDE_COMMAND):
+            print("App hide attempt: Previous command still in progress.")
 
-        try:
-            response = requests.post(SKLERA_API_URL, json=payload, headers=headers)
-            response.raise_for_status()  # Raise an exception for HTTP errors
+    @pyqtSlot(str)
+    def _on_command_succeeded(self, cmd: str):
+        if self._currently_hidden:  # Visitor may have returned while the command was in flight
             self.timer.stop()
-            print(f"App hide attempt: Command successful.")
-        except Exception as e:
-            print(f"App hide attempt: Unexpected error occurred: {e}")
+        print(f"App hide attempt: Command successful.")
+
+    @pyqtSlot(str, str)
+    def _on_command_failed(self, cmd: str, error: str):
+        print(f"App hide attempt: Unexpected error occurred: {error}")
+        if self._currently_hidden:
+            self.timer.start(self.timeout)  # Try again after another timeout
 
     def _handle_inactivity(self):
+        remaining_ms = self.timeout - int((time.monotonic() - self._last_activity) * 1000)
+        if remaining_ms > 0:  # Activity since the timer was started
+            self.timer.start(remaining_ms)
+            return
         print("User inactive for", self.timeout / 1000, "seconds.")
         self._currently_hidden = True
         self._send_sklera_hide_command()
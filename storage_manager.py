@@ -0,0 +1,245 @@
+import os
+import shelve
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from PIL import Image, features
+from PyQt6.QtCore import QObject, QThread, QTimer
+
+from env_config import env_int, env_float
+from image_history import GENOME_FOLDER, GENOME_EXTENSION
+from image_manager import ImageInfo, ImageManager, IMAGE_LOCATION
+
+STORAGE_MAX_MB = env_int("ED_STORAGE_MAX_MB", 0)  # 0 disables the size budget
+STORAGE_MAX_IMAGES = env_int("ED_STORAGE_MAX_IMAGES", 0)  # 0 disables the count budget
+ARCHIVE_AFTER_DAYS = env_float("ED_STORAGE_ARCHIVE_AFTER_DAYS", 7)
+STORAGE_IO_LIMIT_MB_S = env_float("ED_STORAGE_IO_LIMIT_MB_S", 5)
+STORAGE_PASS_INTERVAL_MS = 30 * 60 * 1000
+BUSY_WAIT_S = 0.5
+LAST_SHOWN_INDEX = "evolutionary_diffusion_last_shown"  # Shelve of image name to last time it was shown
+ARCHIVE_LOCATION = os.path.join(IMAGE_LOCATION, "archive")
+GENOME_LOCATION = os.path.join(IMAGE_LOCATION, GENOME_FOLDER)
+ARCHIVE_FORMAT, ARCHIVE_EXTENSION = ("WEBP", ".webp") if features.check("webp") else ("JPEG", ".jpg")
+ARCHIVE_QUALITY = 90
+QR_SUFFIX = "_qr"
+MANAGED_EXTENSIONS = {".png", ARCHIVE_EXTENSION, GENOME_EXTENSION}
+ParentNames = Dict[str, Tuple[Optional[str], Optional[str]]]  # Image name to the names of its recorded parents
+
+
+def storage_budget_configured() -> bool:
+    return STORAGE_MAX_MB > 0 or STORAGE_MAX_IMAGES > 0
+
+
+def archived_path(name: str) -> str:
+    return os.path.join(ARCHIVE_LOCATION, f"{name}{ARCHIVE_EXTENSION}")
+
+
+def resolve_image_path(name: str) -> str | None:
+    """Returns the full-quality png of the image if it still exists, otherwise its archived copy or None."""
+    for path in (os.path.join(IMAGE_LOCATION, f"{name}.png"), archived_path(name)):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def restore_png(name: str) -> str | None:
+    """Returns the png path of the image, decompressing its archived copy if needed."""
+    png_path = os.path.join(IMAGE_LOCATION, f"{name}.png")
+    if not os.path.exists(png_path):
+        if not os.path.exists(archived_path(name)):
+            return None
+        with Image.open(archived_path(name)) as image:
+            image.save(png_path)
+    return png_path
+
+
+def base_name(filename: str) -> str:
+    """Name of the image a results file belongs to, QR codes belong to their source image."""
+    name = os.path.splitext(filename)[0]
+    return name[:-len(QR_SUFFIX)] if name.endswith(QR_SUFFIX) else name
+
+
+def lineage_names(images: Iterable[ImageInfo], parents: ParentNames) -> Set[str]:
+    """
+    Names of the images and all of their ancestors. Parents are followed in memory and in the recorded history, as
+    images restored from the history only know their direct parents.
+    """
+    names = set()
+    stack = list(images)
+    while stack:
+        image = stack.pop()
+        if image is None or image.name in names:
+            continue
+        names.add(base_name(image.name))
+        names.add(image.name)
+        stack.extend((image.parent1, image.parent2))
+    stack = list(names)
+    while stack:
+        for parent in parents.get(stack.pop(), ()):
+            if parent is not None and parent not in names:
+                names.add(parent)
+                stack.append(parent)
+    return names
+
+
+class StorageManager(QObject):
+    """
+    Keeps the results folder within a size and/or image count budget.
+    Images that were not shown for ARCHIVE_AFTER_DAYS are recompressed into the archive folder, when the budget
+    is still exceeded the least recently shown images are deleted. Images on screen and their ancestors are never
+    touched. Passes run in a low priority QThread, throttled to STORAGE_IO_LIMIT_MB_S and paused while images
+    are generated.
+    """
+
+    def __init__(self, image_manager: ImageManager, max_bytes: int = STORAGE_MAX_MB * 1024 * 1024,
+                 max_images: int = STORAGE_MAX_IMAGES, archive_after_days: float = ARCHIVE_AFTER_DAYS,
+                 io_limit_bytes_per_s: float = STORAGE_IO_LIMIT_MB_S * 1024 * 1024):
+        super().__init__()
+        self._image_manager = image_manager
+        self._max_bytes = max_bytes
+        self._max_images = max_images
+        self._archive_after_s = archive_after_days * 24 * 60 * 60
+        self._io_limit = io_limit_bytes_per_s
+        self._lock = threading.Lock()
+        with shelve.open(LAST_SHOWN_INDEX) as db:
+            self._last_shown: Dict[str, float] = dict(db)
+        self._current_thread = None
+        self._cancel_requested = False
+        self._image_manager.imageAdded.connect(self.mark_shown)
+        os.makedirs(ARCHIVE_LOCATION, exist_ok=True)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(STORAGE_PASS_INTERVAL_MS)
+        self._timer.timeout.connect(self.start_pass)
+        self._timer.start()
+
+    def mark_shown(self, image_info: ImageInfo):
+        with self._lock:
+            self._last_shown[base_name(image_info.name)] = time.time()
+
+    def cancel(self):
+        """Stops a running pass at the next file, called when a visitor becomes active."""
+        self._cancel_requested = True
+
+    def start_pass(self):
+        """Starts a retention and compaction pass in the background, unless one is already running."""
+        if self._current_thread is not None:
+            return
+        images = list(self._image_manager.images)
+        self._cancel_requested = False
+        self._current_thread = QThread()
+        current_thread = self._current_thread
+
+        def task():
+            try:
+                self._run_pass(images)
+            except Exception as e:
+                print("Exception in storage pass:", e)
+            finally:
+                self._current_thread = None
+                current_thread.quit()
+
+        current_thread.run = task
+        current_thread.finished.connect(current_thread.deleteLater)
+        current_thread.start(QThread.Priority.LowestPriority)
+
+    def _run_pass(self, images: List[ImageInfo]):
+        start = time.perf_counter()
+        pass_start = time.time()
+        parents = {record.name: (record.parent1, record.parent2) for record in self._image_manager.history.records()}
+        protected = lineage_names(images, parents)
+        groups = self._scan()
+        total_bytes = sum(size for files in groups.values() for size in files.values())
+        with self._lock:
+            last_shown = dict(self._last_shown)
+
+        def last_used(name):
+            return last_shown.get(name) or max(os.path.getmtime(path) for path in groups[name])
+
+        candidates = sorted((name for name in groups if name not in protected), key=last_used)
+        archived = evicted = 0
+
+        for name in candidates:
+            if self._cancel_requested:
+                break
+            if pass_start - last_used(name) < self._archive_after_s:
+                break  # Sorted by last use, all remaining images are newer
+            png_path = os.path.join(IMAGE_LOCATION, f"{name}.png")
+            if png_path in groups[name] and self._still_unused(name, pass_start, parents):
+                saved = self._archive(name, groups[name])
+                total_bytes -= saved
+                archived += 1
+                groups[name] = self._files_for(name)
+
+        for name in candidates:
+            if self._cancel_requested or not self._over_budget(total_bytes, len(groups)):
+                break
+            if not self._still_unused(name, pass_start, parents):
+                continue
+            for path, size in groups.pop(name).items():
+                self._wait_while_busy()
+                os.remove(path)
+                total_bytes -= size
+                self._throttle(size)
+            with self._lock:
+                self._last_shown.pop(name, None)
+            self._image_manager.history.remove(name)
+            evicted += 1
+
+        with self._lock, shelve.open(LAST_SHOWN_INDEX) as db:
+            db.clear()
+            db.update(self._last_shown)
+        print(f"Storage pass: archived {archived}, evicted {evicted}, {len(groups)} images using "
+              f"{total_bytes / 1024 / 1024:.1f} MB, took {time.perf_counter() - start:.1f} s"
+              + (", cancelled" if self._cancel_requested else ""))
+
+    def _scan(self) -> Dict[str, Dict[str, int]]:
+        """Groups the results, archive and genome files by image name, mapping paths to sizes."""
+        groups: Dict[str, Dict[str, int]] = {}
+        for folder in (IMAGE_LOCATION, ARCHIVE_LOCATION, GENOME_LOCATION):
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and os.path.splitext(entry.name)[1] in MANAGED_EXTENSIONS:
+                        groups.setdefault(base_name(entry.name), {})[entry.path] = entry.stat().st_size
+        return groups
+
+    def _files_for(self, name: str) -> Dict[str, int]:
+        paths = [os.path.join(IMAGE_LOCATION, f"{name}.png"), os.path.join(IMAGE_LOCATION, f"{name}{QR_SUFFIX}.png"),
+                 archived_path(name), os.path.join(GENOME_LOCATION, f"{name}{GENOME_EXTENSION}")]
+        return {path: os.path.getsize(path) for path in paths if os.path.exists(path)}
+
+    def _archive(self, name: str, files: Dict[str, int]) -> int:
+        """Recompresses the png into the archive and removes the originals, returns the bytes saved."""
+        self._wait_while_busy()
+        png_path = os.path.join(IMAGE_LOCATION, f"{name}.png")
+        with Image.open(png_path) as image:
+            image.convert("RGB").save(archived_path(name), ARCHIVE_FORMAT, quality=ARCHIVE_QUALITY)
+        read_bytes = files[png_path]
+        saved = 0
+        for path, size in files.items():
+            if os.path.dirname(path) == IMAGE_LOCATION:
+                os.remove(path)  # QR codes can be rendered again when the image is requested
+                saved += size
+        archive_size = os.path.getsize(archived_path(name))
+        self._throttle(read_bytes + archive_size)
+        return saved - archive_size
+
+    def _over_budget(self, total_bytes: int, image_count: int) -> bool:
+        return (0 < self._max_bytes < total_bytes) or (0 < self._max_images < image_count)
+
+    def _still_unused(self, name: str, pass_start: float, parents: ParentNames) -> bool:
+        """Images shown again or brought back on screen since the pass started must not be touched."""
+        with self._lock:
+            shown = self._last_shown.get(name, 0)
+        return shown < pass_start and name not in lineage_names(list(self._image_manager.images), parents)
+
+    def _wait_while_busy(self):
+        while self._image_manager.is_busy and not self._cancel_requested:
+            time.sleep(BUSY_WAIT_S)
+
+    def _throttle(self, io_bytes: int):
+        if self._io_limit > 0:
+            time.sleep(io_bytes / self._io_limit)
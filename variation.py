@@ -0,0 +1,113 @@
+import math
+import threading
+
+import torch
+from evolutionary_prompt_embedding.argument_types import PooledPromptEmbedData
+
+SPARSE_MAX_RATE = 0.05  # Above this, sampling the indices is not cheaper than a dense mask
+SAMPLING_MARGIN = 8  # Standard deviations of the binomial count covered by the first draw
+
+
+class SparseGaussianMutation:
+    """
+    Adds Gaussian noise to a random subset of a tensor's elements, each element is mutated with probability rate.
+    Statistically the same as the library's UniformGaussianMutator, but only the mutated indices are sampled:
+    gaps between them are drawn from a geometric distribution, which is an exact Bernoulli process. Noise is
+    written to a preallocated buffer and added in place to the copy that becomes the child.
+    """
+
+    def __init__(self, rate: float, strength: float, clamp_range=None):
+        self._rate = rate
+        self._strength = strength
+        self._clamp_range = clamp_range
+        self._log_keep = math.log1p(-rate) if 0 < rate < 1 else 0.0
+        self._gaps = torch.empty(0, dtype=torch.float64)  # Index sampling is tiny and always done on the CPU
+        self._noise = None
+        self._lock = threading.Lock()
+
+    def _noise_buffer(self, size: int, like: torch.Tensor) -> torch.Tensor:
+        if self._noise is None or self._noise.numel() < size or \
+                self._noise.device != like.device or self._noise.dtype != like.dtype:
+            self._noise = torch.empty(size, dtype=like.dtype, device=like.device)
+        return self._noise[:size]
+
+    def _sample_indices(self, numel: int) -> torch.Tensor:
+        expected = numel * self._rate
+        draws = int(expected + SAMPLING_MARGIN * math.sqrt(expected * (1 - self._rate))) + 16
+        if self._gaps.numel() < draws:
+            self._gaps = torch.empty(draws, dtype=torch.float64)
+        positions = []
+        offset = -1.0
+        while offset < numel - 1:
+            gaps = self._gaps[:draws].uniform_().log_().div_(self._log_keep).floor_().add_(1)
+            steps = gaps.cumsum(0).add_(offset)
+            positions.append(steps)
+            offset = steps[-1].item()
+        indices = torch.cat(positions) if len(positions) > 1 else positions[0]
+        return indices[indices < numel].long()
+
+    def mutate_(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Mutates the tensor in place and returns it."""
+        flat = tensor.view(-1)
+        with self._lock:
+            if self._rate >= 1 or self._rate > SPARSE_MAX_RATE:
+                mask = torch.rand_like(flat) < self._rate
+                flat.add_(self._noise_buffer(flat.numel(), flat).normal_(0, self._strength).mul_(mask))
+            elif self._rate > 0:
+                indices = self._sample_indices(flat.numel()).to(flat.device)
+                flat.index_add_(0, indices, self._noise_buffer(indices.numel(), flat).normal_(0, self._strength))
+        if self._clamp_range is not None:
+            tensor.clamp_(*self._clamp_range)  # Whole tensor like the library, styled genomes may be out of range
+        return tensor
+
+    def mutate(self, tensor: torch.Tensor) -> torch.Tensor:
+        return self.mutate_(tensor.clone())
+
+
+class PooledSparseMutator:
+    """Drop-in replacement for PooledUniformGaussianMutator, using a SparseGaussianMutation per embedding."""
+
+    def __init__(self, prompt_mutation: SparseGaussianMutation, pooled_mutation: SparseGaussianMutation):
+        self._prompt_mutation = prompt_mutation
+        self._pooled_mutation = pooled_mutation
+
+    def mutate(self, embeds: PooledPromptEmbedData) -> PooledPromptEmbedData:
+        return PooledPromptEmbedData(self._prompt_mutation.mutate(embeds.prompt_embeds),
+                                     self._pooled_mutation.mutate(embeds.pooled_prompt_embeds))
+
+    def mutate_(self, embeds: PooledPromptEmbedData) -> PooledPromptEmbedData:
+        """Mutates the genome in place, also works on a whole population stacked along the batch dimension."""
+        self._prompt_mutation.mutate_(embeds.prompt_embeds)
+        self._pooled_mutation.mutate_(embeds.pooled_prompt_embeds)
+        return embeds
+
+
+def pooled_sparse_mutator(rate: float, strength: float, embedding_range, pooled_embedding_range) -> PooledSparseMutator:
+    """Mutator for SDXL genomes, clamping to the value ranges of the prompt and pooled embeddings."""
+    return PooledSparseMutator(
+        SparseGaussianMutation(rate, strength, clamp_range=(embedding_range.minimum, embedding_range.maximum)),
+        SparseGaussianMutation(rate, strength,
+                               clamp_range=(pooled_embedding_range.minimum, pooled_embedding_range.maximum)))
+
+
+def interpolate(tensor1: torch.Tensor, tensor2: torch.Tensor, weight: float) -> torch.Tensor:
+    """weight * tensor1 + (1 - weight) * tensor2 without temporaries, the endpoints are exact copies."""
+    if weight >= 1:
+        return tensor1.clone()
+    if weight <= 0:
+        return tensor2.clone()
+    return torch.lerp(tensor2, tensor1, weight)
+
+
+class PooledLerpCrossover:
+    """
+    Arithmetic crossover of pooled prompt embeddings like the library's PooledArithmeticCrossover, with the
+    weight passed per call, so one instance is reused for every operation.
+    """
+
+    def crossover(self, embeds1: PooledPromptEmbedData, embeds2: PooledPromptEmbedData,
+                  weight: float, weight_pooled: float | None = None) -> PooledPromptEmbedData:
+        weight_pooled = weight if weight_pooled is None else weight_pooled
+        return PooledPromptEmbedData(interpolate(embeds1.prompt_embeds, embeds2.prompt_embeds, weight),
+                                     interpolate(embeds1.pooled_prompt_embeds, embeds2.pooled_prompt_embeds,
+                                                 weight_pooled))